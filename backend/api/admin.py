@@ -0,0 +1,166 @@
+from datetime import date, datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.exc import IntegrityError
+from ..database import database, models
+from ..services import aio, analytics_service, auth
+from ..models import schemas
+
+router = APIRouter()
+
+MAX_BULK_SIZE = 5000
+MAX_TOP_USERS = 1000
+MAX_GROUPS = 10000
+
+def bulk_response(results: list):
+    succeeded = sum(1 for result in results if result["succeeded"])
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+def check_bulk_size(count: int):
+    if count > MAX_BULK_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SIZE} rows per request")
+
+def analytics_range(start: Optional[date], end: Optional[date]):
+    try:
+        return analytics_service.date_range(start, end)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+@router.get("/admin/users", response_model=schemas.UserSearchPage)
+async def search_users(
+    q: Optional[str] = None,
+    role: Optional[schemas.UserRole] = None,
+    is_active: Optional[bool] = None,
+    min_credits: Optional[float] = None,
+    max_credits: Optional[float] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Find users by partial username or email, role, activity, balance and sign-up
+    date, newest first. `q` matches case-insensitively anywhere in either field.
+    """
+    try:
+        return await aio.search_users(
+            db, cursor=cursor, limit=limit, q=q,
+            role=models.UserRole(role.value) if role is not None else None,
+            is_active=is_active, min_credits=min_credits, max_credits=max_credits,
+            created_after=created_after, created_before=created_before
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.post("/admin/users/import", response_model=schemas.BulkResponse)
+async def import_users(
+    batch: schemas.UserImportBatch,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Create many users in one transaction, hashing their passwords in parallel.
+    """
+    check_bulk_size(len(batch.users))
+    try:
+        results = await aio.import_users(db, batch.users)
+    except IntegrityError:
+        # A concurrent registration took a name between validation and insert
+        raise HTTPException(status_code=409, detail="Conflicting registration during import, retry")
+    return bulk_response(results)
+
+@router.post("/admin/users/credits", response_model=schemas.BulkResponse)
+async def grant_credits(
+    batch: schemas.CreditGrantBatch,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    check_bulk_size(len(batch.grants))
+    return bulk_response(await aio.grant_credits(db, batch.grants, batch.description))
+
+@router.post("/admin/users/bulk-update", response_model=schemas.BulkResponse)
+async def update_users(
+    update: schemas.UserBulkUpdate,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Change the role and/or active flag of many users at once.
+    """
+    check_bulk_size(len(update.user_ids))
+    if update.role is None and update.is_active is None:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+
+    role = models.UserRole(update.role.value) if update.role is not None else None
+    return bulk_response(await aio.update_users(db, update.user_ids, role=role, is_active=update.is_active))
+
+@router.get("/admin/stats", response_model=schemas.AdminStats)
+async def get_admin_stats(
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    return await aio.get_admin_stats(db)
+
+@router.get("/admin/analytics/top-users", response_model=List[schemas.TopUser])
+async def top_users(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    metric: str = "cost",
+    limit: int = 10,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Heaviest users over [start, end), by chats, tokens or cost. Defaults to the last 30 days.
+    """
+    if metric not in ("chats", "tokens", "cost"):
+        raise HTTPException(status_code=400, detail="Unsupported metric")
+    start, end = analytics_range(start, end)
+    return await aio.top_users(db, start, end, metric=metric, limit=max(1, min(limit, MAX_TOP_USERS)))
+
+@router.get("/admin/analytics/models", response_model=List[schemas.ModelUsage])
+async def model_mix(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    start, end = analytics_range(start, end)
+    return await aio.model_mix(db, start, end)
+
+@router.get("/admin/analytics/revenue", response_model=schemas.RevenueReport)
+async def revenue(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "day",
+    current_user: auth.Principal = Depends(auth.get_current_admin_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Credits spent on chats over [start, end), per day or per subscription plan.
+    """
+    if group_by not in ("day", "plan"):
+        raise HTTPException(status_code=400, detail="Unsupported grouping")
+    start, end = analytics_range(start, end)
+    return await aio.revenue(db, start, end, group_by=group_by)
+
+@router.get("/admin/analytics/group-by")
+async def group_chats(
+    by: List[schemas.AnalyticsDimension] = Query([]),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = 1000,
+    current_user: auth.Principal = Depends(auth.get_current_admin_user)
+):
+    """
+    Chats, tokens and cost of the chats created in [start, end), grouped by any of
+    user_id, model_name, day and hour (`by` may be repeated), highest cost first.
+    Scans the chats themselves, so only months still in the database are covered.
+    """
+    if not by:
+        raise HTTPException(status_code=400, detail="Group by at least one dimension")
+    start, end = analytics_range(start, end)
+    dimensions = list(dict.fromkeys(dimension.value for dimension in by))
+    return await aio.group_chats(start, end, dimensions, max(1, min(limit, MAX_GROUPS)))
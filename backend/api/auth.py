@@ -1,9 +1,10 @@
-from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 from ..database import database
-from ..services import auth, user_service
+from ..services import aio, auth, export_service
 from ..models import schemas
 
 router = APIRouter()
@@ -11,74 +12,119 @@ router = APIRouter()
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await aio.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return await aio.create_token_pair(db, user.id)
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(
+    request: schemas.RefreshTokenRequest,
+    db = Depends(database.get_async_db)
+):
+    tokens = await aio.rotate_refresh_token(db, request.refresh_token)
+    if not tokens:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return tokens
+
+@router.post("/logout")
+async def logout(
+    request: schemas.RefreshTokenRequest,
+    token: str = Depends(auth.oauth2_scheme),
+    db = Depends(database.get_async_db)
+):
+    await aio.revoke_access_token(db, token)
+    await aio.revoke_refresh_token(db, request.refresh_token)
+    return {"message": "Logged out"}
 
 @router.post("/register", response_model=schemas.UserResponse)
-def register_user(
+async def register_user(
     user: schemas.UserCreate,
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    db_user = user_service.get_user_by_username(db, username=user.username)
+    db_user = await aio.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user = user_service.get_user_by_email(db, email=user.email)
+    db_user = await aio.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    return user_service.create_user(db=db, user=user)
+    return await aio.create_user(db=db, user=user)
 
 @router.get("/users/me", response_model=schemas.UserResponse)
-async def read_users_me(current_user: schemas.UserResponse = Depends(auth.get_current_active_user)):
-    return current_user
+async def read_users_me(
+    current_user: auth.Principal = Depends(auth.get_current_active_user),
+    db = Depends(database.get_async_db)
+):
+    # The principal is a cached snapshot; profile fields such as credits are read fresh
+    return await aio.get_user_by_id(db, current_user.id)
 
 @router.put("/users/me", response_model=schemas.UserResponse)
 async def update_user_me(
     user_update: schemas.UserUpdate,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    return user_service.update_user(db, current_user.id, user_update)
+    return await aio.update_user(db, current_user.id, user_update)
 
 @router.get("/users/me/balance")
 async def get_user_balance(
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    balance = user_service.get_user_balance(db, current_user.id)
+    balance = await aio.get_user_balance(db, current_user.id)
     return {"balance": balance}
 
-@router.get("/users/me/transactions")
+@router.get("/users/me/transactions", response_model=schemas.TransactionPage)
 async def get_user_transactions(
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    transactions = user_service.get_user_transactions(db, current_user.id, skip=skip, limit=limit)
-    return transactions
+    try:
+        return await aio.get_user_transactions(db, current_user.id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/users/me/transactions/export")
+async def export_user_transactions(
+    fmt: str = Query("ndjson", alias="format"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
+):
+    """
+    Stream the user's full transaction ledger as NDJSON or CSV.
+    """
+    if fmt not in export_service.EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    
+    return StreamingResponse(
+        export_service.stream_transactions(current_user.id, fmt, start=start, end=end),
+        media_type=export_service.EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=transactions.{fmt}"}
+    )
 
 @router.post("/users/me/add-credits")
 async def add_credits(
     amount: float,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    user = user_service.add_credits(db, current_user.id, amount)
+    user = await aio.add_credits(db, current_user.id, amount)
     return {"message": f"Added {amount} credits", "new_balance": user.credits}
\ No newline at end of file
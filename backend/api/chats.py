@@ -1,18 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from ..database import database
-from ..services import chat_service, auth
+from ..services import aio, auth, catalog, export_service
+from ..money import from_micros
 from ..models import schemas
 
 router = APIRouter()
 
+MAX_CHAT_BATCH_SIZE = 5000
+
 @router.post("/chats", response_model=schemas.ChatResponse)
-def create_chat(
+async def create_chat(
     chat: schemas.ChatCreate,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    chat_record, error = chat_service.process_chat_request(
+    chat_record, error = await aio.process_chat_request(
         db, current_user.id, chat.model_name, chat.input_tokens, chat.output_tokens
     )
     
@@ -21,22 +26,105 @@ def create_chat(
     
     return chat_record
 
-@router.get("/chats")
-def get_user_chats(
-    skip: int = 0,
+@router.post("/chats/batch", response_model=schemas.ChatBatchResponse)
+async def create_chat_batch(
+    batch: schemas.ChatBatchCreate,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Record a buffered batch of chats from the gateway in one transaction.
+    """
+    # Only the gateway's admin account can record chats on behalf of users
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if len(batch.records) > MAX_CHAT_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CHAT_BATCH_SIZE} records per batch")
+    
+    results = await aio.process_chat_batch(db, batch.records)
+    accepted = sum(1 for result in results if result["accepted"])
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+@router.post("/chats/reservations", response_model=schemas.ChatReservationResponse)
+async def reserve_chat_credits(
+    reservation: schemas.ChatReservationCreate,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
+    db = Depends(database.get_async_db)
+):
+    """
+    Admit a streaming chat and hold its estimated cost until it is settled.
+    """
+    result, error = await aio.reserve_credits(
+        db, current_user.id, reservation.model_name, reservation.input_tokens, reservation.output_tokens
+    )
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    
+    return result
+
+@router.post("/chats/reservations/{reservation_id}/settle")
+async def settle_chat_reservation(
+    reservation_id: str,
+    settlement: schemas.ChatSettlementCreate,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
+    db = Depends(database.get_async_db)
+):
+    cost = await aio.settle_reservation(
+        db, current_user.id, reservation_id, settlement.input_tokens, settlement.output_tokens
+    )
+    if cost is None:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    
+    return {"reservation_id": reservation_id, "cost": from_micros(cost)}
+
+@router.delete("/chats/reservations/{reservation_id}")
+async def release_chat_reservation(
+    reservation_id: str,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
+):
+    if not await aio.release_reservation(current_user.id, reservation_id):
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    
+    return {"message": "Reservation released"}
+
+@router.get("/chats", response_model=schemas.ChatPage)
+async def get_user_chats(
+    cursor: Optional[str] = None,
     limit: int = 100,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    return chat_service.get_user_chats(db, current_user.id, skip=skip, limit=limit)
+    try:
+        return await aio.get_user_chats(db, current_user.id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/chats/export")
+async def export_user_chats(
+    fmt: str = Query("ndjson", alias="format"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
+):
+    """
+    Stream the user's full chat history as NDJSON or CSV.
+    """
+    if fmt not in export_service.EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    
+    return StreamingResponse(
+        export_service.stream_chats(current_user.id, fmt, start=start, end=end),
+        media_type=export_service.EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=chats.{fmt}"}
+    )
 
 @router.get("/chats/{chat_id}", response_model=schemas.ChatResponse)
-def get_chat(
+async def get_chat(
     chat_id: int,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    chat = chat_service.get_chat(db, chat_id)
+    chat = await aio.get_chat(db, chat_id)
     if chat is None:
         raise HTTPException(status_code=404, detail="Chat not found")
     
@@ -47,59 +135,61 @@ def get_chat(
     return chat
 
 @router.get("/users/me/chat-statistics")
-def get_chat_statistics(
+async def get_chat_statistics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
-    return chat_service.get_chat_statistics(db, current_user.id)
+    return await aio.get_chat_statistics(db, current_user.id, start=start, end=end)
 
 @router.get("/models")
-def get_available_models(
-    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+async def get_available_models(
+    request: Request,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user)
 ):
     """
     Get list of available models for the current user based on their subscription.
     """
-    from ..services.subscription_service import get_user_subscription
-    
-    subscription = get_user_subscription(db, current_user.id)
-    
-    # Base models available to all users
-    available_models = [
-        {"name": "gpt-3.5-turbo", "description": "GPT-3.5 Turbo model", "requires_vip": False},
-        {"name": "llama-2", "description": "Llama 2 model", "requires_vip": False}
-    ]
-    
-    # Add VIP models if user has VIP subscription
-    if subscription and subscription.plan.can_access_vip_models:
-        available_models.extend([
-            {"name": "gpt-4", "description": "GPT-4 model", "requires_vip": True},
-            {"name": "vip-gpt-4", "description": "VIP GPT-4 model", "requires_vip": True}
-        ])
-    
-    # Add admin models if user is admin
-    if current_user.role == "admin":
-        available_models.append({
-            {"name": "admin-gpt-4", "description": "Admin GPT-4 model", "requires_vip": False}
-        })
+    # The list only depends on the principal's role and plan capability, each variant is pre-rendered
+    body, etag = catalog.MODEL_LISTINGS[(current_user.role == "admin", current_user.can_access_vip_models)]
+    return catalog.cached_json_response(request, body, etag, private=True)
+
+@router.post("/model-prices", response_model=schemas.ModelPriceResponse)
+async def create_model_price(
+    price: schemas.ModelPriceCreate,
+    current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
+    db = Depends(database.get_async_db)
+):
+    # Only admins can change prices
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    return available_models
+    try:
+        return await aio.create_model_price(db=db, price=price)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-@router.get("/users/me/rate-limit-status")
-def get_rate_limit_status(
+@router.get("/model-prices", response_model=List[schemas.ModelPriceResponse])
+async def get_model_prices(
+    skip: int = 0,
+    limit: int = 100,
+    db = Depends(database.get_async_db)
+):
+    return await aio.get_model_prices(db, skip=skip, limit=limit)
+
+@router.get("/users/me/rate-limit-status", response_model=schemas.RateLimitStatusResponse)
+async def get_rate_limit_status(
     current_user: schemas.UserResponse = Depends(auth.get_current_active_user),
-    db: Session = Depends(database.get_db)
+    db = Depends(database.get_async_db)
 ):
     """
     Get current rate limit status for the user.
     """
-    from ..services.subscription_service import get_subscription_usage
-    
-    usage = get_subscription_usage(db, current_user.id)
+    usage = await aio.get_subscription_usage(db, current_user.id)
     
     # Check if user can send more chats
-    can_send = chat_service.can_send_chat(db, current_user.id)
+    can_send = await aio.can_send_chat(db, current_user.id)
     
     return {
         "chats_this_hour": usage["chats_this_hour"],
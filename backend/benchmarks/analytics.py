@@ -0,0 +1,137 @@
+"""
+Latency benchmark for the admin usage analytics.
+
+Compares the top-users and model-mix reports read from the daily_usage rollup
+with the same aggregates computed over the chats table, and the NumPy columnar
+group-by of analytics_service.group_chats with a per-row Python dictionary
+aggregation of the same chats, end to end and for the aggregation alone.
+
+Run from the repository root:
+    python -m backend.benchmarks.analytics
+"""
+import os
+import random
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from datetime import datetime, time as day_start, timedelta
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from ..database import models
+from ..services import analytics_service
+from ..services.usage_service import backfill_daily_usage
+
+ITERATIONS = 5
+USERS = 200
+CHATS = 500000
+DAYS = 90
+RANGE_DAYS = 30
+MODELS = ("gpt-3.5-turbo", "gpt-4", "llama-2", "vip-gpt-4")
+
+def setup_database():
+    engine = create_engine(
+        os.environ["DATABASE_URL"],
+        connect_args={"check_same_thread": False} if os.environ["DATABASE_URL"].startswith("sqlite") else {},
+        poolclass=StaticPool if os.environ["DATABASE_URL"].startswith("sqlite") else None
+    )
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    db.execute(models.User.__table__.insert(), [
+        {"username": f"bench{i}", "email": f"bench{i}@example.com", "hashed_password": "x"} for i in range(USERS)
+    ])
+    random.seed(0)
+    started = datetime.combine(datetime.utcnow().date() - timedelta(days=DAYS - 1), day_start())
+    rows = [
+        {
+            "user_id": random.randint(1, USERS),
+            "model_name": random.choice(MODELS),
+            "input_tokens": 100,
+            "output_tokens": 200,
+            "cost_micros": random.randrange(1000, 100000),
+            "created_at": started + timedelta(seconds=random.randrange(DAYS * 86400))
+        }
+        for _ in range(CHATS)
+    ]
+    db.execute(models.Chat.__table__.insert(), rows)
+    backfill_daily_usage(db)
+    db.commit()
+    db.close()
+    return session_factory
+
+def scan_top_users(db, start, end, metric="cost", limit=10):
+    return db.execute(
+        select(models.Chat.user_id, func.sum(models.Chat.cost_micros).label("cost_micros")).where(
+            models.Chat.created_at >= datetime.combine(start, day_start()),
+            models.Chat.created_at < datetime.combine(end, day_start())
+        ).group_by(models.Chat.user_id).order_by(func.sum(models.Chat.cost_micros).desc()).limit(limit)
+    ).all()
+
+def scan_model_mix(db, start, end):
+    return db.execute(
+        select(models.Chat.model_name, func.count(models.Chat.id), func.sum(models.Chat.cost_micros)).where(
+            models.Chat.created_at >= datetime.combine(start, day_start()),
+            models.Chat.created_at < datetime.combine(end, day_start())
+        ).group_by(models.Chat.model_name)
+    ).all()
+
+def python_group_chats(db, start, end, by, limit=1000):
+    groups = {}
+    for user_id, model_name, created_at, tokens, cost_micros in db.connection().execute(
+        analytics_service.chat_rows(start, end)
+    ):
+        values = {"user_id": user_id, "model_name": model_name, "day": created_at.date()}
+        key = tuple(values[name] for name in by)
+        chats, total_tokens, cost = groups.get(key, (0, 0, 0))
+        groups[key] = (chats + 1, total_tokens + tokens, cost + cost_micros)
+    return sorted(groups.items(), key=lambda item: -item[1][2])[:limit]
+
+def numpy_aggregate(chunks, by):
+    model_codes = {}
+    for rows in chunks:
+        columns, values = analytics_service.chat_columns(rows, by, model_codes)
+        analytics_service.aggregate_columns(columns, by, values)
+
+def python_aggregate(chunks, by):
+    groups = {}
+    for rows in chunks:
+        for user_id, model_name, created_at, tokens, cost_micros in rows:
+            values = {"user_id": user_id, "model_name": model_name, "day": created_at.date()}
+            key = tuple(values[name] for name in by)
+            chats, total_tokens, cost = groups.get(key, (0, 0, 0))
+            groups[key] = (chats + 1, total_tokens + tokens, cost + cost_micros)
+
+def run(name, fn, *args, **kwargs):
+    db = session_factory()
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn(db, *args, **kwargs)
+    elapsed = time.perf_counter() - started
+    db.close()
+    print(f"{name:<24} {elapsed / ITERATIONS * 1000:>10.2f} ms")
+
+if __name__ == "__main__":
+    session_factory = setup_database()
+    end = datetime.utcnow().date() + timedelta(days=1)
+    start = end - timedelta(days=RANGE_DAYS)
+    print(f"{CHATS} chats of {USERS} users over {DAYS} days, reports over the last {RANGE_DAYS}")
+    run("top users (rollup)", analytics_service.top_users, start, end)
+    run("top users (chat scan)", scan_top_users, start, end)
+    run("model mix (rollup)", analytics_service.model_mix, start, end)
+    run("model mix (chat scan)", scan_model_mix, start, end)
+    run("group-by (NumPy)", analytics_service.group_chats, start, end, ["user_id", "day"])
+    run("group-by (Python)", python_group_chats, start, end, ["user_id", "day"])
+
+    # The same aggregations over chats already fetched, without the database read both pay
+    db = session_factory()
+    chunks = list(db.connection().execute(analytics_service.chat_rows(start, end)).partitions())
+    db.close()
+    for name, aggregate in (("aggregation (NumPy)", numpy_aggregate), ("aggregation (Python)", python_aggregate)):
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            aggregate(chunks, ["user_id", "model_name", "day"])
+        print(f"{name:<24} {(time.perf_counter() - started) / ITERATIONS * 1000:>10.2f} ms")
@@ -0,0 +1,96 @@
+"""
+Bulk admin operations versus the per-user service path.
+
+For USERS accounts, times and counts the statements of user creation, credit
+grants and deactivation, once through the single-user service functions (one
+lookup and commit per user, as looping the per-user endpoints does) and once
+through admin_service's set-based bulk operations. Password hashing is timed
+separately, sequentially and on the password worker pool; the database runs
+reuse one precomputed hash so they measure the SQL alone.
+
+Run from the repository root:
+    python -m backend.benchmarks.bulk_users
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+# Cheaper than the production cost so the run stays short; the ratios are what matter
+os.environ.setdefault("BCRYPT_ROUNDS", "10")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from ..database import models
+from ..models import schemas
+from ..services import admin_service, auth, user_service
+from ..services.password_hasher import password_hasher
+from .chat_admission import QueryCounter
+
+USERS = 2000
+HASHES = 32
+
+def setup_database():
+    engine = create_engine(
+        os.environ["DATABASE_URL"],
+        connect_args={"check_same_thread": False} if os.environ["DATABASE_URL"].startswith("sqlite") else {},
+        poolclass=StaticPool if os.environ["DATABASE_URL"].startswith("sqlite") else None
+    )
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def per_user(db, users, hashed_password):
+    user_ids = [user_service.create_user(db, user, hashed_password).id for user in users]
+    for user_id in user_ids:
+        user_service.add_credits(db, user_id, 10)
+    for user_id in user_ids:
+        db_user = user_service.get_user_by_id(db, user_id)
+        db_user.is_active = False
+        db.commit()
+
+def bulk(db, users, hashed_password):
+    results = admin_service.import_users(db, users, [hashed_password] * len(users))
+    user_ids = [result["user_id"] for result in results]
+    admin_service.grant_credits(
+        db, [schemas.CreditGrant(user_id=user_id, amount=10) for user_id in user_ids], "Promotion"
+    )
+    admin_service.update_users(db, user_ids, is_active=False)
+
+def run(name, fn, hashed_password):
+    engine, session_factory = setup_database()
+    counter = QueryCounter(engine)
+    users = [
+        schemas.UserImportItem(username=f"tenant{n}", email=f"tenant{n}@example.com", password="secret")
+        for n in range(USERS)
+    ]
+    db = session_factory()
+    started = time.perf_counter()
+    fn(db, users, hashed_password)
+    elapsed = time.perf_counter() - started
+    assert db.query(models.User).filter(models.User.is_active == False).count() == USERS
+    db.close()
+    print(f"{name:<12} {counter.statements:>8} queries {elapsed:>8.2f} s {USERS / elapsed:>10.0f} users/s")
+
+async def run_hashing():
+    passwords = [f"secret{n}" for n in range(HASHES)]
+    started = time.perf_counter()
+    for password in passwords:
+        auth.get_password_hash(password)
+    sequential = time.perf_counter() - started
+    started = time.perf_counter()
+    await password_hasher.hash_many(passwords)
+    pooled = time.perf_counter() - started
+    password_hasher.shutdown()
+    print(
+        f"{HASHES} password hashes: sequential {HASHES / sequential:.1f}/s, "
+        f"worker pool ({password_hasher.workers} threads) {HASHES / pooled:.1f}/s"
+    )
+
+if __name__ == "__main__":
+    hashed_password = auth.get_password_hash("secret")
+    print(f"{USERS} users: create, grant credits, deactivate")
+    run("per-user", per_user, hashed_password)
+    run("bulk", bulk, hashed_password)
+    asyncio.run(run_hashing())
@@ -0,0 +1,117 @@
+"""
+Queries-per-request benchmark for chat admission.
+
+Compares the legacy check chain (can_access_model, can_send_chat,
+get_user_balance, deduct_credits, create_chat) with admission_service.admit_chat
+and with the same chats submitted as one admission_service.admit_chat_batch.
+
+Run from the repository root:
+    python -m backend.benchmarks.chat_admission
+"""
+import os
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from ..database import models
+from ..models import schemas
+from ..services import admission_service, chat_service, subscription_service, user_service
+from ..money import from_micros
+from ..services.pricing_engine import pricing_engine
+
+ITERATIONS = 200
+HISTORY_CHATS = 2000
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.statements = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+def setup_database():
+    engine = create_engine(
+        os.environ["DATABASE_URL"],
+        connect_args={"check_same_thread": False} if os.environ["DATABASE_URL"].startswith("sqlite") else {},
+        poolclass=StaticPool if os.environ["DATABASE_URL"].startswith("sqlite") else None
+    )
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    plan = models.SubscriptionPlan(
+        name="bench", price_micros=0, duration_days=30,
+        max_chats_per_hour=10 ** 9, max_tokens_per_month=10 ** 12, can_access_vip_models=True
+    )
+    user = models.User(username="bench", email="bench@example.com", hashed_password="x", credits_micros=10 ** 15)
+    db.add_all([plan, user])
+    db.flush()
+    db.add(models.Subscription(
+        user_id=user.id, plan_id=plan.id,
+        start_date=datetime.utcnow(), end_date=datetime.utcnow() + timedelta(days=30), is_active=True
+    ))
+    db.add_all([
+        models.Chat(user_id=user.id, model_name="gpt-4", input_tokens=100, output_tokens=200, cost_micros=15000)
+        for _ in range(HISTORY_CHATS)
+    ])
+    db.commit()
+    user_id = user.id
+    db.close()
+    # Price from the benchmark database rather than the configured one
+    pricing_engine.session_factory = session_factory
+    pricing_engine.invalidate()
+    return engine, session_factory, user_id
+
+def legacy_chain(db, user_id, model_name, input_tokens, output_tokens):
+    if not subscription_service.can_access_model(db, user_id, model_name):
+        return None, "Access denied"
+    if not subscription_service.can_send_chat(db, user_id):
+        return None, "Rate limit exceeded"
+    cost = from_micros(chat_service.calculate_chat_cost(input_tokens, output_tokens, model_name))
+    balance = user_service.get_user_balance(db, user_id)
+    if balance is None or balance < cost:
+        return None, "Insufficient credits"
+    user_service.deduct_credits(db, user_id, cost, f"Chat with {model_name}")
+    chat = schemas.ChatCreate(model_name=model_name, input_tokens=input_tokens, output_tokens=output_tokens, cost=cost)
+    return chat_service.create_chat(db, chat, user_id), None
+
+def run(name, fn):
+    engine, session_factory, user_id = setup_database()
+    counter = QueryCounter(engine)
+    db = session_factory()
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        chat, error = fn(db, user_id, "gpt-4", 100, 200)
+        assert error is None, error
+        # Touch the fields the API response serializes
+        chat.id, chat.cost, chat.created_at
+    elapsed = time.perf_counter() - started
+    db.close()
+    print(f"{name:<12} {counter.statements / ITERATIONS:>8.1f} queries/request {elapsed / ITERATIONS * 1000:>8.2f} ms/request")
+
+def run_batch(name):
+    engine, session_factory, user_id = setup_database()
+    counter = QueryCounter(engine)
+    db = session_factory()
+    records = [
+        schemas.ChatUsageRecord(user_id=user_id, model_name="gpt-4", input_tokens=100, output_tokens=200)
+        for _ in range(ITERATIONS)
+    ]
+    started = time.perf_counter()
+    results = admission_service.admit_chat_batch(db, records)
+    elapsed = time.perf_counter() - started
+    assert all(result["accepted"] for result in results)
+    db.close()
+    print(f"{name:<12} {counter.statements / ITERATIONS:>8.1f} queries/request {elapsed / ITERATIONS * 1000:>8.2f} ms/request")
+
+if __name__ == "__main__":
+    print(f"{ITERATIONS} admissions against {HISTORY_CHATS} chats of history")
+    run("legacy", legacy_chain)
+    run("admission", admission_service.admit_chat)
+    run_batch("batch")
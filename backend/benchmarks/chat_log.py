@@ -0,0 +1,151 @@
+"""
+Throughput benchmark for write-behind chat recording.
+
+Admits the same chats from concurrent threads against a file-backed SQLite
+database, once with admission_service.admit_chat, which commits every chat,
+and then with admission_service.admit_chat_deferred and the write-behind
+chat log at several flush batch sizes. A chat counts as done once it would
+be acknowledged: committed, or journaled and fsynced. The queued chats are
+flushed before the clock stops, so both sides end with everything written.
+
+Run from the repository root:
+    python -m backend.benchmarks.chat_log
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from ..database import models
+from ..services import admission_service
+from ..services.chat_log import CHAT_FLUSH_INTERVAL_MS, ChatLog
+from ..services.pricing_engine import pricing_engine
+
+THREADS = 16
+CHATS = 4000
+USERS = 50
+BATCH_SIZES = (100, 1000)
+
+def setup_database(directory):
+    engine = create_engine(
+        f"sqlite:///{os.path.join(directory, 'bench.db')}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+        pool_size=THREADS + 1
+    )
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    plan = models.SubscriptionPlan(
+        name="bench", price_micros=0, duration_days=30,
+        max_chats_per_hour=10 ** 9, max_tokens_per_month=10 ** 12, can_access_vip_models=True
+    )
+    db.add(plan)
+    db.flush()
+    now = datetime.utcnow()
+    for index in range(USERS):
+        user = models.User(
+            username=f"bench{index}", email=f"bench{index}@example.com", hashed_password="x",
+            credits_micros=10 ** 15, created_at=now
+        )
+        db.add(user)
+        db.flush()
+        db.add(models.Subscription(
+            user_id=user.id, plan_id=plan.id, start_date=now, end_date=now + timedelta(days=30), is_active=True
+        ))
+    db.commit()
+    user_ids = [user_id for user_id, in db.execute(select(models.User.id))]
+    db.close()
+    # Price from the benchmark database rather than the configured one
+    pricing_engine.session_factory = session_factory
+    pricing_engine.invalidate()
+    return engine, session_factory, user_ids
+
+def admit_all(session_factory, user_ids, admit):
+    def worker(offset):
+        db = session_factory()
+        try:
+            for index in range(offset, CHATS, THREADS):
+                admit(db, user_ids[index % len(user_ids)])
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(worker, range(THREADS)))
+
+def run_sync(directory):
+    engine, session_factory, user_ids = setup_database(directory)
+
+    def admit(db, user_id):
+        chat, error = admission_service.admit_chat(db, user_id, "gpt-4", 100, 200)
+        assert error is None, error
+
+    started = time.perf_counter()
+    admit_all(session_factory, user_ids, admit)
+    elapsed = time.perf_counter() - started
+    report("commit per chat", engine, elapsed)
+
+def run_write_behind(directory, batch_size):
+    from ..services import chat_log as chat_log_module
+
+    engine, session_factory, user_ids = setup_database(directory)
+    log = ChatLog(os.path.join(directory, "journal"), batch_size=batch_size, max_queued=CHATS)
+    # admit_chat_deferred uses the module's log
+    chat_log_module.chat_log = log
+
+    def flush():
+        db = session_factory()
+        try:
+            return log.flush(db)
+        finally:
+            db.close()
+
+    def admit(db, user_id):
+        chat, error, ticket = admission_service.admit_chat_deferred(db, user_id, "gpt-4", 100, 200)
+        assert error is None, error
+        log.wait_durable(ticket)
+
+    # Stands in for the background flusher: full batches right away, the rest every interval
+    done = threading.Event()
+
+    def flusher():
+        last = time.perf_counter()
+        while not done.is_set():
+            if log.stats()["sealed_segments"] or time.perf_counter() - last >= CHAT_FLUSH_INTERVAL_MS / 1000:
+                flush()
+                last = time.perf_counter()
+            else:
+                time.sleep(0.001)
+
+    thread = threading.Thread(target=flusher)
+    started = time.perf_counter()
+    thread.start()
+    admit_all(session_factory, user_ids, admit)
+    done.set()
+    thread.join()
+    flush()
+    elapsed = time.perf_counter() - started
+    report(f"write-behind {batch_size}", engine, elapsed)
+
+def report(name, engine, elapsed):
+    with engine.connect() as connection:
+        chats = connection.execute(select(func.count(models.Chat.id))).scalar()
+    engine.dispose()
+    assert chats == CHATS, chats
+    print(f"{name:<20} {CHATS / elapsed:>10.0f} chats/s {elapsed / CHATS * 1000:>8.3f} ms/chat")
+
+if __name__ == "__main__":
+    print(f"{CHATS} chats for {USERS} users from {THREADS} threads, file-backed SQLite")
+    for batch_size in (None,) + BATCH_SIZES:
+        directory = tempfile.mkdtemp(prefix="chat_log_bench")
+        try:
+            if batch_size is None:
+                run_sync(directory)
+            else:
+                run_write_behind(directory, batch_size)
+        finally:
+            shutil.rmtree(directory)
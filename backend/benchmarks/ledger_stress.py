@@ -0,0 +1,122 @@
+"""
+Concurrency stress test for credit changes.
+
+THREADS workers hammer one account with random debits and deposits, first through
+the legacy read-modify-write deduct/add (load the user, compare and mutate in
+Python, commit) and then through services.ledger. After each run the final
+balance is reconciled against the applied changes and the transaction ledger.
+
+Run from the repository root (SQLite by default; point DATABASE_URL at
+PostgreSQL to exercise the single-statement path):
+    python -m backend.benchmarks.ledger_stress
+"""
+import os
+import random
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "ledger_stress.db"))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from ..database import models
+from ..services import ledger
+from ..money import from_micros
+
+THREADS = 32
+OPERATIONS = 200
+# Micro-credits
+INITIAL_CREDITS = 500000000
+
+def setup_database():
+    url = os.environ["DATABASE_URL"]
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": 60} if url.startswith("sqlite") else {},
+        pool_size=THREADS,
+        max_overflow=0
+    )
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    user = models.User(username="stress", email="stress@example.com", hashed_password="x", credits_micros=INITIAL_CREDITS)
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+    return session_factory, user_id
+
+def legacy_change(db, user_id, amount):
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if amount < 0 and user.credits_micros < -amount:
+        return False
+    user.credits_micros += amount
+    db.add(models.Transaction(
+        user_id=user_id,
+        amount_micros=amount,
+        transaction_type=models.TransactionType.WITHDRAWAL if amount < 0 else models.TransactionType.DEPOSIT,
+        balance_after_micros=user.credits_micros
+    ))
+    db.commit()
+    return True
+
+def ledger_change(db, user_id, amount):
+    transaction_type = models.TransactionType.WITHDRAWAL if amount < 0 else models.TransactionType.DEPOSIT
+    if ledger.apply_credit_change(db, user_id, amount, transaction_type) is None:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def run(name, change):
+    session_factory, user_id = setup_database()
+    applied = []
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        db = session_factory()
+        try:
+            for _ in range(OPERATIONS):
+                # Debit-heavy so the balance keeps hitting zero
+                amount = rng.randint(1, 5) * 1000000 * (-1 if rng.random() < 0.7 else 1)
+                try:
+                    if change(db, user_id, amount):
+                        applied.append(amount)
+                except Exception as exc:
+                    db.rollback()
+                    errors.append(type(exc).__name__)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    db = session_factory()
+    balance = db.query(models.User.credits_micros).filter(models.User.id == user_id).scalar()
+    ledger_total = db.query(func.coalesce(func.sum(models.Transaction.amount_micros), 0)).scalar()
+    lowest = db.query(func.min(models.Transaction.balance_after_micros)).scalar()
+    db.close()
+
+    expected = INITIAL_CREDITS + sum(applied)
+    print(
+        f"{name:<8} {len(applied):>6} applied {len(errors):>5} errors {elapsed:>7.2f} s  "
+        f"balance {from_micros(balance):>8.1f} expected {from_micros(expected):>8.1f} "
+        f"ledger {from_micros(INITIAL_CREDITS + ledger_total):>8.1f} lowest {from_micros(lowest or 0):>7.1f}"
+    )
+    return balance == expected == INITIAL_CREDITS + ledger_total and balance >= 0 and (lowest is None or lowest >= 0)
+
+if __name__ == "__main__":
+    print(f"{THREADS} threads x {OPERATIONS} changes against one account")
+    legacy_ok = run("legacy", legacy_change)
+    ledger_ok = run("ledger", ledger_change)
+    print(f"legacy consistent: {legacy_ok}, ledger consistent: {ledger_ok}")
+    assert ledger_ok, "ledger lost an update or overdrew the account"
@@ -0,0 +1,137 @@
+"""
+Concurrent-client load test against a running API server.
+
+Seed a database and start the server in the mode under test, for example:
+    python -m backend.benchmarks.seed
+    METRICS_DEBUG=true USE_ASYNC_DB=false uvicorn backend.main:app --port 8000
+    METRICS_DEBUG=true USE_ASYNC_DB=true  uvicorn backend.main:app --port 8000
+
+then, from the repository root:
+    python -m backend.benchmarks.load_test
+    python -m backend.benchmarks.load_test --username alice --password secret --paths /api/v1/users/me
+
+Clients log in as --users seeded accounts (user0, user1, ...) or as --username.
+Each concurrency level opens that many clients which cycle through the scenario
+for --duration seconds. Throughput, latency percentiles and, when the server
+runs with METRICS_DEBUG=true, database statements per request are printed per
+endpoint. "token" in --paths stands for a password login.
+"""
+import argparse
+import asyncio
+import time
+import httpx
+
+DEFAULT_PATHS = [
+    "token",
+    "/api/v1/users/me",
+    "/api/v1/chats?limit=20",
+    "/api/v1/users/me/chat-statistics",
+    "/api/v1/users/me/subscription/usage",
+    "/api/v1/models"
+]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def login(client, username, password):
+    response = await client.post("/api/v1/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.queries = []
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "throughput": len(latencies) / elapsed,
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "queries": sum(self.queries) / len(self.queries) if self.queries else None
+        }
+
+async def worker(client, account, password, paths, offset, deadline, stats):
+    username, token = account
+    headers = {"Authorization": f"Bearer {token}"}
+    index = offset
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if path == "token":
+                response = await client.post("/api/v1/token", data={"username": username, "password": password})
+            else:
+                response = await client.get(path, headers=headers)
+        except httpx.HTTPError:
+            stats[path].errors += 1
+            continue
+        if response.status_code >= 400:
+            stats[path].errors += 1
+            continue
+        stats[path].latencies.append(time.perf_counter() - started)
+        if "x-db-queries" in response.headers:
+            stats[path].queries.append(int(response.headers["x-db-queries"]))
+
+async def run_level(base_url, accounts, password, paths, concurrency, duration):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    stats = {path: EndpointStats() for path in paths}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        # Clients start at different points of the scenario so every endpoint is hit concurrently
+        await asyncio.gather(*(
+            worker(client, accounts[n % len(accounts)], password, paths, n, deadline, stats)
+            for n in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    total = EndpointStats()
+    for endpoint in stats.values():
+        total.latencies.extend(endpoint.latencies)
+        total.errors += endpoint.errors
+        total.queries.extend(endpoint.queries)
+    results = {path: endpoint.summary(elapsed) for path, endpoint in stats.items()}
+    results["total"] = total.summary(elapsed)
+    return results
+
+async def main(args):
+    usernames = [args.username] if args.username else [f"{args.user_prefix}{n}" for n in range(args.users)]
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60.0) as client:
+        tokens = await asyncio.gather(*(login(client, username, args.password) for username in usernames))
+    accounts = list(zip(usernames, tokens))
+
+    for concurrency in args.concurrency:
+        results = await run_level(args.base_url, accounts, args.password, args.paths, concurrency, args.duration)
+        print(f"\n{concurrency} clients, {len(accounts)} accounts")
+        print(
+            f"{'endpoint':<40} {'requests':>9} {'errors':>7} {'req/s':>9} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        for path, result in results.items():
+            queries = f"{result['queries']:>8.1f}" if result["queries"] is not None else f"{'-':>8}"
+            print(
+                f"{path:<40} {result['requests']:>9} {result['errors']:>7} {result['throughput']:>9.1f} "
+                f"{result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} {queries}"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", help="log every client in as this account instead of the seeded users")
+    parser.add_argument("--user-prefix", default="user")
+    parser.add_argument("--users", type=int, default=100, help="number of seeded accounts to spread clients over")
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""
+Login burst benchmark.
+
+Fires BURST concurrent /token requests at the app in-process while a probe
+client polls /health, first with bcrypt verified directly on the event loop
+(the inline path) and then through the bounded password worker pool. Reports
+login throughput, refused (429) logins and the probe's latency during the burst,
+which is what every other request on the worker experiences.
+
+Run from the repository root:
+    python -m backend.benchmarks.login_burst
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "login_burst.db"))
+# Cheaper than the production cost so the run stays short; the ratios are what matter
+os.environ.setdefault("BCRYPT_ROUNDS", "10")
+
+import httpx
+from ..database import models
+from ..database.database import engine
+from ..main import app
+from ..services import aio, auth
+from ..services.password_hasher import PasswordHasher
+from .load_test import percentile
+
+BURST = 64
+PROBE_INTERVAL = 0.01
+
+async def inline_authenticate_user(db, username: str, password: str):
+    user = await aio.get_login_user(db, username)
+    if not user or not auth.verify_password(password, user.hashed_password):
+        return False
+    return user
+
+async def run(name):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        probe_latencies = []
+        done = asyncio.Event()
+
+        async def probe():
+            # Latency counts from when the request was due, so time spent waiting
+            # for a blocked event loop to wake the probe is included
+            due = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/health")
+                finished = time.perf_counter()
+                probe_latencies.append(finished - due)
+                due = max(due + PROBE_INTERVAL, finished)
+
+        async def login(n):
+            response = await client.post("/api/v1/token", data={"username": f"burst{n % 8}", "password": "secret"})
+            return response.status_code
+
+        probe_task = asyncio.create_task(probe())
+        await asyncio.sleep(PROBE_INTERVAL * 5)
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(login(n) for n in range(BURST)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    probe_latencies.sort()
+    succeeded = statuses.count(200)
+    print(
+        f"{name:<14} {succeeded:>4} ok {statuses.count(429):>4} refused {succeeded / elapsed:>8.1f} logins/s  "
+        f"probe p50 {percentile(probe_latencies, 0.50) * 1000:>7.1f} ms "
+        f"p99 {percentile(probe_latencies, 0.99) * 1000:>7.1f} ms max {probe_latencies[-1] * 1000:>7.1f} ms"
+    )
+
+async def main():
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for n in range(8):
+            await client.post(
+                "/api/v1/register", json={"username": f"burst{n}", "email": f"burst{n}@example.com", "password": "secret"}
+            )
+
+    print(f"{BURST} concurrent logins, bcrypt cost {auth.BCRYPT_ROUNDS}, {os.cpu_count()} CPUs")
+    pooled_authenticate_user = aio.authenticate_user
+    aio.authenticate_user = inline_authenticate_user
+    await run("event loop")
+    aio.authenticate_user = pooled_authenticate_user
+    hasher = aio.password_hasher
+    aio.password_hasher = PasswordHasher(queue_size=BURST)
+    await run("worker pool")
+    aio.password_hasher.shutdown()
+
+    # A pool too small for the burst sheds the excess with 429 instead of queueing it
+    aio.password_hasher = PasswordHasher(workers=1, queue_size=8)
+    await run("saturated pool")
+    aio.password_hasher.shutdown()
+    aio.password_hasher = hasher
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Deep-page latency benchmark for chat history pagination.
+
+Compares fetching page PAGE of a user's chats with .offset().limit() against
+the keyset cursor used by chat_service.get_user_chats.
+
+Run from the repository root:
+    python -m backend.benchmarks.pagination
+"""
+import os
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from ..database import models
+from ..services import chat_service
+from ..services.pagination import encode_cursor
+
+ITERATIONS = 50
+PAGE_SIZE = 20
+PAGE = 1000
+HISTORY_CHATS = 25000
+OTHER_USERS = 4
+
+def setup_database():
+    engine = create_engine(
+        os.environ["DATABASE_URL"],
+        connect_args={"check_same_thread": False} if os.environ["DATABASE_URL"].startswith("sqlite") else {},
+        poolclass=StaticPool if os.environ["DATABASE_URL"].startswith("sqlite") else None
+    )
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    users = [
+        models.User(username=f"bench{i}", email=f"bench{i}@example.com", hashed_password="x")
+        for i in range(OTHER_USERS + 1)
+    ]
+    db.add_all(users)
+    db.flush()
+    started = datetime.utcnow() - timedelta(days=365)
+    rows = [
+        {
+            "user_id": user.id,
+            "model_name": "gpt-4",
+            "input_tokens": 100,
+            "output_tokens": 200,
+            "cost_micros": 15000,
+            "created_at": started + timedelta(seconds=n * 60)
+        }
+        for user in users
+        for n in range(HISTORY_CHATS)
+    ]
+    db.execute(models.Chat.__table__.insert(), rows)
+    db.commit()
+    user_id = users[0].id
+    db.close()
+    return session_factory, user_id
+
+def offset_page(db, user_id, skip):
+    return db.query(models.Chat).filter(
+        models.Chat.user_id == user_id
+    ).order_by(models.Chat.created_at.desc(), models.Chat.id.desc()).offset(skip).limit(PAGE_SIZE).all()
+
+def measure(fn):
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        page = fn()
+    return (time.perf_counter() - started) / ITERATIONS * 1000, page
+
+if __name__ == "__main__":
+    session_factory, user_id = setup_database()
+    db = session_factory()
+    skip = (PAGE - 1) * PAGE_SIZE
+
+    # The cursor a client holds after reading the previous page
+    previous = offset_page(db, user_id, skip - 1)[0]
+    cursor = encode_cursor(previous.created_at, previous.id)
+
+    offset_ms, offset_rows = measure(lambda: offset_page(db, user_id, skip))
+    keyset_ms, keyset_result = measure(lambda: chat_service.get_user_chats(db, user_id, cursor=cursor, limit=PAGE_SIZE))
+    assert [chat.id for chat in offset_rows] == [chat.id for chat in keyset_result["items"]]
+    db.close()
+
+    print(f"page {PAGE} of {PAGE_SIZE} chats, {HISTORY_CHATS} chats of history per user")
+    print(f"{'offset':<8} {offset_ms:>8.2f} ms/page")
+    print(f"{'keyset':<8} {keyset_ms:>8.2f} ms/page")
@@ -0,0 +1,36 @@
+"""
+Throughput benchmark for the pricing engine.
+
+Prices CHATS random chats one call at a time and through the batch costs() path.
+
+Run from the repository root:
+    python -m backend.benchmarks.pricing
+"""
+import random
+import time
+from datetime import datetime
+from ..services.pricing_engine import PricingTable
+
+CHATS = 1000000
+MODELS = ["gpt-3.5-turbo", "gpt-4", "llama-2", "vip-gpt-4", "unlisted-model"]
+
+if __name__ == "__main__":
+    table = PricingTable.from_defaults()
+    rng = random.Random(0)
+    model_names = [rng.choice(MODELS) for _ in range(CHATS)]
+    input_tokens = [rng.randint(1, 4000) for _ in range(CHATS)]
+    output_tokens = [rng.randint(1, 4000) for _ in range(CHATS)]
+    now = datetime.utcnow()
+
+    started = time.perf_counter()
+    single = [table.cost(*chat, now) for chat in zip(model_names, input_tokens, output_tokens)]
+    single_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = table.costs(model_names, input_tokens, output_tokens, now)
+    batch_elapsed = time.perf_counter() - started
+    assert single == batch
+
+    print(f"{CHATS} chats")
+    print(f"{'cost':<8} {CHATS / single_elapsed:>12,.0f} chats/s")
+    print(f"{'costs':<8} {CHATS / batch_elapsed:>12,.0f} chats/s")
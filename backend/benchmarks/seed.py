@@ -0,0 +1,194 @@
+"""
+Seed a database with realistic data for the load test.
+
+Creates --users users (username "user<n>", password --password), the standard
+subscription plans with most users subscribed, and per user a year of chat
+history with the matching deposit and chat transactions. The usage rollups and
+per-model statistics are then rebuilt from the chats, as on an existing
+installation.
+Everything is written with chunked bulk inserts.
+
+Run from the repository root against SQLite or a local PostgreSQL:
+    DATABASE_URL=postgresql://localhost/webui_bench python -m backend.benchmarks.seed
+    python -m backend.benchmarks.seed --users 1000 --chats-per-user 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "webui_bench.db"))
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from ..database import models
+from ..services.auth import get_password_hash
+from ..money import to_micros
+from ..services.pricing_engine import PricingTable
+from ..services.usage_service import backfill_usage_rollups
+
+CHUNK_SIZE = 20000
+PLANS = [
+    ("Basic", 5.0, 20, 200000, False),
+    ("Pro", 20.0, 100, 2000000, False),
+    ("VIP", 50.0, 500, 10000000, True)
+]
+MODELS = ["gpt-3.5-turbo", "gpt-3.5-turbo", "gpt-3.5-turbo", "llama-2", "gpt-4", "vip-gpt-4"]
+
+def insert_chunked(db, table, rows):
+    """
+    Insert rows from an iterator in CHUNK_SIZE executemany batches.
+    """
+    total = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            db.execute(table.insert(), chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        db.execute(table.insert(), chunk)
+        total += len(chunk)
+    return total
+
+def seed(db, user_count: int, chats_per_user: int, password: str, seed_value: int = 0):
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    pricing = PricingTable.from_defaults()
+
+    plan_ids = []
+    for name, price, chats_per_hour, tokens_per_month, vip in PLANS:
+        plan = models.SubscriptionPlan(
+            name=name, price_micros=to_micros(price), duration_days=30, max_chats_per_hour=chats_per_hour,
+            max_tokens_per_month=tokens_per_month, can_access_vip_models=vip
+        )
+        db.add(plan)
+        db.flush()
+        plan_ids.append(plan.id)
+
+    # One bcrypt hash shared by every user; hashing 100k passwords would dominate seeding
+    hashed_password = get_password_hash(password)
+    balances = [to_micros(rng.choice([5, 20, 100, 1000])) for _ in range(user_count)]
+    insert_chunked(db, models.User.__table__, (
+        {
+            "username": f"user{n}",
+            "email": f"user{n}@example.com",
+            "hashed_password": hashed_password,
+            "role": models.UserRole.USER,
+            "credits_micros": balances[n],
+            "is_active": True,
+            "created_at": now - timedelta(days=365)
+        }
+        for n in range(user_count)
+    ))
+    # The database is freshly created, so ids follow insertion order
+    user_ids = db.scalars(select(models.User.id).order_by(models.User.id)).all()
+
+    # 80% of users hold an active subscription
+    insert_chunked(db, models.Subscription.__table__, (
+        {
+            "user_id": user_id,
+            "plan_id": rng.choice(plan_ids),
+            "start_date": now - timedelta(days=10),
+            "end_date": now + timedelta(days=20),
+            "is_active": True
+        }
+        for user_id in user_ids if rng.random() < 0.8
+    ))
+
+    def history():
+        """
+        Per user: a deposit a year ago, then chats in time order spending it down
+        to the user's current balance. Yields (chat row, transaction row) pairs.
+        """
+        for user_id, balance in zip(user_ids, balances):
+            chats = sorted(
+                (
+                    now - timedelta(seconds=rng.randint(0, 364 * 86400)),
+                    rng.choice(MODELS),
+                    rng.randint(20, 2000),
+                    rng.randint(20, 2000)
+                )
+                for _ in range(chats_per_user)
+            )
+            costs = [
+                pricing.cost(model_name, input_tokens, output_tokens, created_at)
+                for created_at, model_name, input_tokens, output_tokens in chats
+            ]
+            balance += sum(costs)
+            yield None, {
+                "user_id": user_id,
+                "amount_micros": balance,
+                "transaction_type": models.TransactionType.DEPOSIT,
+                "description": "Initial deposit",
+                "balance_after_micros": balance,
+                "created_at": now - timedelta(days=365)
+            }
+            for (created_at, model_name, input_tokens, output_tokens), cost in zip(chats, costs):
+                balance -= cost
+                yield {
+                    "user_id": user_id,
+                    "model_name": model_name,
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "cost_micros": cost,
+                    "created_at": created_at
+                }, {
+                    "user_id": user_id,
+                    "amount_micros": -cost,
+                    "transaction_type": models.TransactionType.CHAT_COST,
+                    "description": f"Chat with {model_name}",
+                    "balance_after_micros": balance,
+                    "created_at": created_at
+                }
+
+    chat_count = 0
+    chat_chunk = []
+    transaction_chunk = []
+
+    def flush_chunks():
+        if chat_chunk:
+            db.execute(models.Chat.__table__.insert(), chat_chunk)
+        db.execute(models.Transaction.__table__.insert(), transaction_chunk)
+        chat_chunk.clear()
+        transaction_chunk.clear()
+
+    for chat, transaction in history():
+        if chat is not None:
+            chat_chunk.append(chat)
+            chat_count += 1
+        transaction_chunk.append(transaction)
+        if len(transaction_chunk) >= CHUNK_SIZE:
+            flush_chunks()
+    if transaction_chunk:
+        flush_chunks()
+
+    db.commit()
+    backfill_usage_rollups(db)
+    return chat_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    url = os.environ["DATABASE_URL"]
+    engine = create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    started = time.perf_counter()
+    try:
+        chat_count = seed(db, args.users, args.chats_per_user, args.password, args.seed)
+    finally:
+        db.close()
+    print(
+        f"Seeded {args.users} users with {chat_count} chats and {chat_count + args.users} transactions "
+        f"into {engine.url.render_as_string(hide_password=True)} in {time.perf_counter() - started:.1f} s"
+    )
@@ -0,0 +1,63 @@
+"""
+Convert money columns from floating-point credits to integer micro-credits.
+
+Each float column is replaced by a BIGINT *_micros column holding round(value * 10^6),
+all in one transaction. Columns already converted are skipped, so the script can
+be re-run safely.
+
+Run from the repository root against the configured DATABASE_URL:
+    python -m backend.database.migrate_money
+"""
+from sqlalchemy import inspect, text
+from ..money import MICROS_PER_CREDIT
+
+# (table, float column, micro-credit column, nullable)
+MONEY_COLUMNS = [
+    ("users", "credits", "credits_micros", True),
+    ("transactions", "amount", "amount_micros", False),
+    ("transactions", "balance_after", "balance_after_micros", True),
+    ("subscription_plans", "price", "price_micros", False),
+    ("chats", "cost", "cost_micros", True),
+    ("user_model_stats", "cost", "cost_micros", False),
+    ("model_prices", "input_price", "input_price_micros", False),
+    ("model_prices", "output_price", "output_price_micros", False)
+]
+
+def converted_value(dialect: str, column: str):
+    if dialect == "postgresql":
+        # numeric rounds half away from zero on the decimal value, not the binary one
+        return f"ROUND(CAST({column} AS NUMERIC) * {MICROS_PER_CREDIT})::BIGINT"
+    return f"CAST(ROUND({column} * {MICROS_PER_CREDIT}) AS INTEGER)"
+
+def migrate_money_columns(engine):
+    """
+    Returns the list of "table.column" names converted.
+    """
+    dialect = engine.dialect.name
+    converted = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        tables = set(inspector.get_table_names())
+        for table, old_column, new_column, nullable in MONEY_COLUMNS:
+            if table not in tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table)}
+            if old_column not in columns or new_column in columns:
+                continue
+
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {new_column} BIGINT"))
+            connection.execute(text(
+                f"UPDATE {table} SET {new_column} = {converted_value(dialect, old_column)}"
+            ))
+            if not nullable and dialect == "postgresql":
+                connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {new_column} SET NOT NULL"))
+            # Needs SQLite 3.35+ for DROP COLUMN
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {old_column}"))
+            converted.append(f"{table}.{old_column}")
+    return converted
+
+if __name__ == "__main__":
+    from .database import engine
+
+    converted = migrate_money_columns(engine)
+    print(f"Converted {len(converted)} columns to micro-credits: {', '.join(converted) or 'none'}")
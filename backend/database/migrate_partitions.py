@@ -0,0 +1,83 @@
+"""
+Convert the chats and transactions tables to monthly range partitioning on PostgreSQL.
+
+Each table still stored as a plain heap is renamed aside together with its
+indexes and id sequence, recreated as a partitioned table with a partition for
+every month from its oldest row to PARTITION_MONTHS_AHEAD past the current one
+and a default partition, refilled, and the old table dropped, all in one
+transaction per table. Ids are kept and the new id sequence continues after the
+highest. Tables already partitioned are skipped, so the script can be re-run
+safely; on other databases it does nothing.
+
+The copy rewrites the whole table while holding an exclusive lock on it, so run
+it, like the other migrations, before starting the new version.
+
+Run from the repository root against the configured DATABASE_URL:
+    python -m backend.database.migrate_partitions
+"""
+from sqlalchemy import inspect, text
+from . import models
+from .partitioning import create_partitions, is_partitioned, partitioned_tables
+
+def partition_table(connection, table):
+    """
+    Move the rows of the plain table `table` into a new partitioned one.
+    Returns the number of rows moved.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    legacy = f"{table.name}_unpartitioned"
+    connection.execute(text(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(legacy)}"))
+
+    # Free the names of the primary key, the indexes and the id sequence for the new table
+    index_names = connection.execute(
+        text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": legacy}
+    ).scalars().all()
+    for name in index_names:
+        connection.execute(text(f"ALTER INDEX {quote(name)} RENAME TO {quote(name + '_unpartitioned')}"))
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": legacy}).scalar()
+    if sequence:
+        connection.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {quote(legacy + '_id_seq')}"))
+
+    # checkfirst leaves the existing enum types alone; the table itself was just renamed away
+    table.create(connection, checkfirst=True)
+    key = table.info["partition_key"]
+    oldest, newest = connection.execute(
+        text(f"SELECT min({quote(key)}), max({quote(key)}) FROM {quote(legacy)}")
+    ).one()
+    if oldest is not None:
+        create_partitions(connection, table.name, oldest.replace(tzinfo=None), newest.replace(tzinfo=None))
+
+    columns = ", ".join(quote(column.name) for column in table.columns)
+    moved = connection.execute(
+        text(f"INSERT INTO {quote(table.name)} ({columns}) SELECT {columns} FROM {quote(legacy)}")
+    ).rowcount
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(max(id), 0) + 1, false)"
+        f" FROM {quote(table.name)}"
+    ), {"table": table.name})
+    connection.execute(text(f"DROP TABLE {quote(legacy)}"))
+    return moved
+
+def migrate_partitions(engine):
+    """
+    Returns {table name: rows moved} for the tables converted.
+    """
+    converted = {}
+    if engine.dialect.name != "postgresql":
+        return converted
+    for table in partitioned_tables(models.Base.metadata):
+        with engine.begin() as connection:
+            if table.name not in inspect(connection).get_table_names():
+                continue
+            if is_partitioned(connection, table.name):
+                continue
+            converted[table.name] = partition_table(connection, table)
+    return converted
+
+if __name__ == "__main__":
+    from .database import engine
+
+    converted = migrate_partitions(engine)
+    print(f"Partitioned {len(converted)} tables: " + (
+        ", ".join(f"{name} ({rows} rows)" for name, rows in converted.items()) or "none"
+    ))
@@ -0,0 +1,40 @@
+"""
+Add subscription auto-renewal and the partial indexes on active subscriptions.
+
+Adds subscriptions.auto_renew (false for existing rows) and creates the indexes
+declared on models.Subscription that are missing. Existing columns and indexes
+are skipped, so the script can be re-run safely.
+
+Run from the repository root against the configured DATABASE_URL:
+    python -m backend.database.migrate_subscriptions
+"""
+from sqlalchemy import inspect, text
+from . import models
+
+def migrate_subscriptions(engine):
+    """
+    Returns the list of columns and indexes added.
+    """
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "subscriptions" not in inspector.get_table_names():
+            return added
+
+        columns = {column["name"] for column in inspector.get_columns("subscriptions")}
+        if "auto_renew" not in columns:
+            connection.execute(text("ALTER TABLE subscriptions ADD COLUMN auto_renew BOOLEAN NOT NULL DEFAULT FALSE"))
+            added.append("subscriptions.auto_renew")
+
+        existing = {index["name"] for index in inspector.get_indexes("subscriptions")}
+        for index in models.Subscription.__table__.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                added.append(index.name)
+    return added
+
+if __name__ == "__main__":
+    from .database import engine
+
+    added = migrate_subscriptions(engine)
+    print(f"Added {len(added)} columns and indexes: {', '.join(added) or 'none'}")
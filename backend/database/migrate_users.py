@@ -0,0 +1,38 @@
+"""
+Add the admin search indexes on users.
+
+Creates the indexes declared on models.User that are missing: the listing
+indexes on (created_at, id) and (role, is_active, created_at, id) and, on
+PostgreSQL, the pg_trgm extension and trigram indexes on username and email.
+Existing indexes are skipped, so the script can be re-run safely.
+
+Run from the repository root against the configured DATABASE_URL:
+    python -m backend.database.migrate_users
+"""
+from sqlalchemy import inspect
+from . import models
+
+def migrate_users(engine):
+    """
+    Returns the list of indexes added.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if "users" not in inspector.get_table_names():
+            return []
+
+        existing = {index["name"] for index in inspector.get_indexes("users")}
+        models.PG_TRGM(models.User.__table__, connection)
+        for index in models.User.__table__.indexes:
+            if index.name not in existing:
+                # Indexes for another dialect are skipped by their ddl_if
+                index.create(connection)
+
+        created = {index["name"] for index in inspect(connection).get_indexes("users")}
+    return sorted(created - existing)
+
+if __name__ == "__main__":
+    from .database import engine
+
+    added = migrate_users(engine)
+    print(f"Added {len(added)} indexes: {', '.join(added) or 'none'}")
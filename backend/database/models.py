@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Date, DateTime, Float, ForeignKey, Enum, Index, UniqueConstraint, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 import enum
+from ..money import from_micros
+from .partitioning import monthly_partitioning, partition_on_create
 
 Base = declarative_base()
 
@@ -17,6 +19,11 @@ class TransactionType(enum.Enum):
     CHAT_COST = "chat_cost"
     SUBSCRIPTION = "subscription"
 
+class UsagePeriod(enum.Enum):
+    # No longer written; kept so rows from earlier versions load until they are pruned
+    HOUR = "hour"
+    MONTH = "month"
+
 class User(Base):
     __tablename__ = "users"
     
@@ -25,7 +32,8 @@ class User(Base):
     email = Column(String(100), unique=True, index=True)
     hashed_password = Column(String(255))
     role = Column(Enum(UserRole), default=UserRole.USER)
-    credits = Column(Float, default=0.0)
+    # Balance in micro-credits, see backend.money
+    credits_micros = Column(BigInteger, default=0)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -34,32 +42,100 @@ class User(Base):
     transactions = relationship("Transaction", back_populates="user")
     subscriptions = relationship("Subscription", back_populates="user")
     chats = relationship("Chat", back_populates="user")
+    refresh_tokens = relationship("RefreshToken", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Admin listing, newest first, optionally narrowed to a role and activity
+        Index("ix_users_created_id", "created_at", "id"),
+        Index("ix_users_role_active_created_id", "role", "is_active", "created_at", "id"),
+        # Trigram indexes serve case-insensitive substring search on PostgreSQL
+        Index(
+            "ix_users_username_trgm", "username",
+            postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_users_email_trgm", "email",
+            postgresql_using="gin", postgresql_ops={"email": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+    
+    @property
+    def credits(self):
+        return from_micros(self.credits_micros)
+
+# gin_trgm_ops is provided by the pg_trgm extension
+PG_TRGM = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(User.__table__, "before_create", PG_TRGM)
 
 class Transaction(Base):
     __tablename__ = "transactions"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    amount = Column(Float, nullable=False)
+    amount_micros = Column(BigInteger, nullable=False)
     transaction_type = Column(Enum(TransactionType))
     description = Column(String(255))
-    balance_after = Column(Float)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    balance_after_micros = Column(BigInteger)
+    # Partition key on PostgreSQL
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationships
     user = relationship("User", back_populates="transactions")
+    
+    @property
+    def amount(self):
+        return from_micros(self.amount_micros)
+    
+    @property
+    def balance_after(self):
+        return from_micros(self.balance_after_micros)
+    
+    __table_args__ = (
+        Index("ix_transactions_user_created_id", "user_id", "created_at", "id"),
+        monthly_partitioning("created_at"),
+    )
+
+partition_on_create(Transaction.__table__)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # SHA-256 of the token; the token itself is only ever held by the client
+    token_hash = Column(String(64), unique=True, nullable=False)
+    # Every token rotated from the same login shares a family, revoked as a whole on reuse or logout
+    family_id = Column(String(32), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked_at = Column(DateTime(timezone=True))
+
+class TokenRevocation(Base):
+    __tablename__ = "token_revocations"
+    
+    # Logouts (jti) and claims changes (user_id), polled by every worker into its revocation
+    # list; rows are dropped once no access token they could match is still valid
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String(32))
+    user_id = Column(Integer)
+    # Unix time, compared with the integer iat claim of access tokens
+    revoked_at = Column(Float, nullable=False, index=True)
 
 class SubscriptionPlan(Base):
     __tablename__ = "subscription_plans"
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50), unique=True)
-    price = Column(Float, nullable=False)
+    price_micros = Column(BigInteger, nullable=False)
     duration_days = Column(Integer, nullable=False)
     max_chats_per_hour = Column(Integer, default=10)
     max_tokens_per_month = Column(Integer, default=1000000)
     can_access_vip_models = Column(Boolean, default=False)
     description = Column(String(255))
+    
+    @property
+    def price(self):
+        return from_micros(self.price_micros)
 
 class Subscription(Base):
     __tablename__ = "subscriptions"
@@ -70,10 +146,27 @@ class Subscription(Base):
     start_date = Column(DateTime(timezone=True), server_default=func.now())
     end_date = Column(DateTime(timezone=True))
     is_active = Column(Boolean, default=True)
+    # Renewed from the user's credits by the expiry sweeper when end_date passes
+    auto_renew = Column(Boolean, default=False, nullable=False)
     
     # Relationships
     user = relationship("User", back_populates="subscriptions")
     plan = relationship("SubscriptionPlan")
+    
+    __table_args__ = (
+        Index("ix_subscriptions_user_start_id", "user_id", "start_date", "id"),
+        # Partial indexes over the few active rows: the per-user lookup on every
+        # request (covering on PostgreSQL) and the sweeper's scan for due rows
+        Index(
+            "ix_subscriptions_active_user", "user_id",
+            postgresql_where=text("is_active"), sqlite_where=text("is_active = 1"),
+            postgresql_include=["id", "plan_id", "start_date", "end_date", "auto_renew"]
+        ),
+        Index(
+            "ix_subscriptions_active_end_date", "end_date",
+            postgresql_where=text("is_active"), sqlite_where=text("is_active = 1")
+        ),
+    )
 
 class Chat(Base):
     __tablename__ = "chats"
@@ -83,8 +176,124 @@ class Chat(Base):
     model_name = Column(String(100))
     input_tokens = Column(Integer, default=0)
     output_tokens = Column(Integer, default=0)
-    cost = Column(Float, default=0.0)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    cost_micros = Column(BigInteger, default=0)
+    # Partition key on PostgreSQL
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # Relationships
-    user = relationship("User", back_populates="chats")
\ No newline at end of file
+    user = relationship("User", back_populates="chats")
+    
+    @property
+    def cost(self):
+        return from_micros(self.cost_micros)
+    
+    __table_args__ = (
+        Index("ix_chats_user_created_id", "user_id", "created_at", "id"),
+        monthly_partitioning("created_at"),
+    )
+
+partition_on_create(Chat.__table__)
+
+class ChatLogBatch(Base):
+    __tablename__ = "chat_log_batches"
+    
+    # Journal segment of the write-behind chat log, or batch of reservation settlements,
+    # recorded in the transaction that wrote its chats so that a segment left on disk
+    # or a batch left unacknowledged by a crash is not written twice
+    id = Column(String(64), primary_key=True)
+    flushed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    period = Column(Enum(UsagePeriod), nullable=False)
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    chat_count = Column(Integer, default=0, nullable=False)
+    tokens = Column(BigInteger, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "period", "bucket_start", name="uq_usage_rollups_bucket"),
+    )
+
+
+class UserModelStats(Base):
+    __tablename__ = "user_model_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model_name = Column(String(100), nullable=False)
+    chat_count = Column(Integer, default=0, nullable=False)
+    tokens = Column(BigInteger, default=0, nullable=False)
+    cost_micros = Column(BigInteger, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "model_name", name="uq_user_model_stats_model"),
+    )
+    
+    @property
+    def cost(self):
+        return from_micros(self.cost_micros)
+
+
+class DailyUsage(Base):
+    __tablename__ = "daily_usage"
+    
+    # Admin analytics rollup, maintained with every chat insert and kept when chats are archived
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model_name = Column(String(100), nullable=False)
+    # The user's active plan when the chat was recorded, 0 without one (not a foreign
+    # key, so that the conflict target never holds a NULL)
+    plan_id = Column(Integer, nullable=False, default=0)
+    chat_count = Column(Integer, default=0, nullable=False)
+    tokens = Column(BigInteger, default=0, nullable=False)
+    cost_micros = Column(BigInteger, default=0, nullable=False)
+    
+    __table_args__ = (
+        # Leads with the day, so every date-ranged report is one index range
+        UniqueConstraint("day", "user_id", "model_name", "plan_id", name="uq_daily_usage_bucket"),
+    )
+    
+    @property
+    def cost(self):
+        return from_micros(self.cost_micros)
+
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_versions"
+    
+    # Bumped on every change to the named catalog; workers reload their cached copy when it moves
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ModelPrice(Base):
+    __tablename__ = "model_prices"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    # Exact model name, "prefix*" or "*"
+    model_pattern = Column(String(100), nullable=False, index=True)
+    # Graduated tier: the prices apply to a chat's tokens beyond this count
+    tier_start_tokens = Column(Integer, default=0, nullable=False)
+    # Prices per 1000 tokens, in micro-credits
+    input_price_micros = Column(BigInteger, nullable=False)
+    output_price_micros = Column(BigInteger, nullable=False)
+    effective_from = Column(DateTime(timezone=True))
+    # Pricing catalog version this row was added in; the engine reloads when max(version) changes
+    version = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint("model_pattern", "effective_from", "tier_start_tokens", name="uq_model_prices_tier"),
+    )
+    
+    @property
+    def input_price(self):
+        return from_micros(self.input_price_micros)
+    
+    @property
+    def output_price(self):
+        return from_micros(self.output_price_micros)
@@ -0,0 +1,161 @@
+"""
+Monthly range partitioning of the append-only tables on PostgreSQL.
+
+Tables declared with monthly_partitioning() are created PARTITION BY RANGE on
+their timestamp column, with one partition per calendar month (UTC) and a
+DEFAULT partition catching any row outside them. Other databases (SQLite in
+tests and development) get an ordinary table from the same model.
+"""
+import os
+from datetime import datetime
+from sqlalchemy import PrimaryKeyConstraint, event, text
+from sqlalchemy.ext.compiler import compiles
+
+# Partitions kept created beyond the current month, so inserts never find their month missing
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+def monthly_partitioning(column: str):
+    """
+    __table_args__ entries partitioning a table by month on `column`.
+    """
+    return {"postgresql_partition_by": f"RANGE ({column})", "info": {"partition_key": column}}
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _compile_primary_key(constraint, compiler, **kw):
+    # PostgreSQL requires the partition key in the primary key of a partitioned
+    # table. The model keeps the plain id key, which the ORM and SQLite's rowid use.
+    key = constraint.table.info.get("partition_key")
+    if key is None or key in constraint.columns:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [key]
+    return "PRIMARY KEY (%s)" % ", ".join(compiler.preparer.quote(column) for column in columns)
+
+def month_start(moment: datetime):
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(month: datetime, months: int):
+    year, index = divmod(month.month - 1 + months, 12)
+    return datetime(month.year + year, index + 1, 1)
+
+def partition_name(table_name: str, month: datetime):
+    return f"{table_name}_{month:%Y_%m}"
+
+def default_partition_name(table_name: str):
+    return f"{table_name}_default"
+
+def partition_bound(month: datetime):
+    """
+    A month start as a timestamptz literal. An explicit UTC offset keeps the
+    bound independent of the TimeZone of the session creating the partition.
+    """
+    return f"{month:%Y-%m-%d %H:%M:%S}+00"
+
+def partitioned_tables(metadata):
+    return [table for table in metadata.sorted_tables if "partition_key" in table.info]
+
+def is_partitioned(connection, table_name: str):
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"), {"name": table_name}
+    ).scalar())
+
+def partition_months(connection, table_name: str):
+    """
+    First days of the months that have a partition attached to `table_name`, oldest first.
+    """
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " WHERE pg_inherits.inhparent = to_regclass(:name)"
+    ), {"name": table_name}).scalars()
+    prefix = table_name + "_"
+    months = []
+    for name in names:
+        try:
+            months.append(datetime.strptime(name[len(prefix):], "%Y_%m"))
+        except ValueError:
+            continue
+    return sorted(months)
+
+def ensure_default_partition(connection, table_name: str):
+    """
+    Create the DEFAULT partition of `table_name` if it is missing, so a row
+    outside every monthly partition, e.g. dated past the months created ahead,
+    is stored rather than refused. Returns its name if it was created.
+    """
+    name = default_partition_name(table_name)
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return None
+    quote = connection.dialect.identifier_preparer.quote
+    connection.execute(text(f"CREATE TABLE {quote(name)} PARTITION OF {quote(table_name)} DEFAULT"))
+    return name
+
+def _default_has_rows(connection, table_name: str):
+    name = default_partition_name(table_name)
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+        return False
+    quote = connection.dialect.identifier_preparer.quote
+    return bool(connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {quote(name)})")).scalar())
+
+def create_partitions(connection, table_name: str, first_month: datetime, last_month: datetime):
+    """
+    Create the missing monthly partitions of `table_name` from first_month to
+    last_month inclusive. Returns the names of the partitions created.
+    """
+    existing = set(partition_months(connection, table_name))
+    missing = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            missing.append(month)
+        month = add_months(month, 1)
+    if not missing:
+        return []
+
+    quote = connection.dialect.identifier_preparer.quote
+    default = default_partition_name(table_name)
+    stranded = f"{default}_stranded"
+    # PostgreSQL refuses a new partition while the default one holds rows of its
+    # range, so a non-empty default is set aside and its rows routed again below
+    set_aside = _default_has_rows(connection, table_name)
+    if set_aside:
+        connection.execute(text(f"ALTER TABLE {quote(table_name)} DETACH PARTITION {quote(default)}"))
+        connection.execute(text(f"ALTER TABLE {quote(default)} RENAME TO {quote(stranded)}"))
+
+    created = []
+    for month in missing:
+        name = partition_name(table_name, month)
+        connection.execute(text(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(table_name)}"
+            f" FOR VALUES FROM ('{partition_bound(month)}') TO ('{partition_bound(add_months(month, 1))}')"
+        ))
+        created.append(name)
+
+    if set_aside:
+        ensure_default_partition(connection, table_name)
+        connection.execute(text(
+            f"WITH moved AS (DELETE FROM {quote(stranded)} RETURNING *)"
+            f" INSERT INTO {quote(table_name)} SELECT * FROM moved"
+        ))
+        connection.execute(text(f"DROP TABLE {quote(stranded)}"))
+    return created
+
+def ensure_future_partitions(connection, table_name: str, now: datetime = None):
+    """
+    Partitions for the current month and the next PARTITION_MONTHS_AHEAD, and the default one.
+    """
+    current = month_start(now or datetime.utcnow())
+    created = create_partitions(connection, table_name, current, add_months(current, PARTITION_MONTHS_AHEAD))
+    default = ensure_default_partition(connection, table_name)
+    return created + [default] if default else created
+
+def _create_initial_partitions(table, connection, **kw):
+    if connection.dialect.name == "postgresql":
+        ensure_future_partitions(connection, table.name)
+
+def partition_on_create(table):
+    """
+    Give a newly created partitioned table its first partitions.
+    """
+    event.listen(table, "after_create", _create_initial_partitions)
@@ -1,8 +1,21 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import Depends, FastAPI
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from .api import auth, subscriptions, chats
+from .api import admin, auth, subscriptions, chats
 from .database import models
-from .database.database import engine
+from .database.database import engine, pool_stats
+from .services import metrics
+from .services.auth import get_current_admin_user, get_metrics_reader
+from .services.chat_log import chat_log, flush_chat_log
+from .services.password_hasher import password_hasher
+from .services.pricing_engine import pricing_engine
+from .services.principal_cache import principal_cache
+from .services.token_revocation import revocation_list, run_revocation_sync
+from .services.reservation_service import flush_pending_settlements, run_settlement_flusher
+from .services.retention_service import run_partition_maintenance
+from .services.subscription_service import run_subscription_sweeper
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
@@ -22,10 +35,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency and database statement counts, exported on /metrics
+metrics.install_query_hooks()
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/v1", tags=["Authentication"])
 app.include_router(subscriptions.router, prefix="/api/v1", tags=["Subscriptions"])
 app.include_router(chats.router, prefix="/api/v1", tags=["Chats"])
+app.include_router(admin.router, prefix="/api/v1", tags=["Admin"])
+
+@app.on_event("startup")
+async def start_settlement_flusher():
+    app.state.settlement_flusher = asyncio.create_task(run_settlement_flusher())
+
+@app.on_event("shutdown")
+async def stop_settlement_flusher():
+    app.state.settlement_flusher.cancel()
+    # Write whatever was settled since the last tick before the worker exits
+    await run_in_threadpool(flush_pending_settlements)
+
+@app.on_event("startup")
+async def start_chat_log_flusher():
+    # Started in every mode so a journal left by a write-behind run is still replayed
+    app.state.chat_log_flusher = asyncio.create_task(chat_log.run_flusher())
+
+@app.on_event("shutdown")
+async def stop_chat_log_flusher():
+    app.state.chat_log_flusher.cancel()
+    # Write the queued chats before the worker exits; the journal covers a failure here
+    await run_in_threadpool(flush_chat_log)
+
+@app.on_event("startup")
+async def start_subscription_sweeper():
+    app.state.subscription_sweeper = asyncio.create_task(run_subscription_sweeper())
+
+@app.on_event("shutdown")
+async def stop_subscription_sweeper():
+    app.state.subscription_sweeper.cancel()
+
+@app.on_event("startup")
+async def start_partition_maintenance():
+    app.state.partition_maintenance = asyncio.create_task(run_partition_maintenance())
+
+@app.on_event("shutdown")
+async def stop_partition_maintenance():
+    app.state.partition_maintenance.cancel()
+
+@app.on_event("startup")
+async def start_pricing_refresher():
+    app.state.pricing_refresher = asyncio.create_task(pricing_engine.run_refresher())
+
+@app.on_event("shutdown")
+async def stop_pricing_refresher():
+    app.state.pricing_refresher.cancel()
+
+@app.on_event("startup")
+async def start_revocation_sync():
+    app.state.revocation_sync = asyncio.create_task(run_revocation_sync())
+
+@app.on_event("shutdown")
+async def stop_revocation_sync():
+    app.state.revocation_sync.cancel()
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    password_hasher.shutdown()
 
 @app.get("/")
 async def root():
@@ -35,6 +110,23 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# Liveness stays public; the internals below are for admins only
+@app.get("/health/cache", dependencies=[Depends(get_current_admin_user)])
+async def cache_stats():
+    return {
+        "principal_cache": principal_cache.stats(),
+        "revocation_list": revocation_list.stats(),
+        "chat_log": chat_log.stats()
+    }
+
+@app.get("/health/db", dependencies=[Depends(get_current_admin_user)])
+async def database_pool_stats():
+    return {"pools": pool_stats()}
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(get_metrics_reader)])
+async def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
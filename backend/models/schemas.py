@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import List, Optional
+from datetime import date, datetime
 from enum import Enum
 
 class UserRole(str, Enum):
@@ -36,6 +36,85 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserSearchPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str]
+    # Only on the first page; approximate when total_is_estimate is set
+    total: Optional[int]
+    total_is_estimate: bool
+
+class UserImportItem(UserCreate):
+    role: UserRole = UserRole.USER
+    # Opening balance, recorded as a deposit
+    credits: float = 0
+
+class UserImportBatch(BaseModel):
+    users: List[UserImportItem]
+
+class CreditGrant(BaseModel):
+    user_id: int
+    amount: float
+
+class CreditGrantBatch(BaseModel):
+    grants: List[CreditGrant]
+    description: str = "Credit grant"
+
+class UserBulkUpdate(BaseModel):
+    user_ids: List[int]
+    role: Optional[UserRole] = None
+    is_active: Optional[bool] = None
+
+class BulkItemResult(BaseModel):
+    index: int
+    succeeded: bool
+    user_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+class AnalyticsDimension(str, Enum):
+    USER_ID = "user_id"
+    MODEL_NAME = "model_name"
+    DAY = "day"
+    HOUR = "hour"
+
+class UsageTotals(BaseModel):
+    chats: int
+    tokens: int
+    cost: float
+
+class TopUser(UsageTotals):
+    user_id: int
+    username: Optional[str]
+
+class ModelUsage(UsageTotals):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_name: str
+    chat_share: float
+    cost_share: float
+
+class RevenueItem(UsageTotals):
+    # Set according to the grouping; a per-plan item without plan_id covers chats made without a plan
+    day: Optional[date] = None
+    plan_id: Optional[int] = None
+    plan_name: Optional[str] = None
+
+class RevenueReport(BaseModel):
+    start: date
+    end: date
+    total: UsageTotals
+    items: List[RevenueItem]
+
+class AdminStats(BaseModel):
+    total_users: int
+    active_users: int
+    counts_are_estimates: bool
+    total_revenue: float
+
 class TransactionCreate(BaseModel):
     amount: float
     transaction_type: TransactionType
@@ -53,6 +132,10 @@ class TransactionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class TransactionPage(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str]
+
 class SubscriptionPlanCreate(BaseModel):
     name: str
     price: float
@@ -77,6 +160,10 @@ class SubscriptionPlanResponse(BaseModel):
 
 class SubscriptionCreate(BaseModel):
     plan_id: int
+    auto_renew: bool = False
+
+class AutoRenewUpdate(BaseModel):
+    auto_renew: bool
 
 class SubscriptionResponse(BaseModel):
     id: int
@@ -85,18 +172,31 @@ class SubscriptionResponse(BaseModel):
     start_date: datetime
     end_date: datetime
     is_active: bool
+    auto_renew: bool
 
     class Config:
         from_attributes = True
 
+class SubscriptionDetailResponse(SubscriptionResponse):
+    plan: SubscriptionPlanResponse
+
+class SubscriptionUsageResponse(BaseModel):
+    chats_this_hour: int
+    tokens_this_month: int
+    plan: Optional[SubscriptionPlanResponse]
+
+class RateLimitStatusResponse(SubscriptionUsageResponse):
+    can_send_chat: bool
+
 class ChatCreate(BaseModel):
     model_name: str
-    input_tokens: int
-    output_tokens: int
+    input_tokens: int = Field(ge=0)
+    output_tokens: int = Field(ge=0)
     cost: float
 
 class ChatResponse(BaseModel):
-    id: int
+    # None while the chat is queued by the write-behind log
+    id: Optional[int]
     user_id: int
     model_name: str
     input_tokens: int
@@ -107,9 +207,77 @@ class ChatResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ChatPage(BaseModel):
+    items: List[ChatResponse]
+    next_cursor: Optional[str]
+
+class ChatUsageRecord(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    user_id: int
+    model_name: str
+    input_tokens: int = Field(ge=0)
+    output_tokens: int = Field(ge=0)
+
+class ChatBatchCreate(BaseModel):
+    records: List[ChatUsageRecord]
+
+class ChatBatchItemResult(BaseModel):
+    index: int
+    accepted: bool
+    chat_id: Optional[int] = None
+    cost: Optional[float] = None
+    error: Optional[str] = None
+
+class ChatBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[ChatBatchItemResult]
+
+class ChatReservationCreate(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_name: str
+    input_tokens: int = Field(ge=0)
+    output_tokens: int = Field(ge=0)
+
+class ChatReservationResponse(BaseModel):
+    reservation_id: str
+    amount: float
+
+class ChatSettlementCreate(BaseModel):
+    input_tokens: int = Field(ge=0)
+    output_tokens: int = Field(ge=0)
+
+class ModelPriceCreate(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_pattern: str
+    input_price: float
+    output_price: float
+    tier_start_tokens: int = 0
+    effective_from: Optional[datetime] = None
+
+class ModelPriceResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True, protected_namespaces=())
+
+    id: int
+    model_pattern: str
+    input_price: float
+    output_price: float
+    tier_start_tokens: int
+    effective_from: Optional[datetime]
+    version: int
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    # Access token lifetime in seconds
+    expires_in: Optional[int] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,24 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Money is stored and computed as integer micro-credits; 1 credit = 1,000,000 micros
+MICROS_PER_CREDIT = 1000000
+
+def to_micros(credits):
+    """
+    Convert a credit amount (int, float, str or Decimal) to integer micro-credits,
+    rounding half away from zero. Floats are read through their shortest repr, so
+    0.1 becomes exactly 100000 rather than the binary approximation.
+    """
+    if credits is None:
+        return None
+    if isinstance(credits, int):
+        return credits * MICROS_PER_CREDIT
+    return int((Decimal(str(credits)) * MICROS_PER_CREDIT).to_integral_value(ROUND_HALF_UP))
+
+def from_micros(micros):
+    """
+    Credits as a float for API responses; the nearest float to the exact amount.
+    """
+    if micros is None:
+        return None
+    return micros / MICROS_PER_CREDIT
@@ -0,0 +1,213 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session
+from ..database import models
+from ..money import to_micros
+from . import ledger
+from .auth import revoke_users_refresh_tokens
+from .pagination import count_rows, keyset_page
+from .principal_cache import principal_cache
+from .token_revocation import revocation_list
+
+def bulk_result(index: int, user_id: int = None, error: str = None):
+    return {"index": index, "succeeded": error is None, "user_id": user_id, "error": error}
+
+def like_pattern(text: str):
+    """
+    An ILIKE pattern matching `text` anywhere, with its wildcards escaped.
+    """
+    escaped = text.replace("/", "//").replace("%", "/%").replace("_", "/_")
+    return f"%{escaped}%"
+
+def user_filters(
+    q: Optional[str] = None,
+    role: Optional[models.UserRole] = None,
+    is_active: Optional[bool] = None,
+    min_credits: Optional[float] = None,
+    max_credits: Optional[float] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    filters = []
+    if q:
+        pattern = like_pattern(q)
+        filters.append(or_(
+            models.User.username.ilike(pattern, escape="/"),
+            models.User.email.ilike(pattern, escape="/")
+        ))
+    if role is not None:
+        filters.append(models.User.role == role)
+    if is_active is not None:
+        filters.append(models.User.is_active == is_active)
+    if min_credits is not None:
+        filters.append(models.User.credits_micros >= to_micros(min_credits))
+    if max_credits is not None:
+        filters.append(models.User.credits_micros <= to_micros(max_credits))
+    if created_after is not None:
+        filters.append(models.User.created_at >= created_after)
+    if created_before is not None:
+        filters.append(models.User.created_at < created_before)
+    return filters
+
+def search_users(db: Session, cursor: str = None, limit: int = 50, **criteria):
+    """
+    One page of the users matching `criteria` (see user_filters), newest first.
+
+    Role and activity filters follow ix_users_role_active_created_id and `q`
+    the trigram indexes on PostgreSQL; the balance is not indexed, since it
+    changes on every chat, and is checked on the rows those indexes yield.
+    The total is only computed for the first page, and is approximate on
+    large PostgreSQL result sets (see pagination.count_rows).
+    """
+    filters = user_filters(**criteria)
+    page = keyset_page(
+        db.query(models.User).filter(*filters),
+        models.User.created_at, models.User.id, cursor, limit
+    )
+    total, is_estimate = None, False
+    if cursor is None:
+        total, is_estimate = count_rows(db, select(models.User.id).where(*filters))
+    return {**page, "total": total, "total_is_estimate": is_estimate}
+
+def validate_user_import(db: Session, users: list):
+    """
+    Per-row error for a user import, or None for rows that can be created:
+    usernames and emails must be unique within the batch and not taken already.
+    """
+    taken_usernames = set()
+    taken_emails = set()
+    for username, email in db.execute(
+        select(models.User.username, models.User.email).where(or_(
+            models.User.username.in_({user.username for user in users}),
+            models.User.email.in_({user.email for user in users})
+        ))
+    ):
+        taken_usernames.add(username)
+        taken_emails.add(email)
+
+    errors = []
+    for user in users:
+        if user.username in taken_usernames:
+            errors.append("Username already registered")
+        elif user.email in taken_emails:
+            errors.append("Email already registered")
+        elif user.credits < 0:
+            errors.append("Credits must not be negative")
+        else:
+            errors.append(None)
+        taken_usernames.add(user.username)
+        taken_emails.add(user.email)
+    return errors
+
+def precheck_user_import(db: Session, users: list):
+    """
+    validate_user_import, ending the read transaction so that no pooled
+    connection is held while the valid rows' passwords are hashed.
+    """
+    errors = validate_user_import(db, users)
+    db.rollback()
+    return errors
+
+def import_users(db: Session, users: list, hashed_passwords: list):
+    """
+    Create the valid rows of a user import with one bulk INSERT, and their opening
+    balances with one bulk Transaction insert, in a single commit.
+    `hashed_passwords` is parallel to `users`; rows are re-validated here, so
+    conflicts created since the passwords were hashed are reported too.
+    """
+    errors = [
+        error or (None if hashed_password else "Registration changed during import, retry")
+        for error, hashed_password in zip(validate_user_import(db, users), hashed_passwords)
+    ]
+    now = datetime.utcnow()
+    rows = [
+        {
+            "username": user.username,
+            "email": user.email,
+            "hashed_password": hashed_password,
+            "role": models.UserRole(user.role.value),
+            "credits_micros": to_micros(user.credits),
+            "is_active": True,
+            "created_at": now
+        }
+        for user, hashed_password, error in zip(users, hashed_passwords, errors)
+        if error is None
+    ]
+    user_ids = {}
+    if rows:
+        user_ids = dict(db.execute(
+            insert(models.User).returning(models.User.username, models.User.id), rows
+        ).all())
+        deposits = [
+            {
+                "user_id": user_ids[row["username"]],
+                "amount_micros": row["credits_micros"],
+                "transaction_type": models.TransactionType.DEPOSIT,
+                "description": "Opening balance",
+                "balance_after_micros": row["credits_micros"],
+                "created_at": now
+            }
+            for row in rows if row["credits_micros"] > 0
+        ]
+        if deposits:
+            db.execute(models.Transaction.__table__.insert(), deposits)
+        db.commit()
+
+    return [
+        bulk_result(index, user_ids.get(user.username) if error is None else None, error)
+        for index, (user, error) in enumerate(zip(users, errors))
+    ]
+
+def grant_credits(db: Session, grants: list, description: str):
+    """
+    Credit every grant with one conditional UPDATE and one bulk Transaction insert.
+    """
+    errors = []
+    credits = {}
+    for grant in grants:
+        if grant.amount <= 0:
+            errors.append("Amount must be positive")
+        elif grant.user_id in credits:
+            errors.append("Duplicate user in batch")
+        else:
+            credits[grant.user_id] = (to_micros(grant.amount), description)
+            errors.append(None)
+
+    balances = ledger.credit_many(db, credits, models.TransactionType.DEPOSIT)
+    db.commit()
+
+    results = []
+    for index, (grant, error) in enumerate(zip(grants, errors)):
+        if error is None and grant.user_id not in balances:
+            error = "User not found"
+        results.append(bulk_result(index, grant.user_id, error))
+    return results
+
+def update_users(db: Session, user_ids: list, role: models.UserRole = None, is_active: bool = None):
+    """
+    Change the role and/or active flag of many users with one UPDATE.
+    Deactivated users also lose their refresh tokens.
+    """
+    values = {}
+    if role is not None:
+        values["role"] = role
+    if is_active is not None:
+        values["is_active"] = is_active
+
+    updated = set(db.execute(
+        update(models.User).where(models.User.id.in_(set(user_ids))).values(**values).returning(
+            models.User.id
+        ).execution_options(synchronize_session=False)
+    ).scalars())
+    if updated and is_active is False:
+        revoke_users_refresh_tokens(db, list(updated))
+    db.commit()
+
+    for user_id in updated:
+        principal_cache.invalidate_user(user_id)
+    revocation_list.invalidate_claims(db, updated)
+    return [
+        bulk_result(index, user_id, None if user_id in updated else "User not found")
+        for index, user_id in enumerate(user_ids)
+    ]
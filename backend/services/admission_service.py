@@ -0,0 +1,330 @@
+from datetime import datetime
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.orm import Session
+from ..database import models
+from ..money import from_micros
+from . import ledger
+from .catalog import can_use_model
+from .pricing_engine import pricing_engine
+from .rate_limiter import acquire_chat_slots, release_chat_slots
+from .reservation_store import pending_tokens, reserved_credits
+from .usage_service import month_bucket, record_chat_usage
+
+# Reads repeated when a write-behind flush commits between the read and the check
+DEFERRED_ADMISSION_ATTEMPTS = 5
+
+def admission_context_query(now: datetime):
+    return select(
+        models.User,
+        models.SubscriptionPlan,
+        func.coalesce(models.UsageRollup.tokens, 0)
+    ).outerjoin(
+        models.Subscription,
+        and_(models.Subscription.user_id == models.User.id, models.Subscription.is_active == True)
+    ).outerjoin(
+        models.SubscriptionPlan, models.SubscriptionPlan.id == models.Subscription.plan_id
+    ).outerjoin(
+        models.UsageRollup,
+        and_(
+            models.UsageRollup.user_id == models.User.id,
+            models.UsageRollup.period == models.UsagePeriod.MONTH,
+            models.UsageRollup.bucket_start == month_bucket(now)
+        )
+    )
+
+def load_admission_context(db: Session, user_id: int, now: datetime):
+    """
+    Load the user, their active subscription plan and monthly token usage in one query.
+    The row is not locked: the debit itself re-checks the balance atomically.
+    """
+    stmt = admission_context_query(now).where(
+        models.User.id == user_id
+    ).order_by(models.Subscription.end_date.desc().nulls_last()).limit(1)
+
+    return db.execute(stmt).first()
+
+def load_admission_contexts(db: Session, user_ids: list, now: datetime):
+    """
+    Batch form of load_admission_context: {user_id: (user, plan, tokens_this_month)}.
+    Rows are locked in user id order so concurrent batches cannot deadlock.
+    """
+    stmt = admission_context_query(now).where(
+        models.User.id.in_(user_ids)
+    ).order_by(
+        models.User.id, models.Subscription.end_date.desc().nulls_last()
+    ).with_for_update(of=models.User)
+
+    contexts = {}
+    for user, plan, tokens_this_month in db.execute(stmt):
+        contexts.setdefault(user.id, (user, plan, tokens_this_month))
+    return contexts
+
+def check_admission(user, plan, tokens_this_month: int, model_name: str, cost: int):
+    """
+    Evaluate access, token and balance checks against an already loaded context.
+    `cost` is in micro-credits.
+    Returns an error message, or None if the chat is admitted.
+    """
+    is_admin = user is not None and user.role == models.UserRole.ADMIN
+
+    # Admins may use every model; everyone else needs a plan with the model's capability
+    if not is_admin:
+        if plan is None or not can_use_model(model_name, False, plan.can_access_vip_models):
+            return "Access denied: Model not available for your subscription"
+
+    if plan is None:
+        return "Rate limit exceeded: Too many requests"
+    if tokens_this_month >= plan.max_tokens_per_month:
+        return "Rate limit exceeded: Too many requests"
+
+    if user.credits_micros is None or user.credits_micros < cost:
+        return "Insufficient credits"
+
+    return None
+
+def admit_chat(db: Session, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
+    """
+    Admit a chat request: one read for the whole admission context, then the
+    conditional debit and the chat record written in a single commit.
+    Returns (chat, None) on success and (None, error) on rejection.
+    """
+    from .chat_service import calculate_chat_cost
+
+    now = datetime.utcnow()
+    row = load_admission_context(db, user_id, now)
+    if row is None:
+        db.rollback()
+        return None, "Access denied: Model not available for your subscription"
+
+    user, plan, tokens_this_month = row
+    cost = calculate_chat_cost(input_tokens, output_tokens, model_name)
+    # Settled reservations count toward the month before their flush records them
+    tokens_this_month += pending_tokens([user_id]).get(user_id, 0)
+
+    error = check_admission(user, plan, tokens_this_month, model_name, cost)
+    if error:
+        db.rollback()
+        return None, error
+
+    # A concurrent debit may have spent the balance since the context was read
+    if ledger.debit(db, user_id, cost, models.TransactionType.CHAT_COST, f"Chat with {model_name}", now) is None:
+        db.rollback()
+        return None, "Insufficient credits"
+
+    # The hourly chat limit is enforced by the rate limiter without touching the database
+    if not acquire_chat_slots(user_id, plan.max_chats_per_hour):
+        db.rollback()
+        return None, "Rate limit exceeded: Too many requests"
+
+    try:
+        db_chat = models.Chat(
+            user_id=user_id,
+            model_name=model_name,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost_micros=cost,
+            created_at=now
+        )
+        db.add(db_chat)
+        record_chat_usage(
+            db, user_id, input_tokens + output_tokens, now, model_name=model_name, cost_micros=cost, plan_id=plan.id
+        )
+        db.flush()
+
+        # Detach the chat before committing so the response can be built
+        # without the refresh query that commit-time expiry would trigger.
+        db.expunge(db_chat)
+        db.commit()
+    except Exception:
+        # The chat was not recorded, so it must not count against the hourly limit
+        db.rollback()
+        release_chat_slots(user_id)
+        raise
+    return db_chat, None
+
+def admit_chat_deferred(db: Session, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
+    """
+    Write-behind form of admit_chat: the checks run against the database state
+    net of the user's chats still queued in the chat log and of their reserved
+    credits, and the chat is queued
+    there instead of written. Nothing is written to the database.
+    Returns (chat, None, ticket) on success, the chat without an id until it is
+    flushed, and (None, error, None) on rejection. The chat must not be
+    acknowledged before chat_log.wait_durable(ticket) returns.
+    """
+    from .chat_log import STALE, busy, chat_log
+    from .chat_service import calculate_chat_cost
+
+    tokens = input_tokens + output_tokens
+    for _ in range(DEFERRED_ADMISSION_ATTEMPTS):
+        now = datetime.utcnow()
+        generation = chat_log.generation
+        row = load_admission_context(db, user_id, now)
+        if row is None:
+            db.rollback()
+            return None, "Access denied: Model not available for your subscription", None
+
+        user, plan, tokens_this_month = row
+        cost = calculate_chat_cost(input_tokens, output_tokens, model_name)
+        reserved = reserved_credits([user_id]).get(user_id, 0)
+        tokens_this_month += pending_tokens([user_id]).get(user_id, 0)
+        month = month_bucket(now)
+        error = chat_log.hold(
+            user_id, month, cost, tokens, generation,
+            lambda held_cost, held_tokens: check_admission(
+                user, plan, tokens_this_month + held_tokens, model_name, cost + held_cost + reserved
+            )
+        )
+        max_chats_per_hour = plan.max_chats_per_hour if plan is not None else 0
+        # End the read so a retry sees the flush that made it stale
+        db.rollback()
+        if error is not STALE:
+            break
+    else:
+        # Flushes kept landing between the read and the check
+        raise busy()
+    if error:
+        return None, error, None
+
+    if not acquire_chat_slots(user_id, max_chats_per_hour):
+        chat_log.release(user_id, month, cost, tokens)
+        return None, "Rate limit exceeded: Too many requests", None
+
+    try:
+        ticket = chat_log.append({
+            "user_id": user_id,
+            "model_name": model_name,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": cost,
+            "created_at": now.isoformat()
+        })
+    except Exception:
+        # The chat was not queued, so no flush would ever release its hold or its slot
+        chat_log.release(user_id, month, cost, tokens)
+        release_chat_slots(user_id)
+        raise
+    chat = models.Chat(
+        user_id=user_id,
+        model_name=model_name,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost_micros=cost,
+        created_at=now
+    )
+    return chat, None, ticket
+
+def admit_chat_batch(db: Session, records: list):
+    """
+    Admit a batch of (user_id, model_name, input_tokens, output_tokens) records.
+    Records are grouped per user; each group takes its rate limit slots in one call
+    and is checked against one loaded context, then all chats and transactions are
+    written with bulk inserts in a single commit.
+    Returns one {"index", "accepted", "chat_id", "cost", "error"} dict per record,
+    with the cost in credits.
+    """
+    now = datetime.utcnow()
+    costs = pricing_engine.costs(
+        [record.model_name for record in records],
+        [record.input_tokens for record in records],
+        [record.output_tokens for record in records],
+        now
+    )
+    results = [None] * len(records)
+    groups = {}
+    for index, record in enumerate(records):
+        groups.setdefault(record.user_id, []).append(index)
+
+    contexts = load_admission_contexts(db, list(groups), now) if groups else {}
+    reserved = reserved_credits(list(contexts))
+    settled_tokens = pending_tokens(list(contexts))
+
+    chat_rows = []
+    chat_results = []
+    transaction_rows = []
+    usage = {}
+    slots = {}
+    for user_id, indexes in groups.items():
+        context = contexts.get(user_id)
+        if context is None:
+            for index in indexes:
+                results[index] = {"index": index, "accepted": False, "error": "User not found"}
+            continue
+
+        user, plan, tokens_this_month = context
+        tokens_this_month += settled_tokens.get(user_id, 0)
+        starting_credits = user.credits_micros
+        user_reserved = reserved.get(user_id, 0)
+        # Slots are taken up front so that records refused by the rate limit never
+        # count toward the balance and usage later records are checked against
+        granted = acquire_chat_slots(user_id, plan.max_chats_per_hour, len(indexes)) if plan is not None else 0
+        admitted = []
+        for index in indexes:
+            record = records[index]
+            cost = costs[index]
+            # Credits held by the user's reservations are not spendable here either
+            error = check_admission(user, plan, tokens_this_month, record.model_name, cost + user_reserved)
+            if not error and len(admitted) == granted:
+                error = "Rate limit exceeded: Too many requests"
+            if error:
+                results[index] = {"index": index, "accepted": False, "error": error}
+                continue
+            # Later records in the group see the balance and usage of earlier ones
+            user.credits_micros -= cost
+            tokens_this_month += record.input_tokens + record.output_tokens
+            admitted.append((index, cost))
+        if granted > len(admitted):
+            release_chat_slots(user_id, granted - len(admitted))
+        if admitted:
+            slots[user_id] = len(admitted)
+
+        balance = starting_credits
+        for index, cost in admitted:
+            record = records[index]
+            balance -= cost
+            transaction_rows.append({
+                "user_id": user_id,
+                "amount_micros": -cost,
+                "transaction_type": models.TransactionType.CHAT_COST,
+                "description": f"Chat with {record.model_name}",
+                "balance_after_micros": balance,
+                "created_at": now
+            })
+            chat_rows.append({
+                "user_id": user_id,
+                "model_name": record.model_name,
+                "input_tokens": record.input_tokens,
+                "output_tokens": record.output_tokens,
+                "cost_micros": cost,
+                "created_at": now
+            })
+            results[index] = {"index": index, "accepted": True, "cost": from_micros(cost)}
+            chat_results.append(results[index])
+            chats, tokens, total_cost = usage.get((user_id, record.model_name), (0, 0, 0))
+            usage[(user_id, record.model_name)] = (
+                chats + 1, tokens + record.input_tokens + record.output_tokens, total_cost + cost
+            )
+        user.credits_micros = balance
+
+    try:
+        if chat_rows:
+            chat_ids = db.scalars(
+                insert(models.Chat).returning(models.Chat.id, sort_by_parameter_order=True), chat_rows
+            ).all()
+            db.execute(insert(models.Transaction), transaction_rows)
+            for result, chat_id in zip(chat_results, chat_ids):
+                result["chat_id"] = chat_id
+            for (user_id, model_name), (chats, tokens, cost) in usage.items():
+                record_chat_usage(
+                    db, user_id, tokens, now, chats=chats, model_name=model_name, cost_micros=cost,
+                    plan_id=contexts[user_id][1].id
+                )
+
+        db.commit()
+    except Exception:
+        # No chat of the batch was recorded, so none may count against the hourly limit
+        db.rollback()
+        for user_id, count in slots.items():
+            release_chat_slots(user_id, count)
+        raise
+    return results
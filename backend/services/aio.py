@@ -0,0 +1,125 @@
+"""
+Async versions of the user, subscription and chat services.
+
+Each function takes the session yielded by database.get_async_db and runs the
+synchronous implementation through run_sync(), so the business logic exists
+once and works on both the AsyncEngine and the threadpool fallback.
+"""
+import functools
+from starlette.concurrency import run_in_threadpool
+from . import admin_service, analytics_service, auth, chat_service, pricing_service, reservation_service, subscription_service, user_service
+from .catalog import catalog_cache
+from .chat_log import chat_log
+from .password_hasher import password_hasher
+
+def _async(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, **kwargs):
+        return await db.run_sync(fn, *args, **kwargs)
+    return wrapper
+
+# Authentication
+get_user = _async(auth.get_user)
+get_principal = _async(auth.get_principal)
+get_login_user = _async(auth.get_login_user)
+update_password_hash = _async(auth.update_password_hash)
+create_token_pair = _async(auth.create_token_pair)
+rotate_refresh_token = _async(auth.rotate_refresh_token)
+revoke_refresh_token = _async(auth.revoke_refresh_token)
+revoke_access_token = _async(auth.revoke_access_token)
+
+# bcrypt runs on the bounded password worker pool, outside run_sync, in both modes
+async def authenticate_user(db, username: str, password: str):
+    user = await get_login_user(db, username)
+    if not user:
+        return False
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
+        return False
+    if new_hash:
+        await update_password_hash(db, user.id, new_hash)
+    return user
+
+async def create_user(db, user):
+    hashed_password = await password_hasher.hash(user.password)
+    return await db.run_sync(user_service.create_user, user, hashed_password)
+
+async def update_user(db, user_id: int, user_update):
+    hashed_password = await password_hasher.hash(user_update.password) if user_update.password else None
+    return await db.run_sync(user_service.update_user, user_id, user_update, hashed_password)
+
+# Admin bulk operations; passwords are hashed in parallel on the password worker pool
+async def import_users(db, users: list):
+    errors = await db.run_sync(admin_service.precheck_user_import, users)
+    hashes = iter(await password_hasher.hash_many([
+        user.password for user, error in zip(users, errors) if error is None
+    ]))
+    hashed_passwords = [next(hashes) if error is None else None for error in errors]
+    return await db.run_sync(admin_service.import_users, users, hashed_passwords)
+
+grant_credits = _async(admin_service.grant_credits)
+update_users = _async(admin_service.update_users)
+search_users = _async(admin_service.search_users)
+
+# Admin analytics
+top_users = _async(analytics_service.top_users)
+model_mix = _async(analytics_service.model_mix)
+revenue = _async(analytics_service.revenue)
+get_admin_stats = _async(analytics_service.get_admin_stats)
+
+async def group_chats(start, end, by: list, limit: int):
+    # A long scan and CPU-bound aggregation: on the threadpool with its own session, off the event loop in both modes
+    return await run_in_threadpool(analytics_service.run_group_chats, start, end, by, limit)
+
+# User service
+get_user_by_username = _async(user_service.get_user_by_username)
+get_user_by_email = _async(user_service.get_user_by_email)
+get_user_by_id = _async(user_service.get_user_by_id)
+delete_user = _async(user_service.delete_user)
+add_credits = _async(user_service.add_credits)
+deduct_credits = _async(user_service.deduct_credits)
+get_user_transactions = _async(user_service.get_user_transactions)
+get_user_balance = _async(user_service.get_user_balance)
+
+# Subscription service
+create_subscription_plan = _async(subscription_service.create_subscription_plan)
+get_subscription_plan = _async(subscription_service.get_subscription_plan)
+get_subscription_plans = _async(subscription_service.get_subscription_plans)
+subscribe_user = _async(subscription_service.subscribe_user)
+set_auto_renew = _async(subscription_service.set_auto_renew)
+get_user_subscription = _async(subscription_service.get_user_subscription)
+get_user_subscriptions = _async(subscription_service.get_user_subscriptions)
+check_subscription_status = _async(subscription_service.check_subscription_status)
+get_subscription_usage = _async(subscription_service.get_subscription_usage)
+can_access_model = _async(subscription_service.can_access_model)
+can_send_chat = _async(subscription_service.can_send_chat)
+
+# Plan catalog: served from memory, the database is read only when a version check is due
+async def get_plan_catalog(db):
+    return catalog_cache.current() or await db.run_sync(catalog_cache.refresh)
+
+# Chat service
+create_chat = _async(chat_service.create_chat)
+get_user_chats = _async(chat_service.get_user_chats)
+get_chat = _async(chat_service.get_chat)
+
+async def process_chat_request(db, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
+    chat, error, ticket = await db.run_sync(chat_service.admit_chat_request, user_id, model_name, input_tokens, output_tokens)
+    if ticket is not None:
+        # The journal fsync blocks; wait for it off the event loop
+        await run_in_threadpool(chat_log.wait_durable, ticket)
+    return chat, error
+
+process_chat_batch = _async(chat_service.process_chat_batch)
+get_chat_statistics = _async(chat_service.get_chat_statistics)
+
+# Pricing service
+create_model_price = _async(pricing_service.create_model_price)
+get_model_prices = _async(pricing_service.get_model_prices)
+
+# Credit reservations
+reserve_credits = _async(reservation_service.reserve_credits)
+settle_reservation = _async(reservation_service.settle_reservation)
+
+async def release_reservation(user_id: int, reservation_id: str):
+    return await run_in_threadpool(reservation_service.release_reservation, user_id, reservation_id)
@@ -0,0 +1,291 @@
+"""
+Usage analytics for administrators.
+
+Reports over date ranges read only the daily_usage rollup, which record_chat_usage
+maintains with every chat insert: a range of days is one index range on the
+rollup however many chats it covers. Ranges are [start, end) in UTC days.
+
+Ad-hoc group-bys that the rollup cannot answer (by hour, or over the chats of a
+range still in the database) stream the chats once and aggregate them in
+memory as NumPy columns, chunk by chunk, so memory grows with the number of
+groups rather than the number of chats.
+"""
+from datetime import date, datetime, time, timedelta
+from operator import attrgetter, itemgetter
+from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from ..database import models
+from ..database.database import read_only
+from ..money import from_micros
+from .pagination import count_rows
+
+DEFAULT_RANGE_DAYS = 30
+GROUP_BY_BATCH_SIZE = 50000
+GROUP_BY_DIMENSIONS = ("user_id", "model_name", "day", "hour")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def date_range(start: Optional[date] = None, end: Optional[date] = None):
+    """
+    Fill in a missing end with tomorrow (today included) and a missing start with
+    DEFAULT_RANGE_DAYS before the end, in UTC days like the rollup. Raises
+    ValueError if the range is empty.
+    """
+    end = end or datetime.utcnow().date() + timedelta(days=1)
+    start = start or end - timedelta(days=DEFAULT_RANGE_DAYS)
+    if start >= end:
+        raise ValueError("start must be before end")
+    return start, end
+
+def rollup_sums():
+    return (
+        func.sum(models.DailyUsage.chat_count).label("chats"),
+        func.sum(models.DailyUsage.tokens).label("tokens"),
+        func.sum(models.DailyUsage.cost_micros).label("cost_micros")
+    )
+
+def in_range(start: date, end: date):
+    return models.DailyUsage.day >= start, models.DailyUsage.day < end
+
+def totals(chats, tokens, cost_micros):
+    return {"chats": int(chats or 0), "tokens": int(tokens or 0), "cost": from_micros(int(cost_micros or 0))}
+
+@read_only
+def top_users(db: Session, start: date, end: date, metric: str = "cost", limit: int = 10):
+    """
+    The `limit` users with the highest chat count, tokens or cost over the range.
+    """
+    column = {"chats": "chats", "tokens": "tokens", "cost": "cost_micros"}[metric]
+    usage = select(models.DailyUsage.user_id, *rollup_sums()).where(
+        *in_range(start, end)
+    ).group_by(models.DailyUsage.user_id).subquery()
+    # Users are joined to the ranked rows only, not to every rollup row
+    ranked = select(usage).order_by(usage.c[column].desc(), usage.c.user_id).limit(limit).subquery()
+    rows = db.execute(
+        select(ranked, models.User.username).outerjoin(
+            models.User, models.User.id == ranked.c.user_id
+        ).order_by(ranked.c[column].desc(), ranked.c.user_id)
+    ).all()
+    return [
+        {"user_id": row.user_id, "username": row.username, **totals(row.chats, row.tokens, row.cost_micros)}
+        for row in rows
+    ]
+
+@read_only
+def model_mix(db: Session, start: date, end: date):
+    """
+    Chats, tokens and cost per model over the range, with each model's share of
+    the chats and of the cost.
+    """
+    rows = db.execute(
+        select(models.DailyUsage.model_name, *rollup_sums()).where(
+            *in_range(start, end)
+        ).group_by(models.DailyUsage.model_name).order_by(func.sum(models.DailyUsage.cost_micros).desc())
+    ).all()
+    all_chats = sum(row.chats for row in rows)
+    all_cost = sum(row.cost_micros for row in rows)
+    return [
+        {
+            "model_name": row.model_name,
+            **totals(row.chats, row.tokens, row.cost_micros),
+            "chat_share": row.chats / all_chats if all_chats else 0.0,
+            "cost_share": row.cost_micros / all_cost if all_cost else 0.0
+        }
+        for row in rows
+    ]
+
+@read_only
+def revenue(db: Session, start: date, end: date, group_by: str = "day"):
+    """
+    Credits spent on chats over the range, per day (days without chats are
+    omitted) or per subscription plan. Returns {"total": {...}, "items": [...]}.
+    """
+    if group_by == "plan":
+        usage = select(models.DailyUsage.plan_id, *rollup_sums()).where(
+            *in_range(start, end)
+        ).group_by(models.DailyUsage.plan_id).subquery()
+        rows = db.execute(
+            select(usage, models.SubscriptionPlan.name).outerjoin(
+                models.SubscriptionPlan, models.SubscriptionPlan.id == usage.c.plan_id
+            ).order_by(usage.c.cost_micros.desc(), usage.c.plan_id)
+        ).all()
+        items = [
+            {
+                # Chats made without an active plan (admins) are reported under no plan
+                "plan_id": row.plan_id or None,
+                "plan_name": row.name,
+                **totals(row.chats, row.tokens, row.cost_micros)
+            }
+            for row in rows
+        ]
+    else:
+        rows = db.execute(
+            select(models.DailyUsage.day, *rollup_sums()).where(
+                *in_range(start, end)
+            ).group_by(models.DailyUsage.day).order_by(models.DailyUsage.day)
+        ).all()
+        items = [{"day": row.day, **totals(row.chats, row.tokens, row.cost_micros)} for row in rows]
+
+    return {
+        "start": start,
+        "end": end,
+        "total": totals(
+            sum(row.chats for row in rows), sum(row.tokens for row in rows), sum(row.cost_micros for row in rows)
+        ),
+        "items": items
+    }
+
+@read_only
+def get_admin_stats(db: Session):
+    """
+    User counts (estimated on large PostgreSQL tables) and all-time credits spent on chats.
+    """
+    total_users, total_is_estimate = count_rows(db, select(models.User.id))
+    active_users, active_is_estimate = count_rows(db, select(models.User.id).where(models.User.is_active == True))
+    spent = db.execute(select(func.coalesce(func.sum(models.DailyUsage.cost_micros), 0))).scalar()
+    return {
+        "total_users": total_users,
+        "active_users": active_users,
+        "counts_are_estimates": total_is_estimate or active_is_estimate,
+        "total_revenue": from_micros(spent)
+    }
+
+def group_codes(keys: list, size: int):
+    """
+    Dense group numbers for the `size` rows of the NumPy columns `keys`: rows with
+    equal values in every column get the same number. Returns (group of each row,
+    index of one row of each group).
+    """
+    import numpy as np
+
+    combined = np.zeros(size, dtype=np.int64)
+    for column in keys:
+        unique, codes = np.unique(column, return_inverse=True)
+        # Re-densified after every column, so the combined code stays below rows * values
+        _, combined = np.unique(combined * len(unique) + codes, return_inverse=True)
+    _, first = np.unique(combined, return_index=True)
+    return combined, first
+
+def aggregate_columns(columns: dict, by: list, values: dict):
+    """
+    Group-by over NumPy columns: the rows are grouped on the `by` columns and each
+    of the int64 `values` columns is summed exactly per group.
+    Returns (key columns, summed columns), one entry per group.
+    """
+    import numpy as np
+
+    size = len(values["chats"])
+    groups, first = group_codes([columns[name] for name in by], size)
+    order = np.argsort(groups, kind="stable")
+    starts = np.searchsorted(groups[order], np.arange(len(first)))
+    keys = {name: columns[name][first] for name in by}
+    sums = {name: np.add.reduceat(column[order], starts) for name, column in values.items()}
+    return keys, sums
+
+def chat_rows(start: date, end: date):
+    """
+    (user_id, model_name, created_at, tokens, cost_micros) of the chats created in
+    the range, fetched GROUP_BY_BATCH_SIZE at a time.
+    """
+    return select(
+        models.Chat.user_id,
+        func.coalesce(models.Chat.model_name, ""),
+        models.Chat.created_at,
+        func.coalesce(models.Chat.input_tokens, 0) + func.coalesce(models.Chat.output_tokens, 0),
+        func.coalesce(models.Chat.cost_micros, 0)
+    ).where(
+        models.Chat.created_at >= datetime.combine(start, time()),
+        models.Chat.created_at < datetime.combine(end, time())
+    ).execution_options(yield_per=GROUP_BY_BATCH_SIZE)
+
+def chat_columns(rows: list, by: list, model_codes: dict):
+    """
+    NumPy columns of one chunk of chat_rows. Model names are dictionary-encoded
+    as integer codes through `model_codes`, shared by all chunks of a scan.
+    """
+    import numpy as np
+
+    size = len(rows)
+
+    def column(index, convert=None):
+        values = map(itemgetter(index), rows)
+        return np.fromiter(map(convert, values) if convert else values, dtype=np.int64, count=size)
+
+    columns = {}
+    if "user_id" in by:
+        columns["user_id"] = column(0)
+    if "model_name" in by:
+        columns["model_name"] = column(1, lambda name: model_codes.setdefault(name, len(model_codes)))
+    if "day" in by or "hour" in by:
+        # Built from integer day numbers: much faster than converting datetime objects,
+        # and the zone PostgreSQL attaches to the naive UTC timestamps is ignored
+        days = column(2, date.toordinal) - EPOCH_ORDINAL
+        if "day" in by:
+            columns["day"] = days.astype("datetime64[D]")
+        if "hour" in by:
+            columns["hour"] = (days * 24 + column(2, attrgetter("hour"))).astype("datetime64[h]")
+    values = {
+        "chats": np.ones(size, dtype=np.int64),
+        "tokens": column(3),
+        "cost_micros": column(4)
+    }
+    return columns, values
+
+@read_only
+def group_chats(db: Session, start: date, end: date, by: list, limit: int = 1000):
+    """
+    Chats, tokens and cost of the chats created in the range, grouped by any of
+    GROUP_BY_DIMENSIONS, highest cost first. Each chunk of chats is reduced to
+    its groups as it arrives and the partial groups are merged at the end.
+    Returns {"groups": total number of groups, "chats_scanned": ..., "items": [...]}.
+    """
+    import numpy as np
+
+    # Through the session's connection: plain Core rows, without the ORM result layer per chunk
+    result = db.connection().execute(chat_rows(start, end))
+
+    partial_keys = []
+    partial_sums = []
+    model_codes = {}
+    scanned = 0
+    for rows in result.partitions():
+        scanned += len(rows)
+        columns, values = chat_columns(rows, by, model_codes)
+        keys, sums = aggregate_columns(columns, by, values)
+        partial_keys.append(keys)
+        partial_sums.append(sums)
+
+    if not partial_sums:
+        return {"groups": 0, "chats_scanned": 0, "items": []}
+
+    keys, sums = aggregate_columns(
+        {name: np.concatenate([keys[name] for keys in partial_keys]) for name in by},
+        by,
+        {name: np.concatenate([sums[name] for sums in partial_sums]) for name in partial_sums[0]}
+    )
+    if "model_name" in by:
+        keys["model_name"] = np.array(list(model_codes), dtype=object)[keys["model_name"]]
+    # Highest cost first; ties keep the grouping order
+    order = np.argsort(-sums["cost_micros"], kind="stable")[:limit]
+    key_lists = {name: keys[name][order].tolist() for name in by}
+    sum_lists = {name: sums[name][order].tolist() for name in sums}
+    items = [
+        {
+            **{name: key_lists[name][index] for name in by},
+            **totals(sum_lists["chats"][index], sum_lists["tokens"][index], sum_lists["cost_micros"][index])
+        }
+        for index in range(len(order))
+    ]
+    return {"groups": len(sums["chats"]), "chats_scanned": scanned, "items": items}
+
+def run_group_chats(start: date, end: date, by: list, limit: int = 1000):
+    """
+    group_chats with a dedicated session, for running the scan on a worker thread.
+    """
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return group_chats(db, start, end, by, limit)
+    finally:
+        db.close()
@@ -1,35 +1,135 @@
-from datetime import datetime, timedelta
+import hashlib
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import and_, select
 from sqlalchemy.orm import Session
-from . import database, models, schemas
+from ..database import database, models
+from ..models import schemas
+from .metrics import PASSWORD_HASH_LATENCY
+from .principal_cache import Principal, principal_cache
+from .token_revocation import revocation_list
 
 # Security configuration
 SECRET_KEY = "your-secret-key-change-this-in-production"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Access tokens carry the user's claims and are not looked up, so they are kept short-lived
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# Changing the cost re-hashes each user's password at their next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Static bearer token a Prometheus scraper presents on /metrics instead of an admin's access token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    started = time.perf_counter()
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    finally:
+        PASSWORD_HASH_LATENCY.observe(time.perf_counter() - started, ("verify",))
+
+def verify_and_update_password(plain_password, hashed_password):
+    """
+    Verify a password and, if the hash uses outdated parameters, return a new one.
+    Returns (valid, new_hash or None).
+    """
+    started = time.perf_counter()
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    finally:
+        PASSWORD_HASH_LATENCY.observe(time.perf_counter() - started, ("verify",))
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    started = time.perf_counter()
+    try:
+        return pwd_context.hash(password)
+    finally:
+        PASSWORD_HASH_LATENCY.observe(time.perf_counter() - started, ("hash",))
 
 def get_user(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+def get_login_user(db: Session, username: str):
+    """
+    Load a user detached from the session and end the read transaction, so the
+    pooled connection is not held while the password is verified.
+    """
+    user = get_user(db, username)
+    if user is not None:
+        db.expunge(user)
+    db.rollback()
+    return user
+
+def get_principal(db: Session, username: str):
+    """
+    Load the authorization snapshot of a user and their active plan in one query.
+    """
+    return _load_principal(db, models.User.username == username)
+
+def get_principal_by_id(db: Session, user_id: int):
+    return _load_principal(db, models.User.id == user_id)
+
+def _load_principal(db: Session, condition):
+    row = db.execute(
+        select(
+            models.User.id,
+            models.User.username,
+            models.User.role,
+            models.User.is_active,
+            models.SubscriptionPlan.id,
+            models.SubscriptionPlan.can_access_vip_models,
+            models.Subscription.end_date
+        ).outerjoin(
+            models.Subscription,
+            and_(models.Subscription.user_id == models.User.id, models.Subscription.is_active == True)
+        ).outerjoin(
+            models.SubscriptionPlan, models.SubscriptionPlan.id == models.Subscription.plan_id
+        ).where(condition).order_by(models.Subscription.end_date.desc().nulls_last()).limit(1)
+    ).first()
+    if row is None:
+        return None
+    
+    user_id, username, role, is_active, plan_id, can_access_vip_models, end_date = row
+    if end_date is not None and end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=timezone.utc)
+    return Principal(
+        id=user_id,
+        username=username,
+        role=role.value if role else models.UserRole.USER.value,
+        is_active=bool(is_active),
+        plan_id=plan_id,
+        can_access_vip_models=bool(can_access_vip_models),
+        plan_expires_at=end_date.timestamp() if end_date is not None else None
+    )
+
 def authenticate_user(db: Session, username: str, password: str):
     user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return False
+    valid, new_hash = verify_and_update_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}, synchronize_session=False
+    )
+    db.commit()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -40,7 +140,142 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(db: Session = Depends(database.get_db), token: str = Depends(oauth2_scheme)):
+def create_principal_token(principal: Principal):
+    """
+    Access token embedding everything get_current_user needs, so requests
+    carrying it are authorized without touching the database.
+    """
+    return create_access_token(data={
+        "sub": principal.username,
+        "uid": principal.id,
+        "role": principal.role,
+        "act": principal.is_active,
+        "plan": principal.plan_id,
+        "vip": principal.can_access_vip_models,
+        "pexp": principal.plan_expires_at,
+        "iat": int(time.time()),
+        "jti": uuid.uuid4().hex
+    })
+
+def principal_from_claims(payload: dict):
+    return Principal(
+        id=payload["uid"],
+        username=payload["sub"],
+        role=payload["role"],
+        is_active=payload["act"],
+        plan_id=payload["plan"],
+        can_access_vip_models=payload["vip"],
+        plan_expires_at=payload.get("pexp")
+    )
+
+def revoke_access_token(db: Session, token: str):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return
+    if "jti" in payload:
+        revocation_list.revoke_token(db, payload["jti"])
+
+def hash_refresh_token(refresh_token: str):
+    # Refresh tokens are 256 random bits, so a fast hash is enough; bcrypt would buy nothing
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def _issue_tokens(db: Session, principal: Principal, family_id: str):
+    refresh_token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        user_id=principal.id,
+        token_hash=hash_refresh_token(refresh_token),
+        family_id=family_id,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    db.commit()
+    return {
+        "access_token": create_principal_token(principal),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+def create_token_pair(db: Session, user_id: int):
+    """
+    Start a new refresh token family for a password login. Also drops the
+    user's expired refresh tokens, which keeps the table bounded per user.
+    """
+    principal = get_principal_by_id(db, user_id)
+    if principal is None:
+        return None
+    
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user_id,
+        models.RefreshToken.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    return _issue_tokens(db, principal, uuid.uuid4().hex)
+
+def rotate_refresh_token(db: Session, refresh_token: str):
+    """
+    Exchange a refresh token for a new access and refresh token. Each refresh
+    token is single use: presenting one that was already rotated revokes its
+    whole family, since either the client or an attacker holds a stolen copy.
+    """
+    db_token = db.query(models.RefreshToken).filter(
+        models.RefreshToken.token_hash == hash_refresh_token(refresh_token)
+    ).first()
+    if db_token is None:
+        return None
+    if db_token.revoked_at is not None:
+        revoke_token_family(db, db_token.family_id)
+        return None
+    
+    now = datetime.utcnow()
+    # Conditional update, so two concurrent refreshes cannot both succeed
+    rotated = db.query(models.RefreshToken).filter(
+        models.RefreshToken.id == db_token.id,
+        models.RefreshToken.revoked_at.is_(None),
+        models.RefreshToken.expires_at > now
+    ).update({models.RefreshToken.revoked_at: now}, synchronize_session=False)
+    if not rotated:
+        db.rollback()
+        return None
+    
+    principal = get_principal_by_id(db, db_token.user_id)
+    if principal is None or not principal.is_active:
+        revoke_token_family(db, db_token.family_id)
+        return None
+    
+    # Rotated tokens are kept until they expire, so replaying any of them revokes the family
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.family_id == db_token.family_id,
+        models.RefreshToken.expires_at <= now
+    ).delete(synchronize_session=False)
+    return _issue_tokens(db, principal, db_token.family_id)
+
+def revoke_token_family(db: Session, family_id: str):
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.family_id == family_id,
+        models.RefreshToken.revoked_at.is_(None)
+    ).update({models.RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+def revoke_refresh_token(db: Session, refresh_token: str):
+    db_token = db.query(models.RefreshToken).filter(
+        models.RefreshToken.token_hash == hash_refresh_token(refresh_token)
+    ).first()
+    if db_token is not None:
+        revoke_token_family(db, db_token.family_id)
+
+def revoke_user_refresh_tokens(db: Session, user_id: int):
+    """
+    End every session of a user at its next refresh. Does not commit.
+    """
+    revoke_users_refresh_tokens(db, [user_id])
+
+def revoke_users_refresh_tokens(db: Session, user_ids: list):
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id.in_(user_ids),
+        models.RefreshToken.revoked_at.is_(None)
+    ).update({models.RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+
+async def get_current_user(db = Depends(database.get_async_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -54,12 +289,41 @@ async def get_current_user(db: Session = Depends(database.get_db), token: str =
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
+    
+    if "uid" in payload:
+        if revocation_list.is_revoked(payload.get("jti")):
+            raise credentials_exception
+        plan_expires_at = payload.get("pexp")
+        if not revocation_list.claims_stale(payload["uid"], payload.get("iat", 0)) and (
+            plan_expires_at is None or time.time() < plan_expires_at
+        ):
+            return principal_from_claims(payload)
+    
+    # Tokens without claims, whose claims changed since they were issued, or
+    # whose plan has ended since, are authorized from a fresh snapshot
+    principal = principal_cache.get(token_data.username)
+    if principal is None:
+        version = principal_cache.version()
+        principal = await db.run_sync(get_principal, token_data.username)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.put(token_data.username, principal, version)
+    return principal
 
-async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_admin_user(current_user: Principal = Depends(get_current_active_user)):
+    if current_user.role != models.UserRole.ADMIN.value:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return current_user
+
+async def get_metrics_reader(db = Depends(database.get_async_db), token: str = Depends(oauth2_scheme)):
+    """
+    Admit a request carrying METRICS_TOKEN, when one is configured, or an admin's access token.
+    """
+    if METRICS_TOKEN and secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return None
+    return await get_current_admin_user(await get_current_active_user(await get_current_user(db, token)))
\ No newline at end of file
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from ..database import models
+from ..models import schemas
+
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "30"))
+PLANS_VERSION = "subscription_plans"
+# Distinct (skip, limit) pages of the plan list kept serialized per snapshot
+PLAN_PAGE_CACHE_SIZE = 64
+
+BASE = "base"
+VIP = "vip"
+ADMIN = "admin"
+
+class ModelEntry(NamedTuple):
+    name: str
+    description: str
+    capability: str
+
+MODELS = (
+    ModelEntry("gpt-3.5-turbo", "GPT-3.5 Turbo model", BASE),
+    ModelEntry("llama-2", "Llama 2 model", BASE),
+    ModelEntry("gpt-4", "GPT-4 model", VIP),
+    ModelEntry("vip-gpt-4", "VIP GPT-4 model", VIP),
+    ModelEntry("admin-gpt-4", "Admin GPT-4 model", ADMIN)
+)
+# Capabilities of models not listed above, by name prefix; anything else is a base model
+MODEL_PREFIXES = (("vip_", VIP), ("vip-", VIP), ("admin-", ADMIN))
+
+MODEL_CAPABILITIES = {entry.name: entry.capability for entry in MODELS}
+
+def required_capability(model_name: str):
+    capability = MODEL_CAPABILITIES.get(model_name)
+    if capability is not None:
+        return capability
+    for prefix, capability in MODEL_PREFIXES:
+        if model_name.startswith(prefix):
+            return capability
+    return BASE
+
+def can_use_model(model_name: str, is_admin: bool, can_access_vip_models: bool):
+    capability = required_capability(model_name)
+    if capability == BASE or is_admin:
+        return True
+    return capability == VIP and can_access_vip_models
+
+def render_json(content):
+    # Same encoding as FastAPI's JSONResponse, so cached bodies are byte-identical
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    return body, '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or "W/" + etag in candidates
+
+def cached_json_response(request: Request, body: bytes, etag: str, private: bool = False):
+    """
+    Serve a pre-rendered JSON body, or 304 when the client already holds it.
+    Clients must revalidate on every use, so a changed catalog is seen at once.
+    """
+    headers = {"ETag": etag, "Cache-Control": ("private" if private else "public") + ", no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def model_listing(is_admin: bool, can_access_vip_models: bool):
+    return [
+        {"name": entry.name, "description": entry.description, "requires_vip": entry.capability == VIP}
+        for entry in MODELS
+        if entry.capability == BASE or is_admin or (entry.capability == VIP and can_access_vip_models)
+    ]
+
+# The model list only depends on these two flags, so every variant is rendered once at import
+MODEL_LISTINGS = {
+    (is_admin, can_access_vip_models): render_json(model_listing(is_admin, can_access_vip_models))
+    for is_admin in (False, True)
+    for can_access_vip_models in (False, True)
+}
+
+def bump_version(db: Session, name: str):
+    """
+    Advance a catalog version so every worker reloads on its next check. Does not commit.
+    """
+    updated = db.execute(
+        update(models.CatalogVersion).where(models.CatalogVersion.name == name).values(
+            version=models.CatalogVersion.version + 1
+        )
+    ).rowcount
+    if not updated:
+        db.add(models.CatalogVersion(name=name, version=1))
+
+def load_plans_version(db: Session):
+    return db.execute(
+        select(models.CatalogVersion.version).where(models.CatalogVersion.name == PLANS_VERSION)
+    ).scalar() or 0
+
+class PlanCatalog:
+    """
+    Immutable snapshot of the subscription plans, in id order, with the
+    rendered plan list and per-plan lookups.
+    """
+    def __init__(self, plans, version):
+        self.version = version
+        self.plans = [schemas.SubscriptionPlanResponse.model_validate(plan) for plan in plans]
+        self.by_id = {plan.id: plan for plan in self.plans}
+        self._content = [plan.model_dump(mode="json") for plan in self.plans]
+        self._pages = {}
+
+    def page(self, skip: int, limit: int):
+        """
+        The rendered body and ETag of one page of the plan list.
+        """
+        page = self._pages.get((skip, limit))
+        if page is None:
+            page = render_json(self._content[skip:skip + limit])
+            if len(self._pages) < PLAN_PAGE_CACHE_SIZE:
+                self._pages[(skip, limit)] = page
+        return page
+
+class CatalogCache:
+    """
+    Process-wide holder of the PlanCatalog.
+
+    Requests are served from memory. At most once every refresh_seconds the
+    plans version is read, a single-row query, and the plans are reloaded only
+    when another worker (or this one) bumped it.
+    """
+    def __init__(self, refresh_seconds: float = CATALOG_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._catalog = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        The cached catalog, or None when it is due for a version check.
+        """
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.refresh_seconds:
+            return None
+        return self._catalog
+
+    def refresh(self, db: Session):
+        now = time.monotonic()
+        version = load_plans_version(db)
+        with self._lock:
+            if self._catalog is None or self._catalog.version != version:
+                plans = db.query(models.SubscriptionPlan).order_by(models.SubscriptionPlan.id).all()
+                self._catalog = PlanCatalog(plans, version)
+            self._checked_at = now
+            return self._catalog
+
+    def invalidate(self):
+        self._checked_at = None
+
+catalog_cache = CatalogCache()
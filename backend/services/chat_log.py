@@ -0,0 +1,446 @@
+"""
+Write-behind log of admitted chats.
+
+With CHAT_WRITE_BEHIND set, an admitted chat is not written by its request.
+It is appended to an in-process queue and to a local append-only journal, and
+the request is acknowledged once the journal is on disk; concurrent requests
+share one fsync (group commit). A background flusher then writes the queued
+chats every CHAT_FLUSH_INTERVAL_MS, or as soon as CHAT_FLUSH_BATCH_SIZE are
+waiting, each batch in a single commit, the same way settled reservations are
+written (chat_service.write_settled_chats).
+
+Until a chat is written its cost and tokens are held per user, and admission
+checks the database balance and monthly usage net of them, so limits stay
+exact within the process. Like the "memory" reservation backend, the holds
+are per process: with several workers each one enforces limits against the
+database plus its own queue.
+
+The journal is a directory of segment files, one per batch, each locked with
+flock while its process owns it. A segment is deleted after its chats are
+committed; the commit also records the segment in chat_log_batches, so on
+startup segments left behind by a crash are replayed exactly once.
+
+A segment the database rejects for anything but a connection or lock error is
+written chat by chat instead, and the chats it still rejects are set aside in
+CHAT_LOG_DIR/dead, so one bad chat cannot stall the queue behind it.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from fastapi import HTTPException, status
+from sqlalchemy import or_, select
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from .chat_service import write_settled_chats
+from .metrics import Counter, Gauge, registry
+from .usage_service import month_bucket
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CHAT_LOG_DIR = os.getenv("CHAT_LOG_DIR", "chat_log")
+CHAT_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "50"))
+CHAT_FLUSH_BATCH_SIZE = int(os.getenv("CHAT_FLUSH_BATCH_SIZE", "1000"))
+# Queued chats beyond which new chats are refused with 503 until the database catches up
+CHAT_LOG_MAX_QUEUED = int(os.getenv("CHAT_LOG_MAX_QUEUED", "100000"))
+# Without fsync a chat survives a process crash but not a power loss
+CHAT_LOG_FSYNC = os.getenv("CHAT_LOG_FSYNC", "true").lower() in ("1", "true", "yes")
+
+CHATS_FLUSHED = registry.register(Counter(
+    "chat_log_flushed_chats_total", "Chats written to the database by the write-behind flusher."
+))
+CHAT_FLUSHES = registry.register(Counter(
+    "chat_log_flushes_total", "Write-behind flush transactions, by outcome.", ("outcome",)
+))
+CHATS_REFUSED = registry.register(Counter(
+    "chat_log_refused_total", "Chats refused because the write-behind queue was full."
+))
+CHATS_DEAD_LETTERED = registry.register(Counter(
+    "chat_log_dead_lettered_total", "Chats the database rejected, set aside in the dead letter directory."
+))
+
+# Returned by ChatLog.hold when a flush committed after the caller read the database
+STALE = object()
+
+logger = logging.getLogger(__name__)
+
+def busy():
+    CHATS_REFUSED.inc()
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Chat recording is backlogged, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+def encode_event(event: dict):
+    return (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+
+def transient(error: Exception):
+    """
+    Whether a failed write may succeed when retried as is: the database was
+    unreachable or busy, rather than rejecting the chats.
+    """
+    return isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError))
+
+class Segment:
+    """
+    One journal file and the chats appended to it, in order.
+    """
+    def __init__(self, path: str, file, events: list):
+        self.id = os.path.basename(path)[:-len(".log")]
+        self.path = path
+        self.file = file
+        self.events = events
+        self.written = len(events)
+        self.synced = self.written
+        # Set once the segment was rejected as a whole; it is then written chat by chat
+        self.split = False
+        self._sync_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, directory: str):
+        path = os.path.join(directory, f"{time.time_ns():020d}-{uuid.uuid4().hex[:12]}.log")
+        file = open(path, "ab")
+        # Held until the segment is deleted, so recovery in another process leaves it alone
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return cls(path, file, [])
+
+    @classmethod
+    def recover(cls, path: str):
+        """
+        Take over a segment file left by another process, or return None if its
+        owner is still running. A torn last line from a crash mid-write is dropped:
+        that chat was never acknowledged.
+        """
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        events = []
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+        return cls(path, file, events)
+
+    def append(self, event: dict):
+        """
+        Write one chat to the file (not yet synced). Returns its sequence number.
+        Callers serialize appends.
+        """
+        self.file.write(encode_event(event))
+        self.file.flush()
+        self.events.append(event)
+        self.written += 1
+        return self.written
+
+    def sync(self, seq: int):
+        """
+        Make the chats up to `seq` durable. One fsync covers every chat written
+        before it started, so concurrent callers mostly find their chat synced.
+        """
+        if self.synced >= seq:
+            return
+        with self._sync_lock:
+            if self.synced >= seq:
+                return
+            target = self.written
+            os.fsync(self.file.fileno())
+            self.synced = target
+
+    def remove(self):
+        """
+        Delete the file once its chats are committed to the database.
+        """
+        with self._sync_lock:
+            self.synced = self.written
+            os.remove(self.path)
+            self.file.close()
+
+class ChatLog:
+    """
+    The in-process queue of admitted chats, its journal and the per-user holds.
+    """
+    def __init__(self, directory: str = CHAT_LOG_DIR, batch_size: int = CHAT_FLUSH_BATCH_SIZE,
+                 max_queued: int = CHAT_LOG_MAX_QUEUED, fsync: bool = CHAT_LOG_FSYNC):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.max_queued = max_queued
+        self.fsync = fsync
+        # Bumped after every flush commit, once its holds are released
+        self.generation = 0
+        self._segment = None
+        self._sealed = deque()
+        self._queued = 0
+        self._held_cost = {}
+        self._held_tokens = {}
+        self._completed = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def held(self, user_id: int, month: datetime):
+        """
+        Cost and monthly tokens of the user's chats not yet written, as (micro-credits, tokens).
+        """
+        with self._lock:
+            return self._held_cost.get(user_id, 0), self._held_tokens.get((user_id, month), 0)
+
+    def hold(self, user_id: int, month: datetime, cost: int, tokens: int, generation: int, check):
+        """
+        Atomically run `check(held_cost, held_tokens)` and, if it passes, hold the
+        chat's cost and tokens. Returns the check's error, None once held, or
+        STALE when a flush committed since `generation` was read, in which case
+        the caller's database read may predate it and must be repeated.
+        """
+        with self._lock:
+            if self.generation != generation:
+                return STALE
+            if self._queued >= self.max_queued:
+                raise busy()
+            error = check(self._held_cost.get(user_id, 0), self._held_tokens.get((user_id, month), 0))
+            if error:
+                return error
+            self._held_cost[user_id] = self._held_cost.get(user_id, 0) + cost
+            self._held_tokens[(user_id, month)] = self._held_tokens.get((user_id, month), 0) + tokens
+            self._queued += 1
+            return None
+
+    def _release(self, user_id: int, month: datetime, cost: int, tokens: int):
+        remaining = self._held_cost.get(user_id, 0) - cost
+        if remaining > 0:
+            self._held_cost[user_id] = remaining
+        else:
+            self._held_cost.pop(user_id, None)
+        remaining = self._held_tokens.get((user_id, month), 0) - tokens
+        if remaining > 0:
+            self._held_tokens[(user_id, month)] = remaining
+        else:
+            self._held_tokens.pop((user_id, month), None)
+        self._queued -= 1
+
+    def release(self, user_id: int, month: datetime, cost: int, tokens: int):
+        """
+        Drop a hold whose chat was refused after all.
+        """
+        with self._lock:
+            self._release(user_id, month, cost, tokens)
+
+    def _seal(self):
+        self._sealed.append(self._segment)
+        self._segment = None
+
+    def append(self, event: dict):
+        """
+        Queue a held chat. Returns a ticket for wait_durable.
+        """
+        with self._lock:
+            if self._segment is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._segment = Segment.create(self.directory)
+            segment = self._segment
+            seq = segment.append(event)
+            if len(segment.events) >= self.batch_size:
+                self._seal()
+                self._wake()
+        return segment, seq
+
+    def wait_durable(self, ticket):
+        if self.fsync:
+            segment, seq = ticket
+            segment.sync(seq)
+
+    def _wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def flush(self, db: Session):
+        """
+        Write every queued chat, one segment per transaction.
+        Returns the number of chats written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._segment is not None and self._segment.events:
+                    self._seal()
+                segments = list(self._sealed)
+            flushed = 0
+            for segment in segments:
+                try:
+                    markers, written = self._write(db, segment)
+                except Exception:
+                    db.rollback()
+                    CHAT_FLUSHES.inc(("failed",))
+                    raise
+                with self._lock:
+                    self._sealed.popleft()
+                    for event in segment.events:
+                        self._release(
+                            event["user_id"], month_bucket(datetime.fromisoformat(event["created_at"])),
+                            event["cost"], event["input_tokens"] + event["output_tokens"]
+                        )
+                    self.generation += 1
+                segment.remove()
+                self._completed.extend(markers)
+                flushed += written
+                CHAT_FLUSHES.inc(("committed",))
+                CHATS_FLUSHED.inc(amount=written)
+            return flushed
+
+    def _write(self, db: Session, segment: Segment):
+        """
+        Write a segment's chats in one transaction, or chat by chat once the
+        database has rejected the segment. Returns the flush records written,
+        to be deleted after the segment file, and the number of chats written.
+        """
+        if not segment.split:
+            try:
+                write_settled_chats(db, segment.id, segment.events, self._completed)
+                self._completed = []
+                return [segment.id], len(segment.events)
+            except Exception as error:
+                db.rollback()
+                if transient(error):
+                    raise
+                logger.exception("Chat log segment %s rejected, writing its chats one by one", segment.id)
+                segment.split = True
+        return self._write_split(db, segment)
+
+    def _write_split(self, db: Session, segment: Segment):
+        """
+        Write each chat of a rejected segment in its own transaction, recorded as
+        "<segment>:<index>" so a retry or replay skips it, and dead-letter the
+        chats the database still rejects.
+        """
+        prefix = segment.id + ":"
+        done = set(db.execute(
+            select(models.ChatLogBatch.id).where(models.ChatLogBatch.id.startswith(prefix, autoescape=True))
+        ).scalars())
+        db.rollback()
+        markers = []
+        written = 0
+        for index, event in enumerate(segment.events):
+            marker = prefix + str(index)
+            markers.append(marker)
+            if marker in done:
+                continue
+            try:
+                write_settled_chats(db, marker, [event])
+                written += 1
+            except Exception as error:
+                db.rollback()
+                if transient(error):
+                    raise
+                logger.exception("Chat %d of chat log segment %s rejected, dead-lettered", index, segment.id)
+                self._dead_letter(segment, event)
+                db.add(models.ChatLogBatch(id=marker))
+                db.commit()
+        return markers, written
+
+    def _dead_letter(self, segment: Segment, event: dict):
+        """
+        Keep a rejected chat on disk, outside the journal, for inspection and manual replay.
+        """
+        directory = os.path.join(self.directory, "dead")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, segment.id + ".log"), "ab") as file:
+            file.write(encode_event(event))
+            file.flush()
+            os.fsync(file.fileno())
+        CHATS_DEAD_LETTERED.inc()
+
+    def recover(self, db: Session):
+        """
+        Replay the segments left in the journal directory by a crashed process.
+        Returns the number of chats written.
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        recovered = 0
+        with self._flush_lock:
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".log"):
+                    continue
+                segment = Segment.recover(os.path.join(self.directory, name))
+                if segment is None:
+                    continue
+                markers = set(db.execute(
+                    select(models.ChatLogBatch.id).where(or_(
+                        models.ChatLogBatch.id == segment.id,
+                        models.ChatLogBatch.id.startswith(segment.id + ":", autoescape=True)
+                    ))
+                ).scalars())
+                db.rollback()
+                if segment.id in markers:
+                    markers = [segment.id]
+                else:
+                    # Per-chat records mean the crash interrupted a chat by chat write
+                    segment.split = bool(markers)
+                    markers, written = self._write(db, segment)
+                    recovered += written
+                    CHATS_FLUSHED.inc(amount=written)
+                segment.remove()
+                self._completed.extend(markers)
+        return recovered
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self._queued, "sealed_segments": len(self._sealed), "held_users": len(self._held_cost)}
+
+    async def run_flusher(self):
+        """
+        Background task flushing every CHAT_FLUSH_INTERVAL_MS, or early when a
+        batch fills up. Replays the journal left by a previous process first.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            recovered = await run_in_threadpool(flush_chat_log, self.recover)
+            if recovered:
+                logger.info("Replayed %d journaled chats", recovered)
+        except Exception:
+            logger.exception("Chat log recovery failed")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), CHAT_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_in_threadpool(flush_chat_log)
+            except Exception:
+                # The segment stays queued and its holds in place; retry on the next tick
+                logger.exception("Chat log flush failed")
+
+chat_log = ChatLog()
+
+registry.register(Gauge(
+    "chat_log_queued_chats", "Chats admitted in write-behind mode and not yet written.", (),
+    lambda: {(): chat_log.stats()["queued"]}
+))
+
+def flush_chat_log(operation=None):
+    """
+    Flush (or run `operation(db)` on) the chat log with a dedicated session.
+    """
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return (operation or chat_log.flush)(db)
+    finally:
+        db.close()
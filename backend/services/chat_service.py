@@ -1,119 +1,175 @@
-from datetime import datetime
+from datetime import datetime, time
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
-from ..database import models, schemas
+from ..database import models
+from ..database.database import read_only
+from ..models import schemas
+from ..money import from_micros, to_micros
+from .pagination import keyset_page
+from .pricing_engine import pricing_engine
 
 def create_chat(db: Session, chat: schemas.ChatCreate, user_id: int):
+    from .usage_service import record_chat_usage
+    
+    cost_micros = to_micros(chat.cost)
     db_chat = models.Chat(
         user_id=user_id,
         model_name=chat.model_name,
         input_tokens=chat.input_tokens,
         output_tokens=chat.output_tokens,
-        cost=chat.cost
+        cost_micros=cost_micros,
+        created_at=datetime.utcnow()
     )
     db.add(db_chat)
+    record_chat_usage(
+        db, user_id, chat.input_tokens + chat.output_tokens, db_chat.created_at,
+        model_name=chat.model_name, cost_micros=cost_micros
+    )
     db.commit()
     db.refresh(db_chat)
     return db_chat
 
-def get_user_chats(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Chat).filter(
-        models.Chat.user_id == user_id
-    ).offset(skip).limit(limit).all()
+@read_only
+def get_user_chats(db: Session, user_id: int, cursor: str = None, limit: int = 100):
+    return keyset_page(
+        db.query(models.Chat).filter(models.Chat.user_id == user_id),
+        models.Chat.created_at, models.Chat.id, cursor, limit
+    )
 
 def get_chat(db: Session, chat_id: int):
     return db.query(models.Chat).filter(models.Chat.id == chat_id).first()
 
 def calculate_chat_cost(input_tokens: int, output_tokens: int, model_name: str):
     """
-    Calculate the cost of a chat based on input and output tokens.
-    This is a simplified pricing model - in production, you'd want more sophisticated pricing.
+    Calculate the cost of a chat in micro-credits based on input and output tokens.
+    Prices come from the model_prices table through the cached pricing engine.
     """
-    # Example pricing (these would be configurable in a real system)
-    pricing = {
-        "gpt-3.5-turbo": {"input": 0.0015, "output": 0.002},
-        "gpt-4": {"input": 0.03, "output": 0.06},
-        "llama-2": {"input": 0.0005, "output": 0.0005},
-        "vip-gpt-4": {"input": 0.05, "output": 0.10}
-    }
-    
-    if model_name not in pricing:
-        # Default pricing
-        input_price = 0.001
-        output_price = 0.002
-    else:
-        input_price = pricing[model_name]["input"]
-        output_price = pricing[model_name]["output"]
-    
-    # Convert token counts to thousands for pricing
-    input_cost = (input_tokens / 1000) * input_price
-    output_cost = (output_tokens / 1000) * output_price
+    return pricing_engine.cost(model_name, input_tokens, output_tokens)
+
+def admit_chat_request(db: Session, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
+    """
+    Admit a chat in the configured recording mode.
+    Returns (chat, error, ticket); the ticket is only set when the chat was
+    queued in the write-behind log and must be waited on before acknowledging it.
+    """
+    from .admission_service import admit_chat, admit_chat_deferred
+    from .chat_log import CHAT_WRITE_BEHIND
     
-    return round(input_cost + output_cost, 4)
+    if CHAT_WRITE_BEHIND:
+        return admit_chat_deferred(db, user_id, model_name, input_tokens, output_tokens)
+    chat, error = admit_chat(db, user_id, model_name, input_tokens, output_tokens)
+    return chat, error, None
 
 def process_chat_request(db: Session, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
     """
     Process a chat request with validation and cost calculation.
     Returns the chat record if successful, None if failed.
+    In write-behind mode the chat is queued and returned once journaled, without an id.
     """
-    from .subscription_service import can_access_model, can_send_chat, deduct_credits
-    
-    # Check if user can access the model
-    if not can_access_model(db, user_id, model_name):
-        return None, "Access denied: Model not available for your subscription"
-    
-    # Check if user can send chat (rate limiting)
-    if not can_send_chat(db, user_id):
-        return None, "Rate limit exceeded: Too many requests"
+    from .chat_log import chat_log
     
-    # Calculate cost
-    cost = calculate_chat_cost(input_tokens, output_tokens, model_name)
-    
-    # Check if user has enough credits
-    from .user_service import get_user_balance
-    balance = get_user_balance(db, user_id)
-    if balance is None or balance < cost:
-        return None, "Insufficient credits"
-    
-    # Deduct credits
-    deduct_credits(db, user_id, cost, f"Chat with {model_name}")
-    
-    # Create chat record
-    chat = schemas.ChatCreate(
-        model_name=model_name,
-        input_tokens=input_tokens,
-        output_tokens=output_tokens,
-        cost=cost
-    )
-    
-    chat_record = create_chat(db, chat, user_id)
-    return chat_record, None
+    chat, error, ticket = admit_chat_request(db, user_id, model_name, input_tokens, output_tokens)
+    if ticket is not None:
+        chat_log.wait_durable(ticket)
+    return chat, error
+
+def write_settled_chats(db: Session, batch_id: str, chats: list, completed: list = ()):
+    """
+    Write a batch of chats admitted and charged outside the database, the
+    write-behind log's segments and the settled reservations: one multi-row
+    chat insert, one usage update per user, model and day, and one aggregated
+    CHAT_COST debit per user, recording the batch in chat_log_batches, all in
+    a single commit. `completed` are earlier batches no longer needed for
+    replay, whose records are deleted in the same commit.
+    """
+    from . import ledger
+    from .usage_service import day_bucket, record_chat_usage
+
+    now = datetime.utcnow()
+    rows = []
+    usage = {}
+    totals = {}
+    for chat in chats:
+        created_at = datetime.fromisoformat(chat["created_at"])
+        tokens = chat["input_tokens"] + chat["output_tokens"]
+        rows.append({
+            "user_id": chat["user_id"],
+            "model_name": chat["model_name"],
+            "input_tokens": chat["input_tokens"],
+            "output_tokens": chat["output_tokens"],
+            "cost_micros": chat["cost"],
+            "created_at": created_at
+        })
+        # Usage counts in the day, and so the month, the chat was made in, not the one it is written in
+        key = (chat["user_id"], chat["model_name"], datetime.combine(day_bucket(created_at), time()))
+        count, total_tokens, cost = usage.get(key, (0, 0, 0))
+        usage[key] = (count + 1, total_tokens + tokens, cost + chat["cost"])
+        count, cost = totals.get(chat["user_id"], (0, 0))
+        totals[chat["user_id"]] = (count + 1, cost + chat["cost"])
+
+    if rows:
+        db.execute(models.Chat.__table__.insert(), rows)
+        for (user_id, model_name, day), (count, tokens, cost) in usage.items():
+            record_chat_usage(db, user_id, tokens, day, chats=count, model_name=model_name, cost_micros=cost)
+        # The chats were admitted against held credits, so they are charged even if the balance is now short
+        ledger.apply_credit_changes(
+            db, {user_id: (-cost, f"Chat usage: {count} chats") for user_id, (count, cost) in totals.items()},
+            models.TransactionType.CHAT_COST, now, require_funds=False
+        )
+    db.add(models.ChatLogBatch(id=batch_id))
+    if completed:
+        db.execute(delete(models.ChatLogBatch).where(models.ChatLogBatch.id.in_(list(completed))))
+    db.commit()
 
-def get_chat_statistics(db: Session, user_id: int):
+def process_chat_batch(db: Session, records: list):
     """
-    Get chat statistics for a user.
+    Process a batch of gateway-recorded chats in one transaction.
+    Returns one result per record, in request order.
     """
-    chats = db.query(models.Chat).filter(models.Chat.user_id == user_id).all()
+    from .admission_service import admit_chat_batch
     
-    total_chats = len(chats)
-    total_tokens = sum(chat.input_tokens + chat.output_tokens for chat in chats)
-    total_cost = sum(chat.cost for chat in chats)
+    return admit_chat_batch(db, records)
+
+@read_only
+def get_chat_statistics(db: Session, user_id: int, start: datetime = None, end: datetime = None):
+    """
+    Get chat statistics for a user, optionally restricted to chats created in [start, end).
+    Without a date range the per-model totals are read from the incrementally
+    maintained user_model_stats table; with one they are aggregated in SQL.
+    """
+    if start is None and end is None:
+        rows = db.execute(
+            select(
+                models.UserModelStats.model_name,
+                models.UserModelStats.chat_count,
+                models.UserModelStats.tokens,
+                models.UserModelStats.cost_micros
+            ).where(models.UserModelStats.user_id == user_id)
+        ).all()
+    else:
+        conditions = [models.Chat.user_id == user_id]
+        if start is not None:
+            conditions.append(models.Chat.created_at >= start)
+        if end is not None:
+            conditions.append(models.Chat.created_at < end)
+        rows = db.execute(
+            select(
+                models.Chat.model_name,
+                func.count(models.Chat.id),
+                func.coalesce(func.sum(models.Chat.input_tokens + models.Chat.output_tokens), 0),
+                func.coalesce(func.sum(models.Chat.cost_micros), 0)
+            ).where(*conditions).group_by(models.Chat.model_name)
+        ).all()
     
-    # Group by model
-    model_stats = {}
-    for chat in chats:
-        if chat.model_name not in model_stats:
-            model_stats[chat.model_name] = {
-                "count": 0,
-                "tokens": 0,
-                "cost": 0
-            }
-        model_stats[chat.model_name]["count"] += 1
-        model_stats[chat.model_name]["tokens"] += chat.input_tokens + chat.output_tokens
-        model_stats[chat.model_name]["cost"] += chat.cost
+    # Costs are summed as integer micro-credits and converted once, so totals are exact
+    model_stats = {
+        model_name: {"count": count, "tokens": tokens, "cost": from_micros(cost)}
+        for model_name, count, tokens, cost in rows
+    }
     
     return {
-        "total_chats": total_chats,
-        "total_tokens": total_tokens,
-        "total_cost": total_cost,
+        "total_chats": sum(count for _, count, _, _ in rows),
+        "total_tokens": sum(tokens for _, _, tokens, _ in rows),
+        "total_cost": from_micros(sum(cost for _, _, _, cost in rows)),
         "model_stats": model_stats
-    }
\ No newline at end of file
+    }
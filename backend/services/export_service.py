@@ -0,0 +1,108 @@
+import csv
+import enum
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select
+from ..database import models
+from ..database.database import SessionLocal
+from ..money import from_micros
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+# Money columns are exported in credits under their original names, like every JSON endpoint
+TRANSACTION_COLUMNS = [
+    models.Transaction.id,
+    models.Transaction.amount_micros.label("amount"),
+    models.Transaction.transaction_type,
+    models.Transaction.description,
+    models.Transaction.balance_after_micros.label("balance_after"),
+    models.Transaction.created_at
+]
+
+CHAT_COLUMNS = [
+    models.Chat.id,
+    models.Chat.model_name,
+    models.Chat.input_tokens,
+    models.Chat.output_tokens,
+    models.Chat.cost_micros.label("cost"),
+    models.Chat.created_at
+]
+MONEY_COLUMNS = {"amount", "balance_after", "cost"}
+
+def plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+def encode_ndjson(names: list, rows):
+    return "".join(
+        json.dumps(dict(zip(names, map(plain, row))), separators=(",", ":")) + "\n"
+        for row in rows
+    )
+
+def encode_csv(names: list, rows, header: bool = False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(names)
+    writer.writerows([plain(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+def in_credits(names: list, rows):
+    """
+    `rows` with the micro-credit values of MONEY_COLUMNS converted to credits.
+    """
+    money = [index for index, name in enumerate(names) if name in MONEY_COLUMNS]
+    if not money:
+        return rows
+    converted = []
+    for row in rows:
+        row = list(row)
+        for index in money:
+            row[index] = from_micros(row[index])
+        converted.append(row)
+    return converted
+
+def stream_export(model, columns: list, user_id: int, fmt: str, start: datetime = None, end: datetime = None):
+    """
+    Yield a user's rows of `model` in (created_at, id) order, encoded as NDJSON or CSV.
+    Rows are read through a server-side cursor one batch at a time, so memory stays
+    constant however long the ledger is. The generator owns its session because it
+    outlives the request handler.
+    """
+    names = [column.key for column in columns]
+    conditions = [model.user_id == user_id]
+    if start is not None:
+        conditions.append(model.created_at >= start)
+    if end is not None:
+        conditions.append(model.created_at < end)
+
+    db = SessionLocal()
+    # Exports are read-only, so serve them from the replica when one is configured
+    db.info["use_replica"] = True
+    try:
+        result = db.execute(
+            select(*columns).where(*conditions).order_by(
+                model.created_at, model.id
+            ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        if fmt == "csv":
+            yield encode_csv(names, [], header=True)
+        for rows in result.partitions():
+            rows = in_credits(names, rows)
+            yield encode_csv(names, rows) if fmt == "csv" else encode_ndjson(names, rows)
+    finally:
+        db.close()
+
+def stream_transactions(user_id: int, fmt: str, start: datetime = None, end: datetime = None):
+    return stream_export(models.Transaction, TRANSACTION_COLUMNS, user_id, fmt, start, end)
+
+def stream_chats(user_id: int, fmt: str, start: datetime = None, end: datetime = None):
+    return stream_export(models.Chat, CHAT_COLUMNS, user_id, fmt, start, end)
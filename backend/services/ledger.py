@@ -0,0 +1,132 @@
+from datetime import datetime
+from sqlalchemy import case, literal, select, update
+from sqlalchemy.orm import Session
+from ..database import models
+from .reservation_store import reserved_credits
+
+TRANSACTION_COLUMNS = ["user_id", "amount_micros", "transaction_type", "description", "balance_after_micros", "created_at"]
+
+def apply_credit_change(
+    db: Session, user_id: int, amount: int, transaction_type: models.TransactionType,
+    description: str = "", created_at: datetime = None, require_funds: bool = True
+):
+    """
+    Add `amount` micro-credits (negative for debits) to a user's balance and record the Transaction.
+    A debit only applies if the balance net of the user's reserved credits covers it;
+    the check and the update are one conditional UPDATE, so concurrent changes can
+    neither be lost nor overdraw.
+    require_funds=False skips the check, for charging usage that has already happened.
+    Returns the new balance in micro-credits, or None if the user does not exist or cannot cover a debit.
+    Does not commit; callers write it in the same transaction as the rest of their change.
+    """
+    created_at = created_at or datetime.utcnow()
+    stmt = update(models.User).where(models.User.id == user_id)
+    if amount < 0 and require_funds:
+        reserved = reserved_credits([user_id]).get(user_id, 0)
+        stmt = stmt.where(models.User.credits_micros >= reserved - amount)
+    stmt = stmt.values(credits_micros=models.User.credits_micros + amount).returning(
+        models.User.id, models.User.credits_micros
+    )
+    # The users row changes behind any loaded User object; callers re-read it if needed
+    stmt = stmt.execution_options(synchronize_session=False)
+
+    if db.get_bind().dialect.name == "postgresql":
+        # One round trip: the UPDATE feeds the Transaction INSERT through a data-modifying CTE
+        changed = stmt.cte("changed")
+        return db.execute(
+            models.Transaction.__table__.insert().from_select(
+                TRANSACTION_COLUMNS,
+                select(
+                    changed.c.id,
+                    literal(amount, models.Transaction.amount_micros.type),
+                    literal(transaction_type, models.Transaction.transaction_type.type),
+                    literal(description, models.Transaction.description.type),
+                    changed.c.credits_micros,
+                    literal(created_at, models.Transaction.created_at.type)
+                )
+            ).returning(models.Transaction.balance_after_micros)
+        ).scalar()
+
+    row = db.execute(stmt).first()
+    if row is None:
+        return None
+    balance = row.credits_micros
+    db.execute(models.Transaction.__table__.insert().values(
+        user_id=user_id,
+        amount_micros=amount,
+        transaction_type=transaction_type,
+        description=description,
+        balance_after_micros=balance,
+        created_at=created_at
+    ))
+    return balance
+
+def credit(db: Session, user_id: int, amount: int, transaction_type: models.TransactionType, description: str = "", created_at: datetime = None):
+    return apply_credit_change(db, user_id, amount, transaction_type, description, created_at)
+
+def debit(
+    db: Session, user_id: int, amount: int, transaction_type: models.TransactionType,
+    description: str = "", created_at: datetime = None, require_funds: bool = True
+):
+    return apply_credit_change(db, user_id, -amount, transaction_type, description, created_at, require_funds)
+
+def apply_credit_changes(
+    db: Session, changes: dict, transaction_type: models.TransactionType,
+    created_at: datetime = None, require_funds: bool = True
+):
+    """
+    Batch form of apply_credit_change; `changes` maps user_id to (amount in
+    micro-credits, negative for debits, description). A single conditional UPDATE
+    applies every change, debits only where the balance net of reserved credits
+    covers them unless require_funds=False, and the Transactions of those are
+    written with one bulk insert.
+    Returns {user_id: new balance in micro-credits} for the changes that applied.
+    Does not commit.
+    """
+    if not changes:
+        return {}
+    created_at = created_at or datetime.utcnow()
+    amount = case({user_id: amount for user_id, (amount, _) in changes.items()}, value=models.User.id)
+    stmt = update(models.User).where(models.User.id.in_(list(changes)))
+    if require_funds:
+        reserved = reserved_credits([user_id for user_id, (change, _) in changes.items() if change < 0])
+        if reserved:
+            stmt = stmt.where(
+                models.User.credits_micros + amount >= case(reserved, value=models.User.id, else_=0)
+            )
+        else:
+            stmt = stmt.where(models.User.credits_micros + amount >= 0)
+    balances = dict(db.execute(
+        stmt.values(credits_micros=models.User.credits_micros + amount).returning(
+            models.User.id, models.User.credits_micros
+        ).execution_options(synchronize_session=False)
+    ).all())
+    if balances:
+        db.execute(models.Transaction.__table__.insert(), [
+            {
+                "user_id": user_id,
+                "amount_micros": changes[user_id][0],
+                "transaction_type": transaction_type,
+                "description": changes[user_id][1],
+                "balance_after_micros": balance,
+                "created_at": created_at
+            }
+            for user_id, balance in balances.items()
+        ])
+    return balances
+
+def credit_many(db: Session, credits: dict, transaction_type: models.TransactionType, created_at: datetime = None):
+    """
+    Credit several users at once; `credits` maps user_id to (amount, description).
+    """
+    return apply_credit_changes(db, credits, transaction_type, created_at, require_funds=False)
+
+def debit_many(db: Session, debits: dict, transaction_type: models.TransactionType, created_at: datetime = None):
+    """
+    Debit several users at once; `debits` maps user_id to (amount, description).
+    Only the debits each user's balance covers apply.
+    """
+    return apply_credit_changes(
+        db, {user_id: (-amount, description) for user_id, (amount, description) in debits.items()},
+        transaction_type, created_at
+    )
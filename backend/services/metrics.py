@@ -0,0 +1,211 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Adds X-DB-Queries and X-DB-Time-Ms to every response
+METRICS_DEBUG = os.getenv("METRICS_DEBUG", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labelnames: tuple, values: tuple, extra: str = ""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in values:
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    Prometheus histogram. Recording bumps one bucket; the cumulative counts the
+    text format needs are only computed when scraped.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, f'le="{format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(float(total))}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """
+    Gauge whose samples are read from `collect()` at scrape time,
+    as {label values: value}.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def pool_gauge_values():
+    from ..database.database import pool_stats
+
+    # Pools without checkout counters (SQLite's static and null pools) are skipped
+    return {(name,): stats["checkedout"] for name, stats in pool_stats().items() if "checkedout" in stats}
+
+registry = MetricsRegistry()
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route")
+))
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code.", ("method", "route", "status")
+))
+REQUEST_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "Database statements executed per HTTP request.", ("route",), QUERY_COUNT_BUCKETS
+))
+REQUEST_DB_TIME = registry.register(Histogram(
+    "http_request_db_duration_seconds", "Time spent in database statements per HTTP request.", ("route",)
+))
+QUERY_LATENCY = registry.register(Histogram(
+    "db_query_duration_seconds", "Latency of individual database statements."
+))
+PASSWORD_HASH_LATENCY = registry.register(Histogram(
+    "password_hash_duration_seconds", "Time spent hashing and verifying passwords.", ("operation",)
+))
+registry.register(Gauge(
+    "db_pool_checked_out_connections", "Connections currently checked out of each pool.", ("pool",),
+    pool_gauge_values
+))
+
+# [statement count, seconds] of the request being served; threadpool workers
+# run in a copy of the request's context and update the same list
+_request_queries = ContextVar("request_queries", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started_at"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started_at", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    QUERY_LATENCY.observe(elapsed)
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += elapsed
+
+def install_query_hooks():
+    """
+    Time every statement of every engine, including the async engines' sync cores.
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and database usage per route template.
+    Routes are labelled by their path template, so path parameters do not create series.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        status = [500]
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if METRICS_DEBUG:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-queries", str(queries[0]).encode()),
+                        (b"x-db-time-ms", f"{queries[1] * 1000:.2f}".encode())
+                    ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_queries.reset(token)
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            REQUEST_LATENCY.observe(elapsed, (scope["method"], route))
+            REQUESTS.inc((scope["method"], route, str(status[0])))
+            REQUEST_QUERIES.observe(queries[0], (route,))
+            REQUEST_DB_TIME.observe(queries[1], (route,))
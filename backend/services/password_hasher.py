@@ -0,0 +1,88 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+from .metrics import Counter, registry
+
+# bcrypt releases the GIL while hashing, so threads run hashes in parallel across cores
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hashes allowed to wait for a worker; beyond that requests are refused with 429
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", str(PASSWORD_HASH_WORKERS * 16)))
+
+PASSWORD_HASH_REJECTED = registry.register(Counter(
+    "password_hash_rejected_total", "Password hash operations refused because the worker pool was saturated."
+))
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated, bounded thread pool so hashing neither blocks the
+    event loop nor competes with database work in the shared threadpool.
+    At most workers + queue_size operations are admitted at once; further ones
+    are refused immediately with 429 instead of queueing without bound.
+    """
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many concurrent logins, please retry",
+                headers={"Retry-After": "1"}
+            )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str):
+        from .auth import get_password_hash
+
+        return await self.run(get_password_hash, password)
+
+    async def hash_many(self, passwords: list):
+        """
+        Hash a bulk import's passwords in parallel. No more than `workers` of them
+        are queued at a time, so a login arriving meanwhile waits behind one hash
+        per thread rather than the whole batch; bulk work takes no admission slots.
+        """
+        from .auth import get_password_hash
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        in_flight = asyncio.Semaphore(self.workers)
+
+        async def hash_one(password):
+            async with in_flight:
+                return await loop.run_in_executor(executor, get_password_hash, password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        """
+        Returns (valid, new_hash); new_hash is set when the stored hash was made
+        with outdated CryptContext parameters and should be replaced.
+        """
+        from .auth import verify_and_update_password
+
+        return await self.run(verify_and_update_password, password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,246 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import func, select
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from ..money import to_micros
+
+PRICING_REFRESH_SECONDS = float(os.getenv("PRICING_REFRESH_SECONDS", "30"))
+# Bounds the per-table cache of model name -> matched pattern
+RESOLVED_CACHE_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+# Prices in credits per 1000 tokens for models no model_prices row prices
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+    "llama-2": (0.0005, 0.0005),
+    "vip-gpt-4": (0.05, 0.10),
+    "*": (0.001, 0.002)
+}
+
+# Tiers charged for models no pattern matches, so an incomplete price list never makes chats free
+FALLBACK_TIERS = ((0,), (to_micros(DEFAULT_PRICES["*"][0]),), (to_micros(DEFAULT_PRICES["*"][1]),))
+
+def naive_utc(value: datetime):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def tiered_cost(tokens: int, starts: tuple, rates: tuple):
+    """
+    Graduated cost of `tokens`: each tier's rate applies to the tokens between its
+    start and the next tier's start. Rates are micro-credits per 1000 tokens and the
+    result is in thousandths of a micro-credit, so nothing is rounded per tier.
+    """
+    cost = 0
+    for index in range(len(starts) - 1, -1, -1):
+        if tokens > starts[index]:
+            cost += (tokens - starts[index]) * rates[index]
+            tokens = starts[index]
+    return cost
+
+def chat_cost(tiers: tuple, input_tokens: int, output_tokens: int):
+    """
+    Cost of a chat in micro-credits, rounded once at the end.
+    """
+    starts, input_rates, output_rates = tiers
+    # Single-tier prices, the common case, skip the graduated computation
+    if len(starts) == 1 and starts[0] == 0:
+        cost = input_tokens * input_rates[0] + output_tokens * output_rates[0]
+    else:
+        cost = tiered_cost(input_tokens, starts, input_rates) + tiered_cost(output_tokens, starts, output_rates)
+    # Token counts and rates are non-negative, so this rounds half up
+    return (cost + 500) // 1000
+
+class PricingTable:
+    """
+    Immutable lookup structure compiled from model_prices rows.
+
+    Exact model names resolve through a dict and "prefix*" patterns by longest
+    prefix, with "*" as the catch-all. Each pattern holds its price versions
+    sorted by effective_from; a version is (tier starts, input rates, output rates)
+    with rates in micro-credits per 1000 tokens. Models none of the patterns
+    price at the time are looked up in the `fallback` table.
+    """
+    def __init__(self, rows, version=None, fallback=None):
+        self.version = version
+        self.fallback = fallback
+        grouped = {}
+        for pattern, effective_from, tier_start, input_price, output_price in rows:
+            tiers = grouped.setdefault(pattern, {}).setdefault(naive_utc(effective_from) or datetime.min, [])
+            tiers.append((tier_start or 0, input_price, output_price))
+
+        self._exact = {}
+        self._prefixes = []
+        for pattern, versions in grouped.items():
+            effective = sorted(versions)
+            compiled = (
+                effective,
+                [
+                    (
+                        tuple(start for start, _, _ in sorted(versions[when])),
+                        tuple(input_price for _, input_price, _ in sorted(versions[when])),
+                        tuple(output_price for _, _, output_price in sorted(versions[when]))
+                    )
+                    for when in effective
+                ]
+            )
+            if pattern.endswith("*"):
+                self._prefixes.append((pattern[:-1], compiled))
+            else:
+                self._exact[pattern] = compiled
+        self._prefixes.sort(key=lambda entry: len(entry[0]), reverse=True)
+        self._resolved = {}
+
+    @classmethod
+    def from_defaults(cls):
+        return cls([
+            (pattern, None, 0, to_micros(input_price), to_micros(output_price))
+            for pattern, (input_price, output_price) in DEFAULT_PRICES.items()
+        ])
+
+    def _candidates(self, model_name: str):
+        """
+        Patterns matching a model, most specific first: the exact name, then prefixes by length.
+        """
+        candidates = self._resolved.get(model_name)
+        if candidates is None:
+            candidates = [entry for prefix, entry in self._prefixes if model_name.startswith(prefix)]
+            if model_name in self._exact:
+                candidates.insert(0, self._exact[model_name])
+            if len(self._resolved) < RESOLVED_CACHE_SIZE:
+                self._resolved[model_name] = candidates
+        return candidates
+
+    def tiers(self, model_name: str, at: datetime):
+        """
+        Return the (starts, input rates, output rates) in effect for a model at `at`,
+        from the most specific pattern that has a price effective by then.
+        """
+        for effective, versions in self._candidates(model_name):
+            index = bisect.bisect_right(effective, at) - 1
+            if index >= 0:
+                return versions[index]
+        if self.fallback is not None:
+            return self.fallback.tiers(model_name, at)
+        return FALLBACK_TIERS
+
+    def cost(self, model_name: str, input_tokens: int, output_tokens: int, at: datetime):
+        return chat_cost(self.tiers(model_name, at), input_tokens, output_tokens)
+
+    def costs(self, model_names: list, input_tokens: list, output_tokens: list, at: datetime):
+        """
+        Price parallel lists of chats, resolving tiers once per distinct model.
+        """
+        tiers_by_model = {model_name: self.tiers(model_name, at) for model_name in set(model_names)}
+        return [
+            chat_cost(tiers_by_model[model_name], input_count, output_count)
+            for model_name, input_count, output_count in zip(model_names, input_tokens, output_tokens)
+        ]
+
+DEFAULT_TABLE = PricingTable.from_defaults()
+
+def load_pricing_version(db):
+    return db.execute(select(func.max(models.ModelPrice.version))).scalar()
+
+def load_pricing_rows(db):
+    return db.execute(
+        select(
+            models.ModelPrice.model_pattern,
+            models.ModelPrice.effective_from,
+            models.ModelPrice.tier_start_tokens,
+            models.ModelPrice.input_price_micros,
+            models.ModelPrice.output_price_micros
+        )
+    ).all()
+
+class PricingEngine:
+    """
+    Process-wide holder of the compiled PricingTable.
+
+    At most once every refresh_seconds it reads the pricing version, a single
+    max() query, and recompiles the table only when the version changed. In the
+    app the background task run_refresher does this, so requests only read the
+    table in memory; without it (scripts, benchmarks) the request that finds the
+    table due refreshes it inline.
+    """
+    def __init__(self, session_factory=None, refresh_seconds: float = PRICING_REFRESH_SECONDS):
+        self.session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self._table = DEFAULT_TABLE
+        self._checked_at = None
+        self._background = False
+        self._lock = threading.Lock()
+
+    def table(self):
+        if self._background:
+            return self._table
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.refresh_seconds:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.refresh_seconds:
+                    self.refresh()
+                    self._checked_at = now
+        return self._table
+
+    def refresh(self, db=None):
+        """
+        Reload the table if the pricing version moved, with `db` or a dedicated session.
+        """
+        if db is not None:
+            self._load(db)
+            return
+        session_factory = self.session_factory
+        if session_factory is None:
+            from ..database.database import SessionLocal
+            session_factory = SessionLocal
+
+        db = session_factory()
+        try:
+            self._load(db)
+        finally:
+            db.close()
+
+    def _load(self, db):
+        version = load_pricing_version(db)
+        if version is None:
+            self._table = DEFAULT_TABLE
+        elif version != self._table.version:
+            # The defaults stay in force beneath the table for every model it does not price
+            self._table = PricingTable(load_pricing_rows(db), version, DEFAULT_TABLE)
+
+    def invalidate(self):
+        self._checked_at = None
+
+    async def run_refresher(self):
+        """
+        Background task refreshing the table every refresh_seconds, which takes
+        the version check off the request path.
+        """
+        try:
+            while True:
+                try:
+                    await run_in_threadpool(self.refresh)
+                    # Until a refresh succeeds, requests keep checking the version themselves
+                    self._background = True
+                except Exception:
+                    # The current table stays in force until a refresh succeeds
+                    logger.exception("Pricing refresh failed")
+                await asyncio.sleep(self.refresh_seconds)
+        finally:
+            self._background = False
+
+    def cost(self, model_name: str, input_tokens: int, output_tokens: int, at: datetime = None):
+        return self.table().cost(model_name, input_tokens, output_tokens, at or datetime.utcnow())
+
+    def costs(self, model_names: list, input_tokens: list, output_tokens: list, at: datetime = None):
+        return self.table().costs(model_names, input_tokens, output_tokens, at or datetime.utcnow())
+
+pricing_engine = PricingEngine()
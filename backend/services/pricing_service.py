@@ -0,0 +1,77 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..database import models
+from ..models import schemas
+from ..money import to_micros
+from .pricing_engine import pricing_engine
+
+# catalog_versions row handing out model_prices versions
+PRICES_VERSION = "model_prices"
+
+def next_pricing_version(db: Session):
+    """
+    Take the next pricing version. The UPDATE locks the counter row until the
+    caller commits, so concurrent price changes get distinct versions. Does not commit.
+    """
+    version = db.execute(
+        update(models.CatalogVersion).where(models.CatalogVersion.name == PRICES_VERSION).values(
+            version=models.CatalogVersion.version + 1
+        ).returning(models.CatalogVersion.version)
+    ).scalar()
+    if version is None:
+        # First change since the counter was introduced: continue from the rows already there
+        version = (db.execute(select(func.max(models.ModelPrice.version))).scalar() or 0) + 1
+        db.add(models.CatalogVersion(name=PRICES_VERSION, version=version))
+        db.flush()
+    return version
+
+def has_base_tier(db: Session, model_pattern: str, effective_from):
+    when = models.ModelPrice.effective_from
+    return db.execute(
+        select(models.ModelPrice.id).where(
+            models.ModelPrice.model_pattern == model_pattern,
+            when.is_(None) if effective_from is None else when == effective_from,
+            models.ModelPrice.tier_start_tokens == 0
+        ).limit(1)
+    ).first() is not None
+
+def create_model_price(db: Session, price: schemas.ModelPriceCreate):
+    """
+    Add a price row under a new catalog version. Prices are append-only: change a
+    price by adding a row with a later effective_from, starting with its tier 0 row;
+    rows for higher tiers of that version follow with the same effective_from.
+    Raises ValueError for a higher tier whose version has no tier 0 row, which
+    would leave the tokens below it unpriced.
+    """
+    if price.tier_start_tokens > 0 and not has_base_tier(db, price.model_pattern, price.effective_from):
+        db.rollback()
+        raise ValueError("Add the tier starting at 0 tokens for this model_pattern and effective_from first")
+
+    for attempt in range(2):
+        try:
+            db_price = models.ModelPrice(
+                model_pattern=price.model_pattern,
+                input_price_micros=to_micros(price.input_price),
+                output_price_micros=to_micros(price.output_price),
+                tier_start_tokens=price.tier_start_tokens,
+                effective_from=price.effective_from,
+                version=next_pricing_version(db)
+            )
+            break
+        except IntegrityError:
+            # Another worker created the counter row first; its UPDATE path applies now
+            db.rollback()
+            if attempt:
+                raise
+    db.add(db_price)
+    db.commit()
+    # Pick up the new version in this worker immediately; others follow within the refresh interval
+    pricing_engine.refresh(db)
+    db.refresh(db_price)
+    return db_price
+
+def get_model_prices(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(models.ModelPrice).order_by(
+        models.ModelPrice.model_pattern, models.ModelPrice.effective_from, models.ModelPrice.tier_start_tokens
+    ).offset(skip).limit(limit).all()
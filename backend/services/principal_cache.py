@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+class Principal(NamedTuple):
+    """
+    Compact snapshot of an authenticated user, enough to authorize a request.
+    """
+    id: int
+    username: str
+    role: str
+    is_active: bool
+    plan_id: Optional[int]
+    can_access_vip_models: bool
+    # Unix time the active subscription ends; the snapshot is not trusted past it
+    plan_expires_at: Optional[float] = None
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of principals keyed by token subject, with a TTL.
+
+    Every invalidation bumps a version stamp. A loader reads the version before
+    going to the database and passes it back to put(), so a snapshot loaded
+    before a concurrent invalidation is never stored.
+    """
+    def __init__(self, max_size: int = PRINCIPAL_CACHE_SIZE, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._subjects = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self):
+        return self._version
+
+    def get(self, subject: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= now:
+                self._remove(subject)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return principal
+
+    def put(self, subject: str, principal: Principal, version: int):
+        with self._lock:
+            if version != self._version:
+                return
+            self._remove(subject)
+            ttl_seconds = self.ttl_seconds
+            if principal.plan_expires_at is not None:
+                ttl_seconds = min(ttl_seconds, principal.plan_expires_at - time.time())
+            self._entries[subject] = (principal, time.monotonic() + ttl_seconds)
+            self._subjects[principal.id] = subject
+            while len(self._entries) > self.max_size:
+                oldest, _ = next(iter(self._entries.items()))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._version += 1
+            self.invalidations += 1
+            subject = self._subjects.get(user_id)
+            if subject is not None:
+                self._remove(subject)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._subjects.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+    def _remove(self, subject: str):
+        entry = self._entries.pop(subject, None)
+        if entry is not None and self._subjects.get(entry[0].id) == subject:
+            del self._subjects[entry[0].id]
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from ..database.database import run_blocking
+
+# "memory" for single-worker deployments, "redis" to share limits across workers and nodes
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CHAT_WINDOW_SECONDS = 3600
+
+class MemoryRateLimiter:
+    """
+    Sliding-window log limiter kept in process memory.
+    """
+    def __init__(self):
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _window(self, key: str, now: float, window_seconds: int):
+        window = self._windows.get(key)
+        if window is None:
+            return None
+        cutoff = now - window_seconds
+        while window and window[0] <= cutoff:
+            window.popleft()
+        if not window:
+            del self._windows[key]
+            return None
+        return window
+
+    def acquire(self, key: str, limit: int, count: int = 1, window_seconds: int = CHAT_WINDOW_SECONDS):
+        """
+        Take up to `count` slots from the window. Returns the number of slots granted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            window = self._window(key, now, window_seconds)
+            used = len(window) if window is not None else 0
+            granted = max(0, min(count, limit - used))
+            if granted:
+                if window is None:
+                    window = self._windows[key] = deque()
+                window.extend([now] * granted)
+            return granted
+
+    def release(self, key: str, count: int = 1):
+        """
+        Give back the `count` most recent slots, taken for work that did not happen.
+        """
+        with self._lock:
+            window = self._windows.get(key)
+            for _ in range(min(count, len(window) if window is not None else 0)):
+                window.pop()
+            if window is not None and not window:
+                del self._windows[key]
+
+    def count(self, key: str, window_seconds: int = CHAT_WINDOW_SECONDS):
+        with self._lock:
+            window = self._window(key, time.monotonic(), window_seconds)
+            return len(window) if window is not None else 0
+
+    def reset(self, key: str):
+        with self._lock:
+            self._windows.pop(key, None)
+
+class RedisRateLimiter:
+    """
+    Sliding-window log limiter stored in a Redis sorted set per key.
+    Pruning, counting and recording run in a single Lua script, so concurrent
+    workers cannot overshoot the limit. Calls made on the event loop go through
+    the threadpool (database.run_blocking).
+    """
+    ACQUIRE_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local limit = tonumber(ARGV[3])
+    local count = tonumber(ARGV[4])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+    local used = redis.call('ZCARD', KEYS[1])
+    local granted = math.max(0, math.min(count, limit - used))
+    for i = 1, granted do
+        redis.call('ZADD', KEYS[1], now, ARGV[5] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+    return granted
+    """
+
+    COUNT_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+    return redis.call('ZCARD', KEYS[1])
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+        self._acquire = client.register_script(self.ACQUIRE_SCRIPT)
+        self._count = client.register_script(self.COUNT_SCRIPT)
+
+    def acquire(self, key: str, limit: int, count: int = 1, window_seconds: int = CHAT_WINDOW_SECONDS):
+        """
+        Take up to `count` slots from the window. Returns the number of slots granted.
+        """
+        return int(run_blocking(
+            self._acquire,
+            keys=[self.prefix + key],
+            args=[time.time(), window_seconds, limit, count, uuid.uuid4().hex]
+        ))
+
+    def release(self, key: str, count: int = 1):
+        """
+        Give back the `count` most recent slots, taken for work that did not happen.
+        """
+        run_blocking(self.client.zpopmax, self.prefix + key, count)
+
+    def count(self, key: str, window_seconds: int = CHAT_WINDOW_SECONDS):
+        return int(run_blocking(self._count, keys=[self.prefix + key], args=[time.time(), window_seconds]))
+
+    def reset(self, key: str):
+        self.client.delete(self.prefix + key)
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                if RATE_LIMIT_BACKEND == "redis":
+                    import redis
+                    _rate_limiter = RedisRateLimiter(redis.Redis.from_url(REDIS_URL))
+                else:
+                    _rate_limiter = MemoryRateLimiter()
+    return _rate_limiter
+
+def chat_key(user_id: int):
+    return f"chats:{user_id}"
+
+def acquire_chat_slots(user_id: int, max_chats_per_hour: int, count: int = 1):
+    return get_rate_limiter().acquire(chat_key(user_id), max_chats_per_hour, count)
+
+def release_chat_slots(user_id: int, count: int = 1):
+    get_rate_limiter().release(chat_key(user_id), count)
+
+def chats_this_hour(user_id: int):
+    return get_rate_limiter().count(chat_key(user_id))
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from ..money import from_micros
+from .admission_service import check_admission, load_admission_context
+from .chat_log import chat_log
+from .chat_service import write_settled_chats
+from .rate_limiter import acquire_chat_slots
+from .reservation_store import get_reservation_store, pending_tokens
+from .usage_service import month_bucket
+
+SETTLEMENT_FLUSH_SECONDS = float(os.getenv("SETTLEMENT_FLUSH_SECONDS", "2"))
+SETTLEMENT_BATCH_SIZE = 5000
+
+# Serializes this process's flushes; _completed lists the batches acknowledged
+# since the last commit, whose flush records that commit deletes
+_flush_lock = threading.Lock()
+_completed = []
+
+logger = logging.getLogger(__name__)
+
+def reserve_credits(db: Session, user_id: int, model_name: str, input_tokens: int, output_tokens: int):
+    """
+    Admit a streaming chat and hold its estimated cost against the user's credits.
+    Nothing is written to the database. Returns ({"reservation_id", "amount"}, None)
+    with the amount in credits, or (None, error).
+    """
+    from .chat_service import calculate_chat_cost
+
+    now = datetime.utcnow()
+    row = load_admission_context(db, user_id, now)
+    db.rollback()
+    if row is None:
+        return None, "Access denied: Model not available for your subscription"
+
+    user, plan, tokens_this_month = row
+    amount = calculate_chat_cost(input_tokens, output_tokens, model_name)
+    # Settled tokens count toward the month before their flush records them
+    tokens_this_month += pending_tokens([user_id]).get(user_id, 0)
+    error = check_admission(user, plan, tokens_this_month, model_name, amount)
+    if error:
+        return None, error
+
+    store = get_reservation_store()
+    # Chats this process admitted in write-behind mode are not debited yet either
+    held_cost, _ = chat_log.held(user_id, month_bucket(now))
+    reservation_id = store.reserve(user_id, amount, user.credits_micros - held_cost, model_name)
+    if reservation_id is None:
+        return None, "Insufficient credits"
+
+    if not acquire_chat_slots(user_id, plan.max_chats_per_hour):
+        store.release(reservation_id)
+        return None, "Rate limit exceeded: Too many requests"
+
+    return {"reservation_id": reservation_id, "amount": from_micros(amount)}, None
+
+def settle_reservation(db: Session, user_id: int, reservation_id: str, input_tokens: int, output_tokens: int):
+    """
+    Replace a hold with the cost of the tokens actually used, capped at the
+    reserved amount plus the credits no other hold or pending charge uses, so
+    the flush cannot take the balance below zero. The charge reaches the
+    database with the next settlement flush. Returns the cost charged in
+    micro-credits, or None if the reservation is unknown, expired, already
+    settled or not the user's.
+    """
+    from .chat_service import calculate_chat_cost
+
+    store = get_reservation_store()
+    reservation = store.get(reservation_id)
+    if reservation is None or reservation["user_id"] != user_id:
+        return None
+
+    credits = db.execute(select(models.User.credits_micros).where(models.User.id == user_id)).scalar()
+    db.rollback()
+    # Chats this process admitted in write-behind mode are not debited yet either
+    held_cost, _ = chat_log.held(user_id, month_bucket(datetime.utcnow()))
+    cost = calculate_chat_cost(input_tokens, output_tokens, reservation["model_name"])
+    settlement = {
+        "user_id": user_id,
+        "model_name": reservation["model_name"],
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost": cost,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    return store.settle(reservation_id, settlement, (credits or 0) - held_cost)
+
+def release_reservation(user_id: int, reservation_id: str):
+    store = get_reservation_store()
+    reservation = store.get(reservation_id)
+    if reservation is None or reservation["user_id"] != user_id:
+        return False
+    return store.release(reservation_id)
+
+def settlement_totals(settlements: list):
+    """
+    {user_id: (cost, tokens)} of a batch of settlements.
+    """
+    totals = {}
+    for settlement in settlements:
+        cost, tokens = totals.get(settlement["user_id"], (0, 0))
+        totals[settlement["user_id"]] = (
+            cost + settlement["cost"], tokens + settlement["input_tokens"] + settlement["output_tokens"]
+        )
+    return totals
+
+def flush_batch(db: Session, store, batch_id: str, settlements: list):
+    """
+    Write a drained batch unless an earlier flush already committed it, then
+    acknowledge it in the store. Returns the number of settlements written.
+    """
+    written = 0
+    try:
+        flushed = db.execute(
+            select(models.ChatLogBatch.id).where(models.ChatLogBatch.id == batch_id)
+        ).scalar() is not None
+        db.rollback()
+        if not flushed:
+            write_settled_chats(db, batch_id, settlements, _completed)
+            _completed.clear()
+            written = len(settlements)
+    except Exception:
+        db.rollback()
+        # The batch stays in the store; the next flush takes it over
+        store.retry(batch_id)
+        raise
+    store.mark_flushed(batch_id, settlement_totals(settlements))
+    _completed.append(batch_id)
+    return written
+
+def flush_settlements(db: Session, limit: int = SETTLEMENT_BATCH_SIZE):
+    """
+    Write up to `limit` queued settlements in one batch, after any batch a failed
+    or crashed flush left unacknowledged. A drained batch stays in the store until
+    it is acknowledged, and its flush record, written in the same transaction as
+    its chats, keeps a batch taken over after a crash from being written twice.
+    Returns the number of settlements written.
+    """
+    store = get_reservation_store()
+    with _flush_lock:
+        written = 0
+        for batch_id, settlements in store.claim_stale():
+            written += flush_batch(db, store, batch_id, settlements)
+        batch_id, settlements = store.drain(limit)
+        if settlements:
+            written += flush_batch(db, store, batch_id, settlements)
+        return written
+
+def flush_pending_settlements():
+    """
+    Flush every queued settlement, batch by batch, with a dedicated session.
+    """
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            flushed = flush_settlements(db)
+            total += flushed
+            if flushed < SETTLEMENT_BATCH_SIZE:
+                return total
+    finally:
+        db.close()
+
+async def run_settlement_flusher():
+    """
+    Background task flushing settlements every SETTLEMENT_FLUSH_SECONDS.
+    """
+    while True:
+        await asyncio.sleep(SETTLEMENT_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(flush_pending_settlements)
+        except Exception:
+            # The batch stays in the store and is retried on the next tick
+            logger.exception("Settlement flush failed")
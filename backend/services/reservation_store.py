@@ -0,0 +1,426 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from ..database.database import run_blocking
+
+# "memory" for single-worker deployments, "redis" to share holds across workers and nodes
+RESERVATION_BACKEND = os.getenv("RESERVATION_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Unsettled reservations are released after this long, e.g. when the gateway dies mid-stream
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "600"))
+# A drained settlement batch not acknowledged after this long is taken over by the next flush
+SETTLEMENT_LEASE_SECONDS = int(os.getenv("SETTLEMENT_LEASE_SECONDS", "60"))
+
+def new_batch_id():
+    return f"settlements-{uuid.uuid4().hex}"
+
+class MemoryReservationStore:
+    """
+    Credit holds and unflushed settlements kept in process memory.
+
+    Per user it tracks the reservations still held and the settled cost and
+    tokens not yet written to the database ("pending"). Spendable credit is the
+    database balance minus held and pending cost; all amounts are integer
+    micro-credits.
+
+    Settlements are drained in batches; a batch stays in the store, and its cost
+    pending, until the flush that wrote it acknowledges it with mark_flushed.
+    """
+    def __init__(self):
+        self._holds = {}
+        self._reservations = {}
+        self._pending = {}
+        self._pending_tokens = {}
+        self._settlements = deque()
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, user_id: int, now: float):
+        holds = self._holds.get(user_id)
+        if not holds:
+            return {}
+        for reservation_id in [rid for rid, (_, expires_at) in holds.items() if expires_at <= now]:
+            del holds[reservation_id]
+            self._reservations.pop(reservation_id, None)
+        return holds
+
+    def reserve(self, user_id: int, amount: int, balance: int, model_name: str, ttl_seconds: int = RESERVATION_TTL_SECONDS):
+        """
+        Hold `amount` against `balance` if it is still spendable.
+        Returns the reservation id, or None if the credits are not available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            holds = self._prune(user_id, now)
+            held = sum(amount for amount, _ in holds.values())
+            if balance - held - self._pending.get(user_id, 0) < amount:
+                return None
+            reservation_id = uuid.uuid4().hex
+            self._holds.setdefault(user_id, {})[reservation_id] = (amount, now + ttl_seconds)
+            self._reservations[reservation_id] = {"user_id": user_id, "model_name": model_name, "amount": amount}
+            return reservation_id
+
+    def get(self, reservation_id: str):
+        with self._lock:
+            return self._reservations.get(reservation_id)
+
+    def reserved(self, user_ids: list):
+        """
+        {user_id: micro-credits held or settled but not yet flushed} for the users with any.
+        """
+        now = time.monotonic()
+        with self._lock:
+            reserved = {}
+            for user_id in user_ids:
+                amount = sum(amount for amount, _ in self._prune(user_id, now).values())
+                amount += self._pending.get(user_id, 0)
+                if amount:
+                    reserved[user_id] = amount
+            return reserved
+
+    def pending_tokens(self, user_ids: list):
+        """
+        {user_id: tokens settled but not yet flushed} for the users with any.
+        """
+        with self._lock:
+            return {user_id: self._pending_tokens[user_id] for user_id in user_ids if user_id in self._pending_tokens}
+
+    def settle(self, reservation_id: str, settlement: dict, balance: int):
+        """
+        Replace a hold with its actual cost and queue the settlement for flushing.
+        The charge is capped at what `balance` still covers: the reserved amount
+        plus whatever no other hold or pending settlement uses, and the queued
+        settlement carries the capped cost.
+        Returns the cost charged, or None if the reservation is unknown, expired or
+        already settled.
+        """
+        with self._lock:
+            reservation = self._reservations.get(reservation_id)
+            if reservation is None:
+                return None
+            user_id = reservation["user_id"]
+            holds = self._prune(user_id, time.monotonic())
+            if reservation_id not in holds:
+                return None
+            del self._reservations[reservation_id]
+            amount, _ = holds.pop(reservation_id)
+            held = sum(held_amount for held_amount, _ in holds.values())
+            spendable = balance - held - self._pending.get(user_id, 0)
+            cost = min(settlement["cost"], max(amount, spendable))
+            tokens = settlement["input_tokens"] + settlement["output_tokens"]
+            self._pending[user_id] = self._pending.get(user_id, 0) + cost
+            self._pending_tokens[user_id] = self._pending_tokens.get(user_id, 0) + tokens
+            self._settlements.append({**settlement, "cost": cost})
+            return cost
+
+    def release(self, reservation_id: str):
+        with self._lock:
+            reservation = self._reservations.pop(reservation_id, None)
+            if reservation is None:
+                return False
+            self._holds.get(reservation["user_id"], {}).pop(reservation_id, None)
+            return True
+
+    def drain(self, limit: int, lease_seconds: int = SETTLEMENT_LEASE_SECONDS):
+        """
+        Move up to `limit` queued settlements, oldest first, into a new batch leased
+        to the caller for `lease_seconds`. Returns (batch id, settlements), or
+        (None, []) if the queue is empty.
+        """
+        with self._lock:
+            settlements = [self._settlements.popleft() for _ in range(min(limit, len(self._settlements)))]
+            if not settlements:
+                return None, []
+            batch_id = new_batch_id()
+            self._batches[batch_id] = [settlements, time.monotonic() + lease_seconds]
+            return batch_id, settlements
+
+    def claim_stale(self, lease_seconds: int = SETTLEMENT_LEASE_SECONDS):
+        """
+        Take over the batches whose lease ran out before they were acknowledged,
+        leasing them for `lease_seconds`. Returns [(batch id, settlements), ...].
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = []
+            for batch_id, batch in self._batches.items():
+                if batch[1] <= now:
+                    batch[1] = now + lease_seconds
+                    stale.append((batch_id, batch[0]))
+            return stale
+
+    def retry(self, batch_id: str):
+        """
+        Make a batch whose flush failed claimable right away.
+        """
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                batch[1] = float("-inf")
+
+    def mark_flushed(self, batch_id: str, totals: dict):
+        """
+        Acknowledge a written batch: drop it, and its settled costs and tokens
+        ({user_id: (cost, tokens)}), which the database now reflects.
+        Returns False if it was already acknowledged.
+        """
+        with self._lock:
+            if self._batches.pop(batch_id, None) is None:
+                return False
+            for user_id, (cost, tokens) in totals.items():
+                for pending, amount in ((self._pending, cost), (self._pending_tokens, tokens)):
+                    remaining = pending.get(user_id, 0) - amount
+                    if remaining > 0:
+                        pending[user_id] = remaining
+                    else:
+                        pending.pop(user_id, None)
+            return True
+
+class RedisReservationStore:
+    """
+    Credit holds kept in Redis so every worker enforces the same spendable balance.
+    Per user a hash holds reservation amounts, a sorted set their expiry and two
+    integer counters the pending settled cost in micro-credits and tokens; each
+    operation is one Lua script.
+
+    Draining moves settlements from the queue into a list per batch, registered
+    with its lease expiry in a sorted set, so a worker dying mid-flush loses
+    nothing: its batch is claimed by another flush once the lease runs out.
+    Calls made on the request path go through database.run_blocking, so they
+    do not stall the event loop under AsyncSession.run_sync().
+    """
+    # Drops the expired holds, then sets `held` to the sum of the user's holds and
+    # `pending` to the settled cost not yet flushed; ARGV[1] is the current time
+    HELD_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+    for _, reservation_id in ipairs(expired) do
+        redis.call('HDEL', KEYS[1], reservation_id)
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    local held = 0
+    for _, value in ipairs(redis.call('HVALS', KEYS[1])) do
+        held = held + tonumber(value)
+    end
+    local pending = tonumber(redis.call('GET', KEYS[3]) or '0')
+    """
+
+    RESERVE_SCRIPT = HELD_SCRIPT + """
+    local ttl = tonumber(ARGV[2])
+    local balance = tonumber(ARGV[3])
+    local amount = tonumber(ARGV[4])
+    if balance - held - pending < amount then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], ARGV[5], ARGV[4])
+    redis.call('ZADD', KEYS[2], now + ttl, ARGV[5])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(ttl * 1000))
+    redis.call('PEXPIRE', KEYS[2], math.ceil(ttl * 1000))
+    redis.call('SET', KEYS[4], ARGV[6], 'PX', math.ceil(ttl * 1000))
+    return 1
+    """
+
+    RESERVED_SCRIPT = HELD_SCRIPT + """
+    return held + pending
+    """
+
+    # Caps the cost at the reserved amount plus the balance no other hold or pending
+    # settlement uses. ARGV[6] is the settlement JSON without its closing brace; the
+    # capped cost is appended as its last field
+    SETTLE_SCRIPT = HELD_SCRIPT + """
+    local amount = redis.call('HGET', KEYS[1], ARGV[2])
+    if not amount then
+        return false
+    end
+    amount = tonumber(amount)
+    local spendable = tonumber(ARGV[4]) - (held - amount) - pending
+    local cost = math.min(tonumber(ARGV[3]), math.max(amount, spendable))
+    redis.call('HDEL', KEYS[1], ARGV[2])
+    redis.call('ZREM', KEYS[2], ARGV[2])
+    redis.call('DEL', KEYS[4])
+    redis.call('INCRBY', KEYS[3], string.format('%d', cost))
+    redis.call('INCRBY', KEYS[6], ARGV[5])
+    redis.call('RPUSH', KEYS[5], ARGV[6] .. ', "cost": ' .. string.format('%d', cost) .. '}')
+    return cost
+    """
+
+    RELEASE_SCRIPT = """
+    if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then
+        return 0
+    end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('DEL', KEYS[3])
+    return 1
+    """
+
+    DRAIN_SCRIPT = """
+    local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #items == 0 then
+        return items
+    end
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    for start = 1, #items, 1000 do
+        redis.call('RPUSH', KEYS[3], unpack(items, start, math.min(start + 999, #items)))
+    end
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+    return items
+    """
+
+    CLAIM_SCRIPT = """
+    local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    for _, batch_id in ipairs(stale) do
+        redis.call('ZADD', KEYS[1], ARGV[2], batch_id)
+    end
+    return stale
+    """
+
+    ACK_SCRIPT = """
+    if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+        return 0
+    end
+    redis.call('DEL', KEYS[2])
+    for index = 3, #KEYS do
+        if redis.call('DECRBY', KEYS[index], ARGV[index - 1]) <= 0 then
+            redis.call('DEL', KEYS[index])
+        end
+    end
+    return 1
+    """
+
+    def __init__(self, client, prefix: str = "credits:"):
+        self.client = client
+        self.prefix = prefix
+        self._reserve = client.register_script(self.RESERVE_SCRIPT)
+        self._reserved = client.register_script(self.RESERVED_SCRIPT)
+        self._settle = client.register_script(self.SETTLE_SCRIPT)
+        self._release = client.register_script(self.RELEASE_SCRIPT)
+        self._drain = client.register_script(self.DRAIN_SCRIPT)
+        self._claim = client.register_script(self.CLAIM_SCRIPT)
+        self._ack = client.register_script(self.ACK_SCRIPT)
+
+    def _user_keys(self, user_id: int):
+        return [f"{self.prefix}holds:{user_id}", f"{self.prefix}expiry:{user_id}", f"{self.prefix}pending:{user_id}"]
+
+    def _tokens_key(self, user_id: int):
+        return f"{self.prefix}pending_tokens:{user_id}"
+
+    def _reservation_key(self, reservation_id: str):
+        return f"{self.prefix}reservation:{reservation_id}"
+
+    def reserve(self, user_id: int, amount: int, balance: int, model_name: str, ttl_seconds: int = RESERVATION_TTL_SECONDS):
+        reservation_id = uuid.uuid4().hex
+        reservation = json.dumps({"user_id": user_id, "model_name": model_name, "amount": amount})
+        granted = run_blocking(
+            self._reserve,
+            keys=self._user_keys(user_id) + [self._reservation_key(reservation_id)],
+            args=[time.time(), ttl_seconds, balance, amount, reservation_id, reservation]
+        )
+        return reservation_id if int(granted) else None
+
+    def get(self, reservation_id: str):
+        reservation = run_blocking(self.client.get, self._reservation_key(reservation_id))
+        return json.loads(reservation) if reservation else None
+
+    def reserved(self, user_ids: list):
+        now = time.time()
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._reserved(keys=self._user_keys(user_id), args=[now], client=pipeline)
+        return {user_id: int(amount) for user_id, amount in zip(user_ids, run_blocking(pipeline.execute)) if int(amount)}
+
+    def pending_tokens(self, user_ids: list):
+        tokens = run_blocking(self.client.mget, [self._tokens_key(user_id) for user_id in user_ids])
+        return {user_id: int(count) for user_id, count in zip(user_ids, tokens) if count and int(count)}
+
+    def settle(self, reservation_id: str, settlement: dict, balance: int):
+        user_id = settlement["user_id"]
+        uncharged = json.dumps({key: value for key, value in settlement.items() if key != "cost"})
+        cost = run_blocking(
+            self._settle,
+            keys=self._user_keys(user_id) + [
+                self._reservation_key(reservation_id), f"{self.prefix}settlements", self._tokens_key(user_id)
+            ],
+            args=[
+                time.time(), reservation_id, settlement["cost"], balance,
+                settlement["input_tokens"] + settlement["output_tokens"], uncharged[:-1]
+            ]
+        )
+        return None if cost is None else int(cost)
+
+    def release(self, reservation_id: str):
+        reservation = self.get(reservation_id)
+        if reservation is None:
+            return False
+        holds, expiry, _ = self._user_keys(reservation["user_id"])
+        return bool(int(run_blocking(
+            self._release,
+            keys=[holds, expiry, self._reservation_key(reservation_id)], args=[reservation_id]
+        )))
+
+    def _batch_keys(self, batch_id: str):
+        return [f"{self.prefix}settlements:batches", f"{self.prefix}settlements:{batch_id}"]
+
+    def drain(self, limit: int, lease_seconds: int = SETTLEMENT_LEASE_SECONDS):
+        batch_id = new_batch_id()
+        batches, batch = self._batch_keys(batch_id)
+        items = self._drain(
+            keys=[f"{self.prefix}settlements", batches, batch], args=[limit, time.time() + lease_seconds, batch_id]
+        )
+        if not items:
+            return None, []
+        return batch_id, [json.loads(item) for item in items]
+
+    def claim_stale(self, lease_seconds: int = SETTLEMENT_LEASE_SECONDS):
+        now = time.time()
+        batches, _ = self._batch_keys("")
+        claimed = []
+        for batch_id in self._claim(keys=[batches], args=[now, now + lease_seconds]):
+            batch_id = batch_id.decode() if isinstance(batch_id, bytes) else batch_id
+            items = self.client.lrange(self._batch_keys(batch_id)[1], 0, -1)
+            claimed.append((batch_id, [json.loads(item) for item in items]))
+        return claimed
+
+    def retry(self, batch_id: str):
+        batches, _ = self._batch_keys(batch_id)
+        # XX: a batch another worker has acknowledged in the meantime stays gone
+        self.client.zadd(batches, {batch_id: 0}, xx=True)
+
+    def mark_flushed(self, batch_id: str, totals: dict):
+        keys = self._batch_keys(batch_id)
+        args = [batch_id]
+        for user_id, (cost, tokens) in totals.items():
+            keys += [self._user_keys(user_id)[2], self._tokens_key(user_id)]
+            args += [cost, tokens]
+        return bool(int(self._ack(keys=keys, args=args)))
+
+_reservation_store = None
+_reservation_store_lock = threading.Lock()
+
+def get_reservation_store():
+    global _reservation_store
+    if _reservation_store is None:
+        with _reservation_store_lock:
+            if _reservation_store is None:
+                if RESERVATION_BACKEND == "redis":
+                    import redis
+                    _reservation_store = RedisReservationStore(redis.Redis.from_url(REDIS_URL))
+                else:
+                    _reservation_store = MemoryReservationStore()
+    return _reservation_store
+
+def reserved_credits(user_ids: list):
+    """
+    {user_id: micro-credits of the users' balances held by reservations or
+    settled and not yet flushed}, which no other spending may use.
+    """
+    return get_reservation_store().reserved(user_ids) if user_ids else {}
+
+def pending_tokens(user_ids: list):
+    """
+    {user_id: tokens of the users' settlements not yet flushed}, which count
+    toward their monthly token usage until the flush records them.
+    """
+    return get_reservation_store().pending_tokens(user_ids) if user_ids else {}
@@ -0,0 +1,215 @@
+"""
+Partition upkeep and retention for the chats and transactions tables.
+
+A background task keeps the monthly partitions of the coming months created
+and moves months older than the configured retention out of the database:
+each month is written to a gzip-compressed NDJSON file under ARCHIVE_DIR and
+then removed, on PostgreSQL by detaching and dropping its partition. Tables
+that are not partitioned (SQLite, or PostgreSQL before migrate_partitions)
+are archived month by month the same way and pruned with a range DELETE.
+
+The usage rollups, per-model statistics and daily analytics rollup are
+maintained incrementally, so quotas, all-time statistics and admin reports are
+unaffected; date-ranged user statistics, exports and ad-hoc group-bys only cover
+the months still in the database. The same task deletes the hourly usage
+rollup rows left by earlier versions; chats per hour are counted by the rate
+limiter.
+"""
+import asyncio
+import gzip
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import delete, func, select, text
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from ..database.partitioning import (
+    add_months, ensure_future_partitions, is_partitioned, month_start, partition_months, partition_name
+)
+from .export_service import encode_ndjson
+from .metrics import Counter, registry
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Whole months kept before the current one; 0 keeps everything
+RETENTION_MONTHS = {
+    "chats": int(os.getenv("CHAT_RETENTION_MONTHS", "0")),
+    "transactions": int(os.getenv("TRANSACTION_RETENTION_MONTHS", "0"))
+}
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "3600"))
+ARCHIVE_BATCH_SIZE = 5000
+# Serializes maintenance across workers on PostgreSQL
+MAINTENANCE_LOCK_KEY = 0x7061727469
+
+RETENTION_TABLES = (models.Chat.__table__, models.Transaction.__table__)
+
+MONTHS_ARCHIVED = registry.register(Counter(
+    "retention_months_archived_total", "Months of rows archived and removed by the retention policy.", ("table",)
+))
+ROWS_ARCHIVED = registry.register(Counter(
+    "retention_rows_archived_total", "Rows archived and removed by the retention policy.", ("table",)
+))
+ROLLUPS_PRUNED = registry.register(Counter(
+    "retention_usage_rollups_pruned_total", "Hourly usage rollup rows deleted."
+))
+
+logger = logging.getLogger(__name__)
+
+def archive_path(table_name: str, month: datetime):
+    return os.path.join(ARCHIVE_DIR, table_name, partition_name(table_name, month) + ".ndjson.gz")
+
+def month_range(table, month: datetime):
+    column = table.c[table.info["partition_key"]]
+    return column >= month, column < add_months(month, 1)
+
+def write_archive(connection, table, month: datetime):
+    """
+    Write the month's rows of `table` to its archive file, in id order. On a
+    partitioned table the range scan is pruned to the month's partition. The
+    file is only put in place once fully written and synced, so an interrupted
+    run leaves no partial archive.
+    Returns the number of rows written; nothing is written for an empty month.
+    """
+    path = archive_path(table.name, month)
+    temporary = path + ".tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    names = [column.name for column in table.columns]
+    result = connection.execute(
+        select(table).where(*month_range(table, month)).order_by(table.c.id).execution_options(
+            yield_per=ARCHIVE_BATCH_SIZE
+        )
+    )
+    count = 0
+    with open(temporary, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            for rows in result.partitions():
+                archive.write(encode_ndjson(names, rows).encode("utf-8"))
+                count += len(rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+    if count:
+        os.replace(temporary, path)
+    else:
+        os.remove(temporary)
+    return count
+
+def archive_month(connection, table, month: datetime, partitioned: bool):
+    """
+    Archive one month of `table`, then remove it: a partition is detached and
+    dropped, an unpartitioned table has the month's rows deleted.
+    """
+    count = write_archive(connection, table, month)
+    if partitioned:
+        name = connection.dialect.identifier_preparer.quote(partition_name(table.name, month))
+        parent = connection.dialect.identifier_preparer.quote(table.name)
+        connection.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+    elif count:
+        connection.execute(table.delete().where(*month_range(table, month)))
+    connection.commit()
+    return count
+
+def expired_months(connection, table, cutoff: datetime, partitioned: bool):
+    """
+    The months of `table` holding rows older than `cutoff`, oldest first.
+    """
+    if partitioned:
+        return [month for month in partition_months(connection, table.name) if month < cutoff]
+    oldest = connection.execute(select(func.min(table.c[table.info["partition_key"]]))).scalar()
+    if oldest is None:
+        return []
+    month = month_start(oldest)
+    months = []
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def apply_retention(connection, table, now: datetime):
+    """
+    Archive and remove the months of `table` beyond its retention.
+    Returns the names of the archived months.
+    """
+    retention = RETENTION_MONTHS.get(table.name, 0)
+    if retention <= 0:
+        return []
+    cutoff = add_months(month_start(now), -retention)
+    partitioned = is_partitioned(connection, table.name)
+    archived = []
+    for month in expired_months(connection, table, cutoff, partitioned):
+        count = archive_month(connection, table, month, partitioned)
+        MONTHS_ARCHIVED.inc((table.name,))
+        ROWS_ARCHIVED.inc((table.name,), count)
+        archived.append(partition_name(table.name, month))
+    return archived
+
+def prune_hourly_rollups(connection):
+    """
+    Delete the hourly usage rollup rows, which are no longer read or written.
+    Returns the number of rows deleted.
+    """
+    pruned = connection.execute(
+        delete(models.UsageRollup).where(models.UsageRollup.period == models.UsagePeriod.HOUR)
+    ).rowcount
+    connection.commit()
+    ROLLUPS_PRUNED.inc(amount=pruned)
+    return pruned
+
+def maintain_partitions(engine, now: datetime = None):
+    """
+    Create upcoming partitions, apply the retention policy to every
+    partitioned table and prune the hourly usage rollups.
+    Returns {"created": [...], "archived": [...], "pruned_rollups": count}.
+    """
+    now = now or datetime.utcnow()
+    report = {"created": [], "archived": [], "pruned_rollups": 0}
+    with engine.connect() as connection:
+        postgresql = connection.dialect.name == "postgresql"
+        if postgresql:
+            locked = connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}
+            ).scalar()
+            connection.commit()
+            if not locked:
+                # Another worker is on it
+                return report
+        try:
+            for table in RETENTION_TABLES:
+                if is_partitioned(connection, table.name):
+                    report["created"] += ensure_future_partitions(connection, table.name, now)
+                    connection.commit()
+                report["archived"] += apply_retention(connection, table, now)
+            report["pruned_rollups"] = prune_hourly_rollups(connection)
+        finally:
+            connection.rollback()
+            if postgresql:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+                connection.commit()
+    return report
+
+def run_maintenance():
+    from ..database.database import engine
+
+    report = maintain_partitions(engine)
+    if report["created"] or report["archived"] or report["pruned_rollups"]:
+        logger.info(
+            "Partition maintenance created %s, archived %s, pruned %d hourly usage rollups",
+            ", ".join(report["created"]) or "nothing", ", ".join(report["archived"]) or "nothing",
+            report["pruned_rollups"]
+        )
+    return report
+
+async def run_partition_maintenance():
+    """
+    Background task maintaining partitions every PARTITION_MAINTENANCE_SECONDS.
+    """
+    while True:
+        try:
+            await run_in_threadpool(run_maintenance)
+        except Exception:
+            # Each month is archived in its own transaction; the next run resumes where this one failed
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(PARTITION_MAINTENANCE_SECONDS)
+
+if __name__ == "__main__":
+    report = run_maintenance()
+    print(f"Created {len(report['created'])} partitions, archived {len(report['archived'])} months")
@@ -1,11 +1,36 @@
+import asyncio
+import logging
+import os
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from ..database import models, schemas
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, joinedload
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from ..database.database import read_only
+from ..models import schemas
+from ..money import to_micros
+from . import ledger
+from .catalog import PLANS_VERSION, bump_version, can_use_model, catalog_cache
+from .metrics import Counter, registry
+from .pagination import keyset_page
+from .pricing_engine import naive_utc
+from .principal_cache import principal_cache
+from .token_revocation import revocation_list
+
+SUBSCRIPTION_SWEEP_SECONDS = float(os.getenv("SUBSCRIPTION_SWEEP_SECONDS", "60"))
+# Auto-renewals claimed and charged per transaction
+SUBSCRIPTION_RENEWAL_BATCH_SIZE = int(os.getenv("SUBSCRIPTION_RENEWAL_BATCH_SIZE", "500"))
+
+SUBSCRIPTIONS_SWEPT = registry.register(Counter(
+    "subscriptions_swept_total", "Subscriptions ended by the expiry sweeper, by outcome.", ("outcome",)
+))
+
+logger = logging.getLogger(__name__)
 
 def create_subscription_plan(db: Session, plan: schemas.SubscriptionPlanCreate):
     db_plan = models.SubscriptionPlan(
         name=plan.name,
-        price=plan.price,
+        price_micros=to_micros(plan.price),
         duration_days=plan.duration_days,
         max_chats_per_hour=plan.max_chats_per_hour,
         max_tokens_per_month=plan.max_tokens_per_month,
@@ -13,101 +38,235 @@ def create_subscription_plan(db: Session, plan: schemas.SubscriptionPlanCreate):
         description=plan.description
     )
     db.add(db_plan)
+    bump_version(db, PLANS_VERSION)
     db.commit()
+    # Serve the new plan from this worker immediately; others follow within the refresh interval
+    catalog_cache.invalidate()
     db.refresh(db_plan)
     return db_plan
 
 def get_subscription_plan(db: Session, plan_id: int):
     return db.query(models.SubscriptionPlan).filter(models.SubscriptionPlan.id == plan_id).first()
 
+@read_only
 def get_subscription_plans(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.SubscriptionPlan).offset(skip).limit(limit).all()
 
-def subscribe_user(db: Session, user_id: int, plan_id: int):
-    # Check if user already has an active subscription
-    existing_subscription = db.query(models.Subscription).filter(
-        models.Subscription.user_id == user_id,
-        models.Subscription.is_active == True
-    ).first()
-    
-    if existing_subscription:
-        # Deactivate current subscription
-        existing_subscription.is_active = False
-        db.commit()
-    
+def subscribe_user(db: Session, user_id: int, plan_id: int, auto_renew: bool = False):
     # Get the plan details
     plan = get_subscription_plan(db, plan_id)
     if not plan:
         return None
     
+    # Charge the plan price first; nothing changes if the user cannot cover it
+    if ledger.debit(db, user_id, plan.price_micros, models.TransactionType.SUBSCRIPTION, f"Subscription: {plan.name}") is None:
+        db.rollback()
+        return None
+    
+    # Deactivate the current subscription, if any
+    db.query(models.Subscription).filter(
+        models.Subscription.user_id == user_id,
+        models.Subscription.is_active == True
+    ).update({models.Subscription.is_active: False}, synchronize_session=False)
+    
     # Create new subscription
-    end_date = datetime.utcnow() + timedelta(days=plan.duration_days)
+    now = datetime.utcnow()
     db_subscription = models.Subscription(
         user_id=user_id,
         plan_id=plan_id,
-        start_date=datetime.utcnow(),
-        end_date=end_date,
-        is_active=True
+        start_date=now,
+        end_date=now + timedelta(days=plan.duration_days),
+        is_active=True,
+        auto_renew=auto_renew
     )
     
     db.add(db_subscription)
     db.commit()
+    principal_cache.invalidate_user(user_id)
+    revocation_list.invalidate_claims(db, [user_id])
     db.refresh(db_subscription)
-    
-    # Deduct subscription cost from user's credits
-    from .user_service import deduct_credits
-    deduct_credits(db, user_id, plan.price, f"Subscription: {plan.name}")
-    
     return db_subscription
 
 def get_user_subscription(db: Session, user_id: int):
-    return db.query(models.Subscription).filter(
+    # Every caller reads the plan, so load it in the same query
+    return db.query(models.Subscription).options(joinedload(models.Subscription.plan)).filter(
         models.Subscription.user_id == user_id,
         models.Subscription.is_active == True
     ).first()
 
-def get_user_subscriptions(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Subscription).filter(
-        models.Subscription.user_id == user_id
-    ).offset(skip).limit(limit).all()
+def get_user_subscriptions(db: Session, user_id: int, cursor: str = None, limit: int = 100):
+    return keyset_page(
+        db.query(models.Subscription).filter(models.Subscription.user_id == user_id),
+        models.Subscription.start_date, models.Subscription.id, cursor, limit
+    )
 
-def check_subscription_status(db: Session, user_id: int):
+def set_auto_renew(db: Session, user_id: int, auto_renew: bool):
     subscription = get_user_subscription(db, user_id)
     if not subscription:
-        return False
+        return None
+    
+    subscription.auto_renew = auto_renew
+    db.commit()
+    return subscription
+
+def check_subscription_status(db: Session, user_id: int):
+    # Expiry is written by the sweeper; between its runs an overdue row still reads as ended
+    subscription = get_user_subscription(db, user_id)
+    return subscription is not None and naive_utc(subscription.end_date) > datetime.utcnow()
+
+def invalidate_subscribers(db: Session, user_ids):
+    for user_id in set(user_ids):
+        principal_cache.invalidate_user(user_id)
+    revocation_list.invalidate_claims(db, user_ids)
+
+def expire_subscriptions(db: Session, now: datetime):
+    """
+    End every overdue subscription that does not renew, in one UPDATE over the
+    partial index on active end dates. Returns the affected user ids. Does not commit.
+    """
+    return db.execute(
+        update(models.Subscription).where(
+            models.Subscription.is_active == True,
+            models.Subscription.end_date <= now,
+            models.Subscription.auto_renew == False
+        ).values(is_active=False).returning(
+            models.Subscription.user_id
+        ).execution_options(synchronize_session=False)
+    ).scalars().all()
+
+def renew_subscriptions(db: Session, now: datetime, limit: int = SUBSCRIPTION_RENEWAL_BATCH_SIZE):
+    """
+    Renew up to `limit` overdue auto-renewing subscriptions.
+
+    The due rows are claimed by deactivating them in one UPDATE, so concurrent
+    sweepers in other workers never renew the same row twice. All renewal
+    prices are then charged in one batched debit, and a follow-on subscription
+    is inserted for every user whose balance covered it; the others stay expired.
+    Returns (claimed user ids, renewed user ids). Does not commit.
+    """
+    due = select(models.Subscription.id).where(
+        models.Subscription.is_active == True,
+        models.Subscription.end_date <= now,
+        models.Subscription.auto_renew == True
+    ).order_by(models.Subscription.end_date).limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        due = due.with_for_update(skip_locked=True)
+    
+    claimed = db.execute(
+        update(models.Subscription).where(
+            models.Subscription.id.in_(due.scalar_subquery()),
+            models.Subscription.is_active == True
+        ).values(is_active=False).returning(
+            models.Subscription.user_id, models.Subscription.plan_id, models.Subscription.end_date
+        ).execution_options(synchronize_session=False)
+    ).all()
+    if not claimed:
+        return [], []
+    
+    plans = {
+        plan.id: plan
+        for plan in db.query(models.SubscriptionPlan).filter(
+            models.SubscriptionPlan.id.in_({plan_id for _, plan_id, _ in claimed})
+        )
+    }
+    renewals = {}
+    for user_id, plan_id, end_date in claimed:
+        # A user only ever has one active subscription; renew the first if data says otherwise
+        renewals.setdefault(user_id, (plans[plan_id], naive_utc(end_date)))
     
-    if subscription.end_date < datetime.utcnow():
-        # Subscription expired
-        subscription.is_active = False
+    balances = ledger.debit_many(db, {
+        user_id: (plan.price_micros, f"Subscription renewal: {plan.name}")
+        for user_id, (plan, _) in renewals.items()
+    }, models.TransactionType.SUBSCRIPTION, now)
+    
+    rows = []
+    for user_id in balances:
+        plan, start = renewals[user_id]
+        end = start + timedelta(days=plan.duration_days)
+        # Renew without a gap, unless the sweeper was down for longer than a whole period
+        if end <= now:
+            start, end = now, now + timedelta(days=plan.duration_days)
+        rows.append({
+            "user_id": user_id, "plan_id": plan.id, "start_date": start, "end_date": end,
+            "is_active": True, "auto_renew": True
+        })
+    if rows:
+        db.execute(models.Subscription.__table__.insert(), rows)
+    return [user_id for user_id, _, _ in claimed], list(balances)
+
+def sweep_subscriptions(db: Session, now: datetime = None):
+    """
+    Expire and renew every overdue subscription, then invalidate the cached
+    principals and token claims of the affected users.
+    Returns (expired, renewed) counts.
+    """
+    now = now or datetime.utcnow()
+    expired_users = expire_subscriptions(db, now)
+    db.commit()
+    invalidate_subscribers(db, expired_users)
+    expired, renewed = len(expired_users), 0
+    
+    while True:
+        claimed_users, renewed_users = renew_subscriptions(db, now)
         db.commit()
-        return False
+        invalidate_subscribers(db, claimed_users)
+        expired += len(claimed_users) - len(renewed_users)
+        renewed += len(renewed_users)
+        if len(claimed_users) < SUBSCRIPTION_RENEWAL_BATCH_SIZE:
+            break
     
-    return True
+    SUBSCRIPTIONS_SWEPT.inc(("expired",), expired)
+    SUBSCRIPTIONS_SWEPT.inc(("renewed",), renewed)
+    return expired, renewed
+
+def sweep_due_subscriptions():
+    """
+    Run one sweep with a dedicated session.
+    """
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return sweep_subscriptions(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_subscription_sweeper():
+    """
+    Background task sweeping subscriptions every SUBSCRIPTION_SWEEP_SECONDS.
+    """
+    while True:
+        try:
+            await run_in_threadpool(sweep_due_subscriptions)
+        except Exception:
+            # Nothing was committed for the failed batch; the next tick picks it up again
+            logger.exception("Subscription sweep failed")
+        await asyncio.sleep(SUBSCRIPTION_SWEEP_SECONDS)
 
 def get_subscription_usage(db: Session, user_id: int):
+    from .chat_log import chat_log
+    from .rate_limiter import chats_this_hour
+    from .reservation_store import pending_tokens
+    from .usage_service import get_tokens_this_month, month_bucket
+    
     subscription = get_user_subscription(db, user_id)
     if not subscription:
         return {"chats_this_hour": 0, "tokens_this_month": 0, "plan": None}
     
-    # Calculate chats this hour
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    chats_this_hour = db.query(models.Chat).filter(
-        models.Chat.user_id == user_id,
-        models.Chat.created_at >= one_hour_ago
-    ).count()
-    
-    # Calculate tokens this month
-    first_day_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    tokens_this_month = db.query(models.Chat).filter(
-        models.Chat.user_id == user_id,
-        models.Chat.created_at >= first_day_of_month
-    ).with_entities(models.Chat.input_tokens, models.Chat.output_tokens).all()
-    
-    total_tokens = sum(input_tokens + output_tokens for input_tokens, output_tokens in tokens_this_month)
+    # Token usage is maintained incrementally in the usage rollups,
+    # the hourly chat count comes from the sliding-window rate limiter
+    tokens_this_month = get_tokens_this_month(db, user_id)
+    # Plus the tokens of chats still queued by the write-behind log and of
+    # settled reservations not yet flushed
+    _, held_tokens = chat_log.held(user_id, month_bucket(datetime.utcnow()))
+    held_tokens += pending_tokens([user_id]).get(user_id, 0)
     
     return {
-        "chats_this_hour": chats_this_hour,
-        "tokens_this_month": total_tokens,
+        "chats_this_hour": chats_this_hour(user_id),
+        "tokens_this_month": tokens_this_month + held_tokens,
         "plan": subscription.plan
     }
 
@@ -122,26 +281,20 @@ def can_access_model(db: Session, user_id: int, model_name: str):
     if not subscription:
         return False
     
-    # Check if model requires VIP access
-    # For this example, let's assume models starting with "vip_" require VIP access
-    if model_name.startswith("vip_"):
-        return subscription.plan.can_access_vip_models
-    
-    return True
+    return can_use_model(model_name, False, subscription.plan.can_access_vip_models)
 
 def can_send_chat(db: Session, user_id: int):
-    subscription = get_user_subscription(db, user_id)
-    if not subscription:
-        return False
-    
     usage = get_subscription_usage(db, user_id)
+    plan = usage["plan"]
+    if not plan:
+        return False
     
     # Check chat limit
-    if usage["chats_this_hour"] >= subscription.plan.max_chats_per_hour:
+    if usage["chats_this_hour"] >= plan.max_chats_per_hour:
         return False
     
     # Check token limit
-    if usage["tokens_this_month"] >= subscription.plan.max_tokens_per_month:
+    if usage["tokens_this_month"] >= plan.max_tokens_per_month:
         return False
     
     return True
\ No newline at end of file
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from ..database import models
+from .principal_cache import principal_cache
+
+# Matches the access token lifetime: an entry only has to outlive the tokens it can match
+REVOCATION_TTL_SECONDS = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15")) * 60
+# Seconds between polls of the token_revocations table (per worker)
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+# Each poll re-reads this far behind the previous one, so rows committed late are not missed
+REVOCATION_SYNC_OVERLAP_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+class RevocationList:
+    """
+    Per-worker list checked on every request that carries a claims-bearing
+    access token.
+
+    It holds revoked token ids (logout) and, per user, the time their claims
+    last changed (role, plan, profile, password). A token issued before that
+    time is not rejected but authorized from the database instead of its claims,
+    so applying a claims change also evicts the user from this worker's
+    principal cache.
+
+    Changes are applied locally at once and recorded in the token_revocations
+    table, which every worker polls each REVOCATION_SYNC_SECONDS, so a change
+    reaches the other workers within that interval. Entries expire together
+    with the access tokens they could match, in memory and in the table.
+    """
+    def __init__(self, ttl_seconds: float = REVOCATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._tokens = {}
+        self._stale_users = {}
+        self._expiry = deque()
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def revoke_token(self, db: Session, jti: str):
+        self._publish(db, [models.TokenRevocation(jti=jti, revoked_at=time.time())])
+
+    def invalidate_claims(self, db: Session, user_ids):
+        """
+        Mark the claims of the given users as changed. Call after the change
+        is committed; commits the revocation rows.
+        """
+        now = time.time()
+        self._publish(db, [models.TokenRevocation(user_id=user_id, revoked_at=now) for user_id in set(user_ids)])
+
+    def is_revoked(self, jti: str):
+        return jti in self._tokens
+
+    def claims_stale(self, user_id: int, issued_at: int):
+        changed_at = self._stale_users.get(user_id)
+        # iat has one-second resolution, so a token from the same second counts as stale
+        return changed_at is not None and issued_at <= changed_at
+
+    def sync(self, db: Session):
+        """
+        Apply the revocations recorded by any worker since the previous poll;
+        the first poll loads every one still live. Returns the rows read.
+        """
+        now = time.time()
+        if self._synced_at is None:
+            since = now - self.ttl_seconds
+        else:
+            since = self._synced_at - REVOCATION_SYNC_OVERLAP_SECONDS
+        rows = db.execute(
+            select(models.TokenRevocation.jti, models.TokenRevocation.user_id, models.TokenRevocation.revoked_at)
+            .where(models.TokenRevocation.revoked_at >= since)
+        ).all()
+        for jti, user_id, revoked_at in rows:
+            self._apply(jti, user_id, revoked_at)
+        self._synced_at = now
+        return len(rows)
+
+    def stats(self):
+        return {"revoked_tokens": len(self._tokens), "stale_users": len(self._stale_users)}
+
+    def _publish(self, db: Session, rows):
+        if not rows:
+            return
+        for row in rows:
+            self._apply(row.jti, row.user_id, row.revoked_at)
+        db.add_all(rows)
+        db.commit()
+
+    def _apply(self, jti, user_id, revoked_at: float):
+        if jti is not None:
+            self._add(self._tokens, jti, revoked_at)
+        # A re-read row changes nothing; a new one must not leave the old snapshot cached
+        if user_id is not None and self._add(self._stale_users, user_id, revoked_at):
+            principal_cache.invalidate_user(user_id)
+
+    def _add(self, entries: dict, key, stamp: float):
+        now = time.time()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, expired_entries, expired_key, expired_stamp = self._expiry.popleft()
+                if expired_entries.get(expired_key) == expired_stamp:
+                    del expired_entries[expired_key]
+            # A poll re-reads recent rows; only a later change moves an entry
+            if entries.get(key, float("-inf")) >= stamp or stamp + self.ttl_seconds <= now:
+                return False
+            entries[key] = stamp
+            self._expiry.append((stamp + self.ttl_seconds, entries, key, stamp))
+            return True
+
+revocation_list = RevocationList()
+
+def prune_revocations(db: Session, now: float = None):
+    """
+    Delete revocation rows older than any access token still valid. Does not commit.
+    """
+    now = now or time.time()
+    return db.execute(
+        delete(models.TokenRevocation).where(models.TokenRevocation.revoked_at < now - REVOCATION_TTL_SECONDS)
+    ).rowcount
+
+def sync_revocations():
+    """
+    Prune the table and poll it into this worker's list, with a dedicated session.
+    """
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        prune_revocations(db)
+        db.commit()
+        return revocation_list.sync(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_revocation_sync():
+    """
+    Background task polling the token_revocations table every REVOCATION_SYNC_SECONDS.
+    """
+    while True:
+        try:
+            await run_in_threadpool(sync_revocations)
+        except Exception:
+            # The next poll reads from the last successful one, so nothing is lost
+            logger.exception("Token revocation sync failed")
+        await asyncio.sleep(REVOCATION_SYNC_SECONDS)
@@ -0,0 +1,281 @@
+from datetime import datetime
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.orm import Session
+from ..database import models
+
+BACKFILL_BATCH_SIZE = 10000
+
+def month_bucket(timestamp: datetime):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def day_bucket(timestamp: datetime):
+    return timestamp.date()
+
+def active_plan_id(user_id: int):
+    """
+    SQL expression for the id of the user's active plan, 0 without one, evaluated
+    inside the statement that uses it.
+    """
+    return select(func.coalesce(func.min(models.Subscription.plan_id), 0)).where(
+        models.Subscription.user_id == user_id, models.Subscription.is_active == True
+    ).scalar_subquery()
+
+def upsert_counters(db: Session, model, rows: list, key_columns: list, counter_columns: list):
+    """
+    Insert counter rows, or add their counters to the existing rows with the same key.
+    Uses a native ON CONFLICT upsert on PostgreSQL and SQLite.
+    """
+    if not rows:
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={
+                column: getattr(model, column) + getattr(stmt.excluded, column)
+                for column in counter_columns
+            }
+        )
+        db.execute(stmt)
+        return
+
+    # Portable fallback: update in place, insert when the row does not exist yet
+    for row in rows:
+        result = db.execute(
+            update(model).where(
+                and_(*(getattr(model, column) == row[column] for column in key_columns))
+            ).values({
+                column: getattr(model, column) + row[column] for column in counter_columns
+            })
+        )
+        if result.rowcount == 0:
+            db.add(model(**row))
+    db.flush()
+
+def record_chat_usage(
+    db: Session, user_id: int, tokens: int, created_at: datetime, chats: int = 1,
+    model_name: str = None, cost_micros: int = 0, plan_id: int = None
+):
+    """
+    Add chat usage to the monthly rollup and, when a model is given,
+    to the user's per-model totals and the daily analytics rollup (cost in
+    micro-credits). Without `plan_id` the chat is attributed to the user's
+    active plan, looked up within the same statement.
+    Does not commit; callers write it in the same transaction as the chat row.
+    """
+    if model_name is not None:
+        upsert_counters(
+            db,
+            models.UserModelStats,
+            [{"user_id": user_id, "model_name": model_name, "chat_count": chats, "tokens": tokens, "cost_micros": cost_micros}],
+            ["user_id", "model_name"],
+            ["chat_count", "tokens", "cost_micros"]
+        )
+        upsert_counters(
+            db,
+            models.DailyUsage,
+            [{
+                "day": day_bucket(created_at),
+                "user_id": user_id,
+                "model_name": model_name,
+                "plan_id": plan_id if plan_id is not None else active_plan_id(user_id),
+                "chat_count": chats,
+                "tokens": tokens,
+                "cost_micros": cost_micros
+            }],
+            ["day", "user_id", "model_name", "plan_id"],
+            ["chat_count", "tokens", "cost_micros"]
+        )
+    upsert_counters(
+        db,
+        models.UsageRollup,
+        [{
+            "user_id": user_id,
+            "period": models.UsagePeriod.MONTH,
+            "bucket_start": month_bucket(created_at),
+            "chat_count": chats,
+            "tokens": tokens
+        }],
+        ["user_id", "period", "bucket_start"],
+        ["chat_count", "tokens"]
+    )
+
+def get_tokens_this_month(db: Session, user_id: int, now: datetime = None):
+    """
+    Return the user's tokens this month from the monthly rollup.
+    """
+    now = now or datetime.utcnow()
+    return db.execute(
+        select(models.UsageRollup.tokens).where(
+            models.UsageRollup.user_id == user_id,
+            models.UsageRollup.period == models.UsagePeriod.MONTH,
+            models.UsageRollup.bucket_start == month_bucket(now)
+        )
+    ).scalar() or 0
+
+def backfill_usage_rollups(db: Session):
+    """
+    Rebuild the monthly usage rollups from the chats table.
+    Streams chats ordered by user so only one user's buckets are held in memory.
+    """
+    db.query(models.UsageRollup).delete(synchronize_session=False)
+
+    chats = db.execute(
+        select(
+            models.Chat.user_id,
+            models.Chat.created_at,
+            models.Chat.input_tokens,
+            models.Chat.output_tokens
+        ).order_by(models.Chat.user_id).execution_options(yield_per=BACKFILL_BATCH_SIZE)
+    )
+
+    buckets = {}
+    current_user_id = None
+    total_chats = 0
+
+    def flush_buckets():
+        rows = [
+            {
+                "user_id": user_id,
+                "period": period,
+                "bucket_start": bucket_start,
+                "chat_count": chat_count,
+                "tokens": tokens
+            }
+            for (user_id, period, bucket_start), (chat_count, tokens) in buckets.items()
+        ]
+        for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+            db.execute(models.UsageRollup.__table__.insert(), rows[start:start + BACKFILL_BATCH_SIZE])
+        buckets.clear()
+
+    for user_id, created_at, input_tokens, output_tokens in chats:
+        if user_id != current_user_id and len(buckets) >= BACKFILL_BATCH_SIZE:
+            flush_buckets()
+        current_user_id = user_id
+        if created_at is None:
+            continue
+
+        tokens = (input_tokens or 0) + (output_tokens or 0)
+        key = (user_id, models.UsagePeriod.MONTH, month_bucket(created_at))
+        chat_count, total_tokens = buckets.get(key, (0, 0))
+        buckets[key] = (chat_count + 1, total_tokens + tokens)
+        total_chats += 1
+
+    flush_buckets()
+    backfill_model_stats(db)
+    backfill_daily_usage(db)
+    db.commit()
+    return total_chats
+
+def backfill_model_stats(db: Session):
+    """
+    Rebuild the per-model totals from the chats table with a single INSERT ... SELECT.
+    """
+    db.query(models.UserModelStats).delete(synchronize_session=False)
+    db.execute(
+        models.UserModelStats.__table__.insert().from_select(
+            ["user_id", "model_name", "chat_count", "tokens", "cost_micros"],
+            select(
+                models.Chat.user_id,
+                models.Chat.model_name,
+                func.count(models.Chat.id),
+                func.coalesce(func.sum(models.Chat.input_tokens + models.Chat.output_tokens), 0),
+                func.coalesce(func.sum(models.Chat.cost_micros), 0)
+            ).where(
+                models.Chat.model_name.isnot(None)
+            ).group_by(models.Chat.user_id, models.Chat.model_name)
+        )
+    )
+
+def subscription_periods(db: Session):
+    """
+    {user_id: [(start_date, end_date, plan_id), ...]} for every subscription ever taken.
+    """
+    periods = {}
+    for user_id, start_date, end_date, plan_id in db.execute(
+        select(
+            models.Subscription.user_id,
+            models.Subscription.start_date,
+            models.Subscription.end_date,
+            models.Subscription.plan_id
+        ).order_by(models.Subscription.user_id, models.Subscription.start_date)
+    ):
+        periods.setdefault(user_id, []).append((start_date, end_date, plan_id))
+    return periods
+
+def backfill_daily_usage(db: Session):
+    """
+    Rebuild the daily analytics rollup from the chats table, attributing each chat
+    to the plan of the subscription that covered it. Streams chats ordered by user
+    so only one user's days are held in memory.
+    """
+    db.query(models.DailyUsage).delete(synchronize_session=False)
+    periods = subscription_periods(db)
+
+    chats = db.execute(
+        select(
+            models.Chat.user_id,
+            models.Chat.created_at,
+            models.Chat.model_name,
+            models.Chat.input_tokens,
+            models.Chat.output_tokens,
+            models.Chat.cost_micros
+        ).where(
+            models.Chat.model_name.isnot(None)
+        ).order_by(models.Chat.user_id).execution_options(yield_per=BACKFILL_BATCH_SIZE)
+    )
+
+    buckets = {}
+    current_user_id = None
+
+    def flush_buckets():
+        rows = [
+            {
+                "day": day,
+                "user_id": user_id,
+                "model_name": model_name,
+                "plan_id": plan_id,
+                "chat_count": chat_count,
+                "tokens": tokens,
+                "cost_micros": cost_micros
+            }
+            for (day, user_id, model_name, plan_id), (chat_count, tokens, cost_micros) in buckets.items()
+        ]
+        for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+            db.execute(models.DailyUsage.__table__.insert(), rows[start:start + BACKFILL_BATCH_SIZE])
+        buckets.clear()
+
+    for user_id, created_at, model_name, input_tokens, output_tokens, cost_micros in chats:
+        if user_id != current_user_id and len(buckets) >= BACKFILL_BATCH_SIZE:
+            flush_buckets()
+        current_user_id = user_id
+
+        plan_id = 0
+        for start_date, end_date, subscribed_plan_id in periods.get(user_id, ()):
+            if (start_date is None or start_date <= created_at) and (end_date is None or created_at < end_date):
+                plan_id = subscribed_plan_id
+                break
+        key = (day_bucket(created_at), user_id, model_name, plan_id)
+        chat_count, tokens, cost = buckets.get(key, (0, 0, 0))
+        buckets[key] = (
+            chat_count + 1,
+            tokens + (input_tokens or 0) + (output_tokens or 0),
+            cost + (cost_micros or 0)
+        )
+
+    flush_buckets()
+
+if __name__ == "__main__":
+    from ..database.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(f"Backfilled usage rollups, model statistics and daily analytics from {backfill_usage_rollups(db)} chats")
+    finally:
+        db.close()
@@ -1,13 +1,28 @@
+from datetime import datetime
 from sqlalchemy.orm import Session
-from ..database import models, schemas
-from ..services.auth import get_password_hash, verify_password
+from ..database import models
+from ..database.database import read_only
+from ..models import schemas
+from ..money import from_micros, to_micros
+from . import ledger
+from .chat_log import chat_log
+from .pagination import keyset_page
+from ..services.auth import get_password_hash, revoke_user_refresh_tokens
+from .principal_cache import principal_cache
+from .reservation_store import reserved_credits
+from .usage_service import month_bucket
+from .token_revocation import revocation_list
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    # Async callers hash on the password worker pool and pass the result in
+    hashed_password = hashed_password or get_password_hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
-        hashed_password=hashed_password
+        hashed_password=hashed_password,
+        # Set here rather than by the server default so that every row has the
+        # same precision, which the admin listing's keyset cursor relies on
+        created_at=datetime.utcnow()
     )
     db.add(db_user)
     db.commit()
@@ -23,7 +38,7 @@ def get_user_by_email(db: Session, email: str):
 def get_user_by_id(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
-def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
+def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate, hashed_password: str = None):
     db_user = get_user_by_id(db, user_id)
     if not db_user:
         return None
@@ -33,9 +48,13 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     if user_update.email:
         db_user.email = user_update.email
     if user_update.password:
-        db_user.hashed_password = get_password_hash(user_update.password)
+        db_user.hashed_password = hashed_password or get_password_hash(user_update.password)
+        # A password change signs out every session at its next refresh
+        revoke_user_refresh_tokens(db, user_id)
     
     db.commit()
+    principal_cache.invalidate_user(user_id)
+    revocation_list.invalidate_claims(db, [user_id])
     db.refresh(db_user)
     return db_user
 
@@ -46,63 +65,41 @@ def delete_user(db: Session, user_id: int):
     
     db.delete(db_user)
     db.commit()
+    principal_cache.invalidate_user(user_id)
+    revocation_list.invalidate_claims(db, [user_id])
     return True
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
-
 def add_credits(db: Session, user_id: int, amount: float):
-    db_user = get_user_by_id(db, user_id)
-    if not db_user:
+    balance = ledger.credit(db, user_id, to_micros(amount), models.TransactionType.DEPOSIT, f"Added {amount} credits")
+    if balance is None:
+        db.rollback()
         return None
     
-    db_user.credits += amount
-    
-    # Create transaction record
-    transaction = models.Transaction(
-        user_id=user_id,
-        amount=amount,
-        transaction_type=models.TransactionType.DEPOSIT,
-        description=f"Added {amount} credits",
-        balance_after=db_user.credits
-    )
-    
-    db.add(transaction)
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return get_user_by_id(db, user_id)
 
 def deduct_credits(db: Session, user_id: int, amount: float, description: str = ""):
-    db_user = get_user_by_id(db, user_id)
-    if not db_user:
-        return None
-    
-    if db_user.credits < amount:
-        return None  # Insufficient credits
+    balance = ledger.debit(db, user_id, to_micros(amount), models.TransactionType.WITHDRAWAL, description)
+    if balance is None:
+        db.rollback()
+        return None  # Unknown user or insufficient credits
     
-    db_user.credits -= amount
-    
-    # Create transaction record
-    transaction = models.Transaction(
-        user_id=user_id,
-        amount=-amount,
-        transaction_type=models.TransactionType.WITHDRAWAL,
-        description=description,
-        balance_after=db_user.credits
-    )
-    
-    db.add(transaction)
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return get_user_by_id(db, user_id)
 
-def get_user_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Transaction).filter(
-        models.Transaction.user_id == user_id
-    ).offset(skip).limit(limit).all()
+@read_only
+def get_user_transactions(db: Session, user_id: int, cursor: str = None, limit: int = 100):
+    return keyset_page(
+        db.query(models.Transaction).filter(models.Transaction.user_id == user_id),
+        models.Transaction.created_at, models.Transaction.id, cursor, limit
+    )
 
 def get_user_balance(db: Session, user_id: int):
     db_user = get_user_by_id(db, user_id)
     if not db_user:
         return None
-    return db_user.credits
\ No newline at end of file
+    # Net of the chats admitted in write-behind mode but not yet debited,
+    # and of the credits held by reservations or settled but not yet flushed
+    held_cost, _ = chat_log.held(user_id, month_bucket(datetime.utcnow()))
+    reserved = reserved_credits([user_id]).get(user_id, 0)
+    return from_micros(db_user.credits_micros - held_cost - reserved)
\ No newline at end of file
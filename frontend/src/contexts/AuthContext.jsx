@@ -24,6 +24,33 @@ export function AuthProvider({ children }) {
     return config
   })
 
+  // Access tokens are short-lived: on a 401, exchange the refresh token once and retry
+  api.interceptors.response.use(undefined, async (error) => {
+    const original = error.config
+    const refreshToken = localStorage.getItem('refresh_token')
+    if (error.response?.status !== 401 || !refreshToken || original._retried || original.url === '/token/refresh') {
+      return Promise.reject(error)
+    }
+    original._retried = true
+    try {
+      const response = await api.post('/token/refresh', { refresh_token: refreshToken })
+      storeTokens(response.data)
+    } catch (refreshError) {
+      localStorage.removeItem('token')
+      localStorage.removeItem('refresh_token')
+      setUser(null)
+      return Promise.reject(error)
+    }
+    return api(original)
+  })
+
+  const storeTokens = (tokens) => {
+    localStorage.setItem('token', tokens.access_token)
+    if (tokens.refresh_token) {
+      localStorage.setItem('refresh_token', tokens.refresh_token)
+    }
+  }
+
   const login = async (username, password) => {
     try {
       const response = await api.post('/token', new URLSearchParams({
@@ -35,7 +62,7 @@ export function AuthProvider({ children }) {
         }
       })
       
-      localStorage.setItem('token', response.data.access_token)
+      storeTokens(response.data)
       setUser(response.data.user)
       return { success: true }
     } catch (error) {
@@ -52,8 +79,17 @@ export function AuthProvider({ children }) {
     }
   }
 
-  const logout = () => {
+  const logout = async () => {
+    const refreshToken = localStorage.getItem('refresh_token')
+    if (refreshToken) {
+      try {
+        await api.post('/logout', { refresh_token: refreshToken })
+      } catch (error) {
+        // Signing out locally does not depend on the server revoking the tokens
+      }
+    }
     localStorage.removeItem('token')
+    localStorage.removeItem('refresh_token')
     setUser(null)
   }
 
@@ -63,6 +99,7 @@ export function AuthProvider({ children }) {
       setUser(response.data)
     } catch (error) {
       localStorage.removeItem('token')
+      localStorage.removeItem('refresh_token')
       setUser(null)
     }
   }
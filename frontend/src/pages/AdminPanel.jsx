@@ -5,6 +5,8 @@ import { UserGroupIcon, CurrencyDollarIcon, ChartBarIcon } from '@heroicons/reac
 const AdminPanel = () => {
   const { api } = useAuth()
   const [users, setUsers] = useState([])
+  const [userCount, setUserCount] = useState(null)
+  const [nextCursor, setNextCursor] = useState(null)
   const [stats, setStats] = useState({})
   const [loading, setLoading] = useState(true)
   const [searchTerm, setSearchTerm] = useState('')
@@ -13,13 +15,29 @@ const AdminPanel = () => {
     fetchAdminData()
   }, [api])
 
+  // Search runs on the server; wait for typing to pause before querying
+  useEffect(() => {
+    const timer = setTimeout(() => fetchUsers(), 300)
+    return () => clearTimeout(timer)
+  }, [api, searchTerm])
+
+  const fetchUsers = async (cursor = null) => {
+    try {
+      const params = { limit: 50 }
+      if (searchTerm) params.q = searchTerm
+      if (cursor) params.cursor = cursor
+      const response = await api.get('/admin/users', { params })
+      setUsers(cursor ? [...users, ...response.data.items] : response.data.items)
+      setNextCursor(response.data.next_cursor)
+      if (!cursor) setUserCount({ total: response.data.total, estimate: response.data.total_is_estimate })
+    } catch (error) {
+      console.error('Failed to fetch users:', error)
+    }
+  }
+
   const fetchAdminData = async () => {
     try {
-      const [usersResponse, statsResponse] = await Promise.all([
-        api.get('/admin/users'),
-        api.get('/admin/stats')
-      ])
-      setUsers(usersResponse.data)
+      const statsResponse = await api.get('/admin/stats')
       setStats(statsResponse.data)
     } catch (error) {
       console.error('Failed to fetch admin data:', error)
@@ -31,17 +49,14 @@ const AdminPanel = () => {
   const handleUserAction = async (userId, action, data = {}) => {
     try {
       await api.post(`/admin/users/${userId}/${action}`, data)
-      fetchAdminData() // Refresh data
+      // Refresh data
+      fetchAdminData()
+      fetchUsers()
     } catch (error) {
       alert('Failed to perform action: ' + (error.response?.data?.detail || 'Unknown error'))
     }
   }
 
-  const filteredUsers = users.filter(user =>
-    user.username.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    user.email.toLowerCase().includes(searchTerm.toLowerCase())
-  )
-
   const getStatusColor = (status) => {
     switch (status) {
       case 'active':
@@ -115,7 +130,14 @@ const AdminPanel = () => {
       <div className="bg-white rounded-lg shadow">
         <div className="px-6 py-4 border-b border-gray-200">
           <div className="flex items-center justify-between">
-            <h2 className="text-lg font-semibold text-gray-900">Users Management</h2>
+            <h2 className="text-lg font-semibold text-gray-900">
+              Users Management
+              {userCount && (
+                <span className="ml-2 text-sm font-normal text-gray-500">
+                  {userCount.estimate ? '~' : ''}{userCount.total} found
+                </span>
+              )}
+            </h2>
             <div className="flex space-x-4">
               <input
                 type="text"
@@ -128,7 +150,7 @@ const AdminPanel = () => {
           </div>
         </div>
         <div className="p-6">
-          {filteredUsers.length === 0 ? (
+          {users.length === 0 ? (
             <div className="text-center py-8 text-gray-500">
               No users found
             </div>
@@ -146,7 +168,7 @@ const AdminPanel = () => {
                   </tr>
                 </thead>
                 <tbody className="bg-white divide-y divide-gray-200">
-                  {filteredUsers.map((user) => (
+                  {users.map((user) => (
                     <tr key={user.id}>
                       <td className="px-6 py-4 whitespace-nowrap">
                         <div className="text-sm font-medium text-gray-900">{user.username}</div>
@@ -162,8 +184,8 @@ const AdminPanel = () => {
                         </span>
                       </td>
                       <td className="px-6 py-4 whitespace-nowrap">
-                        <span className={`inline-flex px-2 py-1 text-xs font-semibold rounded-full ${getStatusColor(user.status)}`}>
-                          {getStatusText(user.status)}
+                        <span className={`inline-flex px-2 py-1 text-xs font-semibold rounded-full ${getStatusColor(user.is_active ? 'active' : 'inactive')}`}>
+                          {getStatusText(user.is_active ? 'active' : 'inactive')}
                         </span>
                       </td>
                       <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
@@ -196,6 +218,16 @@ const AdminPanel = () => {
                   ))}
                 </tbody>
               </table>
+              {nextCursor && (
+                <div className="text-center pt-4">
+                  <button
+                    onClick={() => fetchUsers(nextCursor)}
+                    className="text-blue-600 hover:text-blue-900 text-sm font-medium"
+                  >
+                    Load more
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
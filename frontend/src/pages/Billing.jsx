@@ -15,7 +15,7 @@ const Billing = () => {
   const fetchTransactions = async () => {
     try {
       const response = await api.get('/users/me/transactions')
-      setTransactions(response.data)
+      setTransactions(response.data.items)
     } catch (error) {
       console.error('Failed to fetch transactions:', error)
     } finally {
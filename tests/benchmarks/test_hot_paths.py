@@ -0,0 +1,65 @@
+"""
+Micro-benchmarks for hot request-path functions: chat pricing, subscription
+usage against a seeded in-memory database, and the JWT path (issuing a
+claims-bearing access token, and decoding one into a principal as every
+authenticated request does).
+
+Save a baseline and fail on regressions with pytest-benchmark, e.g.:
+    python -m pytest tests/benchmarks --benchmark-only --benchmark-autosave
+    python -m pytest tests/benchmarks --benchmark-only --benchmark-compare --benchmark-compare-fail=mean:25%
+"""
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from backend.benchmarks.seed import seed
+from backend.database import models
+from backend.services import auth, chat_service, subscription_service
+from backend.services.pricing_engine import pricing_engine
+
+SEED_USERS = 200
+SEED_CHATS_PER_USER = 50
+
+@pytest.fixture(scope="module")
+def seeded_db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = session_factory()
+    seed(db, SEED_USERS, SEED_CHATS_PER_USER, "secret")
+    # Price from the benchmark database rather than the configured one
+    previous_factory = pricing_engine.session_factory
+    pricing_engine.session_factory = session_factory
+    pricing_engine.invalidate()
+    yield db
+    pricing_engine.session_factory = previous_factory
+    pricing_engine.invalidate()
+    db.close()
+    engine.dispose()
+
+@pytest.fixture(scope="module")
+def principal(seeded_db):
+    user = seeded_db.query(models.User).filter(models.User.username == "user1").one()
+    return auth.get_principal(seeded_db, user.username)
+
+def test_calculate_chat_cost(benchmark, seeded_db):
+    # Warm the price cache the measured path relies on
+    chat_service.calculate_chat_cost(500, 800, "gpt-4")
+    assert benchmark(chat_service.calculate_chat_cost, 500, 800, "gpt-4") == 63000
+
+def test_get_subscription_usage(benchmark, seeded_db, principal):
+    usage = benchmark(subscription_service.get_subscription_usage, seeded_db, principal.id)
+    assert usage["plan"] is not None
+
+def test_jwt_issue(benchmark, principal):
+    assert benchmark(auth.create_principal_token, principal)
+
+def test_jwt_authenticate(benchmark, principal):
+    token = auth.create_principal_token(principal)
+    loop = asyncio.new_event_loop()
+    try:
+        user = benchmark(lambda: loop.run_until_complete(auth.get_current_user(db=None, token=token)))
+    finally:
+        loop.close()
+    assert user.id == principal.id
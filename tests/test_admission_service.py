@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from sqlalchemy.orm import sessionmaker
+from backend.database import models
+from backend.services import admission_service, rate_limiter, reservation_store
+from backend.services.admission_service import admit_chat, admit_chat_batch
+from backend.services.chat_service import calculate_chat_cost
+from backend.services.pricing_engine import pricing_engine
+from backend.services.rate_limiter import MemoryRateLimiter, chats_this_hour
+from backend.services.reservation_service import reserve_credits, settle_reservation
+from backend.services.reservation_store import MemoryReservationStore
+
+@pytest.fixture(autouse=True)
+def services(db, monkeypatch):
+    monkeypatch.setattr(pricing_engine, "session_factory", sessionmaker(bind=db.get_bind()))
+    pricing_engine.invalidate()
+    monkeypatch.setattr(rate_limiter, "_rate_limiter", MemoryRateLimiter())
+    monkeypatch.setattr(reservation_store, "_reservation_store", MemoryReservationStore())
+    yield
+    pricing_engine.invalidate()
+
+def subscribe(
+    db, user_id: int, name: str, vip: bool, days: int, max_chats_per_hour: int = 10, max_tokens_per_month: int = 1000000
+):
+    plan = models.SubscriptionPlan(
+        name=name, price_micros=0, duration_days=days, max_chats_per_hour=max_chats_per_hour,
+        max_tokens_per_month=max_tokens_per_month, can_access_vip_models=vip
+    )
+    db.add(plan)
+    db.flush()
+    db.add(models.Subscription(
+        user_id=user_id, plan_id=plan.id, end_date=datetime.utcnow() + timedelta(days=days), is_active=True
+    ))
+    db.commit()
+
+@pytest.fixture
+def user_id(db):
+    user = models.User(username="alice", email="alice@example.com", hashed_password="x", credits_micros=10000000)
+    db.add(user)
+    db.commit()
+    return user.id
+
+def test_failed_commit_gives_back_the_hourly_slot(db, user_id, monkeypatch):
+    subscribe(db, user_id, "basic", False, 30)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("rollup unavailable")
+    monkeypatch.setattr(admission_service, "record_chat_usage", fail)
+    with pytest.raises(RuntimeError):
+        admit_chat(db, user_id, "llama-2", 10, 20)
+    assert chats_this_hour(user_id) == 0
+
+def test_plan_of_the_latest_ending_subscription_applies(db, user_id):
+    subscribe(db, user_id, "basic", False, 10)
+    subscribe(db, user_id, "vip", True, 30)
+    chat, error = admit_chat(db, user_id, "gpt-4", 10, 20)
+    assert error is None and chat.model_name == "gpt-4"
+
+def test_batch_checks_only_records_within_the_rate_limit(db, user_id):
+    subscribe(db, user_id, "basic", False, 30, max_chats_per_hour=1)
+    cost = calculate_chat_cost(10, 20, "llama-2")
+    db.get(models.User, user_id).credits_micros = 2 * cost
+    db.commit()
+    records = [SimpleNamespace(user_id=user_id, model_name="llama-2", input_tokens=10, output_tokens=20)] * 3
+    results = admit_chat_batch(db, records)
+    assert [result["accepted"] for result in results] == [True, False, False]
+    # The second record was never charged, so the third is refused for the rate limit, not for funds
+    assert results[2]["error"] == "Rate limit exceeded: Too many requests"
+    assert chats_this_hour(user_id) == 1
+
+def test_failed_batch_gives_back_its_slots(db, user_id, monkeypatch):
+    subscribe(db, user_id, "basic", False, 30)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("rollup unavailable")
+    monkeypatch.setattr(admission_service, "record_chat_usage", fail)
+    records = [SimpleNamespace(user_id=user_id, model_name="llama-2", input_tokens=10, output_tokens=20)] * 3
+    with pytest.raises(RuntimeError):
+        admit_chat_batch(db, records)
+    assert chats_this_hour(user_id) == 0
+
+def test_settlement_cannot_overdraw_the_balance(db, user_id):
+    subscribe(db, user_id, "basic", False, 30)
+    reserved_cost = calculate_chat_cost(10, 20, "llama-2")
+    db.get(models.User, user_id).credits_micros = 2 * reserved_cost
+    db.commit()
+    reservation, error = reserve_credits(db, user_id, "llama-2", 10, 20)
+    assert error is None
+    cost = settle_reservation(db, user_id, reservation["reservation_id"], 10000, 20000)
+    assert cost == 2 * reserved_cost
+    assert reserve_credits(db, user_id, "llama-2", 10, 20) == (None, "Insufficient credits")
+
+def test_settled_tokens_count_toward_the_month_before_the_flush(db, user_id):
+    subscribe(db, user_id, "basic", False, 30, max_tokens_per_month=100)
+    reservation, _ = reserve_credits(db, user_id, "llama-2", 10, 20)
+    settle_reservation(db, user_id, reservation["reservation_id"], 40, 60)
+    chat, error = admit_chat(db, user_id, "llama-2", 10, 20)
+    assert chat is None and error == "Rate limit exceeded: Too many requests"
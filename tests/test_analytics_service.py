@@ -0,0 +1,22 @@
+from datetime import date, datetime
+import pytest
+from backend.services import analytics_service
+from backend.services.analytics_service import DEFAULT_RANGE_DAYS, date_range
+
+class LateEvening(datetime):
+    """
+    23:30 UTC on 2024-03-10, already the next day east of UTC.
+    """
+    @classmethod
+    def utcnow(cls):
+        return cls(2024, 3, 10, 23, 30)
+
+def test_default_range_ends_after_today_in_utc(monkeypatch):
+    monkeypatch.setattr(analytics_service, "datetime", LateEvening)
+    start, end = date_range()
+    assert end == date(2024, 3, 11)
+    assert (end - start).days == DEFAULT_RANGE_DAYS
+
+def test_empty_range_is_rejected():
+    with pytest.raises(ValueError):
+        date_range(date(2024, 3, 10), date(2024, 3, 10))
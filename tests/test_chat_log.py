@@ -0,0 +1,100 @@
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from backend.database import models
+from backend.services import chat_log as chat_log_module
+from backend.services.chat_log import ChatLog
+from backend.services.usage_service import month_bucket
+
+@pytest.fixture
+def log(tmp_path):
+    return ChatLog(directory=str(tmp_path), fsync=False)
+
+@pytest.fixture
+def user_id(db):
+    user = models.User(username="alice", email="alice@example.com", hashed_password="x", credits_micros=10000000)
+    db.add(user)
+    db.commit()
+    return user.id
+
+@pytest.fixture
+def reject(monkeypatch):
+    """
+    Make the database reject any write that includes a chat for the model "bad".
+    """
+    write_settled_chats = chat_log_module.write_settled_chats
+
+    def rejecting(db, segment_id, events, completed=()):
+        if any(event["model_name"] == "bad" for event in events):
+            raise ValueError("rejected")
+        return write_settled_chats(db, segment_id, events, completed)
+    monkeypatch.setattr(chat_log_module, "write_settled_chats", rejecting)
+
+def queue(log, user_id: int, model_name: str = "gpt-4", cost: int = 1000):
+    now = datetime.utcnow()
+    assert log.hold(user_id, month_bucket(now), cost, 30, log.generation, lambda held_cost, held_tokens: None) is None
+    log.append({
+        "user_id": user_id, "model_name": model_name, "input_tokens": 10, "output_tokens": 20,
+        "cost": cost, "created_at": now.isoformat()
+    })
+
+def chat_count(db):
+    return db.execute(select(func.count(models.Chat.id))).scalar()
+
+def balance(db, user_id: int):
+    return db.execute(select(models.User.credits_micros).where(models.User.id == user_id)).scalar()
+
+def test_flush_writes_queued_chats(db, log, user_id):
+    queue(log, user_id)
+    queue(log, user_id, cost=2000)
+    assert log.flush(db) == 2
+    assert chat_count(db) == 2
+    assert balance(db, user_id) == 10000000 - 3000
+    assert log.stats() == {"queued": 0, "sealed_segments": 0, "held_users": 0}
+
+def test_rejected_chat_is_dead_lettered(db, log, user_id, reject, tmp_path):
+    queue(log, user_id)
+    queue(log, user_id, "bad", cost=5000)
+    queue(log, user_id, cost=2000)
+    assert log.flush(db) == 2
+    assert chat_count(db) == 2
+    assert balance(db, user_id) == 10000000 - 3000
+    assert log.stats()["queued"] == 0
+    dead = os.listdir(tmp_path / "dead")
+    assert len(dead) == 1
+    assert (tmp_path / "dead" / dead[0]).read_text().count("\n") == 1
+    # The queue is not held up behind the rejected chat
+    queue(log, user_id)
+    assert log.flush(db) == 1
+
+def test_transient_failure_keeps_segment_queued(db, log, user_id, monkeypatch, tmp_path):
+    queue(log, user_id)
+    write_settled_chats = chat_log_module.write_settled_chats
+
+    def unavailable(*args, **kwargs):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+    with monkeypatch.context() as patch:
+        patch.setattr(chat_log_module, "write_settled_chats", unavailable)
+        with pytest.raises(OperationalError):
+            log.flush(db)
+    assert chat_log_module.write_settled_chats is write_settled_chats
+    assert log.stats()["sealed_segments"] == 1
+    assert not (tmp_path / "dead").exists()
+    assert log.flush(db) == 1
+    assert chat_count(db) == 1
+
+def test_replay_resumes_an_interrupted_split(db, tmp_path, user_id, reject):
+    crashed = ChatLog(directory=str(tmp_path), fsync=False)
+    queue(crashed, user_id)
+    queue(crashed, user_id, "bad")
+    queue(crashed, user_id)
+    segment = crashed._segment
+    # The first chat was written on its own before the process died
+    chat_log_module.write_settled_chats(db, segment.id + ":0", segment.events[:1])
+    segment.file.close()
+
+    assert ChatLog(directory=str(tmp_path), fsync=False).recover(db) == 1
+    assert chat_count(db) == 2
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".log")] == []
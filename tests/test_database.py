@@ -0,0 +1,25 @@
+import asyncio
+import threading
+from datetime import datetime
+from sqlalchemy.util import greenlet_spawn
+from backend.database.database import engine_options, run_blocking
+from backend.database.partitioning import partition_bound
+
+def test_run_blocking_runs_inline_off_the_event_loop():
+    assert run_blocking(threading.get_ident) == threading.get_ident()
+
+def test_run_blocking_leaves_the_event_loop_thread_under_run_sync():
+    async def main():
+        # greenlet_spawn is how AsyncSession.run_sync calls service code
+        return threading.get_ident(), await greenlet_spawn(run_blocking, threading.get_ident)
+
+    loop_thread, called_in = asyncio.run(main())
+    assert called_in != loop_thread
+
+def test_postgresql_sessions_run_in_utc():
+    assert engine_options("postgresql://db/app")["connect_args"] == {"options": "-c timezone=UTC"}
+    assert engine_options("postgresql+asyncpg://db/app")["connect_args"] == {"server_settings": {"timezone": "UTC"}}
+    assert "connect_args" not in engine_options("sqlite://")
+
+def test_partition_bounds_are_utc_literals():
+    assert partition_bound(datetime(2024, 2, 1)) == "2024-02-01 00:00:00+00"
@@ -0,0 +1,18 @@
+from backend.services.export_service import CHAT_COLUMNS, TRANSACTION_COLUMNS, encode_csv, encode_ndjson, in_credits
+
+def test_money_columns_are_exported_in_credits():
+    names = [column.key for column in TRANSACTION_COLUMNS]
+    assert names == ["id", "amount", "transaction_type", "description", "balance_after", "created_at"]
+    rows = in_credits(names, [(1, -1500, "chat_cost", "Chat", 98500000, None)])
+    assert encode_ndjson(names, rows) == (
+        '{"id":1,"amount":-0.0015,"transaction_type":"chat_cost","description":"Chat",'
+        '"balance_after":98.5,"created_at":null}\n'
+    )
+
+def test_chat_cost_is_exported_in_credits():
+    names = [column.key for column in CHAT_COLUMNS]
+    rows = in_credits(names, [(1, "gpt-4", 100, 200, 15000, None)])
+    assert encode_csv(names, rows, header=True).splitlines() == [
+        "id,model_name,input_tokens,output_tokens,cost,created_at",
+        "1,gpt-4,100,200,0.015,"
+    ]
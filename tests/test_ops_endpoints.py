@@ -0,0 +1,28 @@
+import pytest
+from fastapi.testclient import TestClient
+from backend.main import app
+from backend.services import auth
+from backend.services.principal_cache import Principal
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def bearer(role: str):
+    principal = Principal(id=1, username="alice", role=role, is_active=True, plan_id=None, can_access_vip_models=False)
+    return {"Authorization": f"Bearer {auth.create_principal_token(principal)}"}
+
+@pytest.mark.parametrize("path", ["/metrics", "/health/db", "/health/cache"])
+def test_internals_are_for_admins_only(client, path):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=bearer("user")).status_code == 403
+    assert client.get(path, headers=bearer("admin")).status_code == 200
+
+def test_liveness_stays_public(client):
+    assert client.get("/health").status_code == 200
+
+def test_scraper_reads_metrics_with_the_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(auth, "METRICS_TOKEN", "scrape")
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape"}).status_code == 200
+    assert client.get("/health/db", headers={"Authorization": "Bearer scrape"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer other"}).status_code == 401
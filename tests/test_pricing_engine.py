@@ -0,0 +1,29 @@
+from datetime import datetime
+from backend.money import to_micros
+from backend.services.pricing_engine import DEFAULT_TABLE, PricingTable
+
+NOW = datetime(2024, 6, 1)
+
+def table(*rows):
+    return PricingTable([
+        (pattern, effective_from, 0, to_micros(input_price), to_micros(output_price))
+        for pattern, effective_from, input_price, output_price in rows
+    ], version=1, fallback=DEFAULT_TABLE)
+
+def test_defaults_price_models_the_table_does_not():
+    prices = table(("llama-2", None, 0.001, 0.001))
+    assert prices.cost("llama-2", 1000, 1000, NOW) == to_micros(0.002)
+    assert prices.cost("gpt-4", 1000, 1000, NOW) == to_micros(0.09)
+    assert prices.cost("vip-gpt-4", 1000, 1000, NOW) == to_micros(0.15)
+    assert prices.cost("unknown", 1000, 1000, NOW) == to_micros(0.003)
+
+def test_table_rows_override_the_defaults():
+    prices = table(("gpt-4*", None, 0.01, 0.02))
+    assert prices.cost("gpt-4", 1000, 1000, NOW) == to_micros(0.03)
+    assert prices.cost("gpt-4-turbo", 1000, 1000, NOW) == to_micros(0.03)
+    assert prices.costs(["gpt-4", "llama-2"], [1000, 1000], [1000, 1000], NOW) == [to_micros(0.03), to_micros(0.001)]
+
+def test_defaults_apply_until_a_price_takes_effect():
+    prices = table(("gpt-4", datetime(2024, 7, 1), 0.01, 0.02))
+    assert prices.cost("gpt-4", 1000, 1000, NOW) == to_micros(0.09)
+    assert prices.cost("gpt-4", 1000, 1000, datetime(2024, 7, 2)) == to_micros(0.03)
@@ -0,0 +1,37 @@
+from datetime import datetime
+import pytest
+from sqlalchemy.orm import sessionmaker
+from backend.database import models
+from backend.models import schemas
+from backend.services.pricing_engine import pricing_engine
+from backend.services.pricing_service import create_model_price
+
+@pytest.fixture(autouse=True)
+def engine_session(db, monkeypatch):
+    monkeypatch.setattr(pricing_engine, "session_factory", sessionmaker(bind=db.get_bind()))
+    pricing_engine.invalidate()
+    yield
+    pricing_engine.invalidate()
+
+def price(tier_start_tokens: int = 0, effective_from: datetime = None, input_price: float = 0.01):
+    return schemas.ModelPriceCreate(
+        model_pattern="gpt-4", input_price=input_price, output_price=0.02,
+        tier_start_tokens=tier_start_tokens, effective_from=effective_from
+    )
+
+def test_higher_tier_needs_the_tier_0_row_of_its_version(db):
+    create_model_price(db, price())
+    later = datetime(2030, 1, 1)
+    with pytest.raises(ValueError):
+        create_model_price(db, price(1000, later))
+    create_model_price(db, price(0, later))
+    assert create_model_price(db, price(1000, later)).tier_start_tokens == 1000
+
+def test_versions_continue_from_existing_rows(db):
+    db.add(models.ModelPrice(
+        model_pattern="llama-2", input_price_micros=1, output_price_micros=1, tier_start_tokens=0, version=7
+    ))
+    db.commit()
+    assert create_model_price(db, price()).version == 8
+    assert create_model_price(db, price(0, datetime(2030, 1, 1))).version == 9
+    assert pricing_engine.table().version == 9
@@ -0,0 +1,53 @@
+import pytest
+from backend.services.rate_limiter import MemoryRateLimiter, RedisRateLimiter
+
+@pytest.fixture(params=["memory", "redis"])
+def limiter(request, clock):
+    if request.param == "memory":
+        return MemoryRateLimiter()
+    return RedisRateLimiter(request.getfixturevalue("redis_client"))
+
+def test_acquire_up_to_limit(limiter):
+    assert [limiter.acquire("user", 3) for _ in range(4)] == [1, 1, 1, 0]
+    assert limiter.count("user") == 3
+
+def test_acquire_grants_part_of_a_batch(limiter):
+    assert limiter.acquire("user", 5, count=3) == 3
+    assert limiter.acquire("user", 5, count=3) == 2
+    assert limiter.acquire("user", 5, count=3) == 0
+    assert limiter.count("user") == 5
+
+def test_keys_are_independent(limiter):
+    assert limiter.acquire("a", 1) == 1
+    assert limiter.acquire("b", 1) == 1
+    assert limiter.acquire("a", 1) == 0
+
+def test_window_slides(limiter, clock):
+    limiter.acquire("user", 2, window_seconds=60)
+    clock.advance(30)
+    limiter.acquire("user", 2, window_seconds=60)
+    assert limiter.acquire("user", 2, window_seconds=60) == 0
+
+    # The first slot leaves the window, the second is still in it
+    clock.advance(31)
+    assert limiter.count("user", window_seconds=60) == 1
+    assert limiter.acquire("user", 2, count=2, window_seconds=60) == 1
+
+def test_reset(limiter):
+    limiter.acquire("user", 1)
+    limiter.reset("user")
+    assert limiter.count("user") == 0
+    assert limiter.acquire("user", 1) == 1
+
+def test_redis_key_expires_with_the_window(redis_client, clock):
+    limiter = RedisRateLimiter(redis_client)
+    limiter.acquire("user", 1, window_seconds=60)
+    assert 0 < redis_client.pttl("ratelimit:user") <= 60000
+
+def test_release_returns_the_latest_slots(limiter):
+    assert limiter.acquire("user", 3, count=3) == 3
+    limiter.release("user", 2)
+    assert limiter.count("user") == 1
+    assert limiter.acquire("user", 3, count=3) == 2
+    limiter.release("other")
+    assert limiter.count("other") == 0
@@ -0,0 +1,24 @@
+import pytest
+from backend.database import models
+from backend.services import auth
+
+@pytest.fixture
+def user_id(db):
+    user = models.User(username="alice", email="alice@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user.id
+
+def test_rotation_issues_a_new_single_use_token(db, user_id):
+    first = auth.create_token_pair(db, user_id)["refresh_token"]
+    second = auth.rotate_refresh_token(db, first)["refresh_token"]
+    assert second != first
+    assert auth.rotate_refresh_token(db, second) is not None
+
+@pytest.mark.parametrize("rotations", [1, 2, 5])
+def test_replaying_any_rotated_token_revokes_the_family(db, user_id, rotations):
+    tokens = [auth.create_token_pair(db, user_id)["refresh_token"]]
+    for _ in range(rotations):
+        tokens.append(auth.rotate_refresh_token(db, tokens[-1])["refresh_token"])
+    assert auth.rotate_refresh_token(db, tokens[0]) is None
+    assert auth.rotate_refresh_token(db, tokens[-1]) is None
@@ -0,0 +1,111 @@
+import pytest
+from backend.services.reservation_store import MemoryReservationStore, RedisReservationStore
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, clock):
+    if request.param == "memory":
+        return MemoryReservationStore()
+    return RedisReservationStore(request.getfixturevalue("redis_client"))
+
+def settlement(user_id: int, cost: int):
+    return {
+        "user_id": user_id, "model_name": "gpt-4", "input_tokens": 10, "output_tokens": 20,
+        "cost": cost, "created_at": "2024-01-01T00:00:00"
+    }
+
+def test_reserve_holds_against_the_balance(store):
+    first = store.reserve(1, 600, 1000, "gpt-4")
+    assert first is not None
+    assert store.get(first) == {"user_id": 1, "model_name": "gpt-4", "amount": 600}
+    assert store.reserve(1, 500, 1000, "gpt-4") is None
+    assert store.reserve(1, 400, 1000, "gpt-4") is not None
+    # Other users are unaffected
+    assert store.reserve(2, 1000, 1000, "gpt-4") is not None
+
+def test_release_frees_the_hold(store):
+    reservation_id = store.reserve(1, 1000, 1000, "gpt-4")
+    assert store.release(reservation_id)
+    assert not store.release(reservation_id)
+    assert store.get(reservation_id) is None
+    assert store.reserve(1, 1000, 1000, "gpt-4") is not None
+
+def test_expired_holds_are_released(store, clock):
+    store.reserve(1, 1000, 1000, "gpt-4", ttl_seconds=60)
+    assert store.reserve(1, 1, 1000, "gpt-4") is None
+    clock.advance(61)
+    assert store.reserve(1, 1000, 1000, "gpt-4") is not None
+
+def test_settle_keeps_the_cost_pending_until_flushed(store):
+    reservation_id = store.reserve(1, 600, 1000, "gpt-4")
+    assert store.settle(reservation_id, settlement(1, 300), 1000) == 300
+    assert store.settle(reservation_id, settlement(1, 300), 1000) is None
+    # The hold is replaced by the settled cost
+    assert store.reserve(1, 800, 1000, "gpt-4") is None
+    assert store.reserve(1, 700, 1000, "gpt-4") is not None
+
+def test_drain_moves_settlements_into_a_batch(store):
+    for cost in (100, 200, 300):
+        store.settle(store.reserve(1, cost, 1000, "gpt-4"), settlement(1, cost), 1000)
+    batch_id, drained = store.drain(2)
+    assert [item["cost"] for item in drained] == [100, 200]
+    other_id, rest = store.drain(10)
+    assert other_id != batch_id
+    assert [item["cost"] for item in rest] == [300]
+    assert store.drain(10) == (None, [])
+
+def test_mark_flushed_releases_pending_once(store):
+    store.settle(store.reserve(1, 1000, 1000, "gpt-4"), settlement(1, 1000), 1000)
+    assert store.reserve(1, 1, 1000, "gpt-4") is None
+    batch_id, _ = store.drain(10)
+    # Drained but not yet acknowledged, the cost is still pending
+    assert store.reserved([1]) == {1: 1000}
+    assert store.mark_flushed(batch_id, {1: (1000, 30)})
+    assert not store.mark_flushed(batch_id, {1: (1000, 30)})
+    assert store.reserved([1]) == {}
+    assert store.claim_stale() == []
+
+def test_unacknowledged_batches_are_claimed_after_their_lease(store, clock):
+    store.settle(store.reserve(1, 100, 1000, "gpt-4"), settlement(1, 100), 1000)
+    batch_id, drained = store.drain(10, lease_seconds=60)
+    assert store.claim_stale(lease_seconds=60) == []
+    clock.advance(61)
+    assert store.claim_stale(lease_seconds=60) == [(batch_id, drained)]
+    # Claiming renews the lease
+    assert store.claim_stale(lease_seconds=60) == []
+
+def test_retry_makes_a_batch_claimable_at_once(store):
+    store.settle(store.reserve(1, 100, 1000, "gpt-4"), settlement(1, 100), 1000)
+    batch_id, drained = store.drain(10)
+    store.retry(batch_id)
+    assert store.claim_stale() == [(batch_id, drained)]
+    store.mark_flushed(batch_id, {1: (100, 30)})
+    # An acknowledged batch is not brought back
+    store.retry(batch_id)
+    assert store.claim_stale() == []
+
+def test_reserved_sums_holds_and_pending(store, clock):
+    store.reserve(1, 300, 1000, "gpt-4", ttl_seconds=60)
+    store.settle(store.reserve(1, 500, 1000, "gpt-4"), settlement(1, 200), 1000)
+    store.reserve(2, 100, 1000, "gpt-4")
+    assert store.reserved([1, 2, 3]) == {1: 500, 2: 100}
+    clock.advance(61)
+    assert store.reserved([1]) == {1: 200}
+
+def test_settle_caps_the_cost_at_the_spendable_balance(store):
+    reservation_id = store.reserve(1, 300, 1000, "gpt-4")
+    store.reserve(1, 500, 1000, "gpt-4")
+    # 300 reserved plus the 200 no other hold uses
+    assert store.settle(reservation_id, settlement(1, 900), 1000) == 500
+    _, drained = store.drain(10)
+    assert drained[0]["cost"] == 500
+    # The reserved amount is always covered
+    reservation_id = store.reserve(2, 300, 1000, "gpt-4")
+    assert store.settle(reservation_id, settlement(2, 900), 100) == 300
+
+def test_settled_tokens_are_pending_until_flushed(store):
+    store.settle(store.reserve(1, 100, 1000, "gpt-4"), settlement(1, 100), 1000)
+    store.settle(store.reserve(1, 100, 1000, "gpt-4"), settlement(1, 100), 1000)
+    assert store.pending_tokens([1, 2]) == {1: 60}
+    batch_id, _ = store.drain(1)
+    store.mark_flushed(batch_id, {1: (100, 30)})
+    assert store.pending_tokens([1]) == {1: 30}
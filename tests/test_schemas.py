@@ -0,0 +1,16 @@
+import pytest
+from pydantic import ValidationError
+from backend.models import schemas
+
+@pytest.mark.parametrize("schema, fields", [
+    (schemas.ChatCreate, {"model_name": "gpt-4", "cost": 0}),
+    (schemas.ChatUsageRecord, {"user_id": 1, "model_name": "gpt-4"}),
+    (schemas.ChatReservationCreate, {"model_name": "gpt-4"}),
+    (schemas.ChatSettlementCreate, {})
+])
+def test_token_counts_cannot_be_negative(schema, fields):
+    assert schema(input_tokens=0, output_tokens=10, **fields).input_tokens == 0
+    with pytest.raises(ValidationError):
+        schema(input_tokens=-1000000, output_tokens=10, **fields)
+    with pytest.raises(ValidationError):
+        schema(input_tokens=10, output_tokens=-1, **fields)
@@ -0,0 +1,81 @@
+from datetime import date, datetime
+import pytest
+from sqlalchemy import func, select
+from backend.database import models
+from backend.services import reservation_service, reservation_store, usage_service
+from backend.services.reservation_store import MemoryReservationStore
+
+@pytest.fixture
+def store(monkeypatch, clock):
+    store = MemoryReservationStore()
+    monkeypatch.setattr(reservation_store, "_reservation_store", store)
+    monkeypatch.setattr(reservation_service, "_completed", [])
+    return store
+
+@pytest.fixture
+def user_id(db):
+    user = models.User(username="alice", email="alice@example.com", hashed_password="x", credits_micros=10000000)
+    db.add(user)
+    db.commit()
+    return user.id
+
+def settle(store, user_id: int, cost: int, created_at: str = "2024-01-31T23:59:00"):
+    reservation_id = store.reserve(user_id, cost, 10000000, "gpt-4")
+    store.settle(reservation_id, {
+        "user_id": user_id, "model_name": "gpt-4", "input_tokens": 10, "output_tokens": 20,
+        "cost": cost, "created_at": created_at
+    }, 10000000)
+
+def chat_count(db):
+    return db.execute(select(func.count(models.Chat.id))).scalar()
+
+def balance(db, user_id: int):
+    return db.execute(select(models.User.credits_micros).where(models.User.id == user_id)).scalar()
+
+def test_flush_writes_and_acknowledges(db, store, user_id):
+    settle(store, user_id, 1000)
+    settle(store, user_id, 2000)
+    assert reservation_service.flush_settlements(db) == 2
+    assert chat_count(db) == 2
+    assert balance(db, user_id) == 10000000 - 3000
+    assert store.reserved([user_id]) == {}
+
+def test_usage_counts_in_the_month_of_settlement(db, store, user_id):
+    settle(store, user_id, 1000, "2024-01-31T23:59:00")
+    reservation_service.flush_settlements(db)
+    assert db.execute(select(models.UsageRollup.bucket_start)).scalar() == datetime(2024, 1, 1)
+    assert db.execute(select(models.DailyUsage.day)).scalar() == date(2024, 1, 31)
+
+def test_failed_flush_is_retried(db, store, user_id):
+    settle(store, user_id, 1000)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(usage_service, "record_chat_usage", lambda *args, **kwargs: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            reservation_service.flush_settlements(db)
+    assert chat_count(db) == 0
+    assert store.reserved([user_id]) == {user_id: 1000}
+
+    assert reservation_service.flush_settlements(db) == 1
+    assert chat_count(db) == 1
+    assert store.reserved([user_id]) == {}
+
+def test_batch_committed_but_not_acknowledged_is_not_written_twice(db, store, user_id, clock):
+    settle(store, user_id, 1000)
+
+    def crash(batch_id, totals):
+        raise ConnectionError("store unreachable")
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(store, "mark_flushed", crash)
+        with pytest.raises(ConnectionError):
+            reservation_service.flush_settlements(db)
+    assert chat_count(db) == 1
+    # Nothing to take over until the lease runs out
+    assert reservation_service.flush_settlements(db) == 0
+    assert store.reserved([user_id]) == {user_id: 1000}
+
+    clock.advance(reservation_store.SETTLEMENT_LEASE_SECONDS + 1)
+    assert reservation_service.flush_settlements(db) == 0
+    assert chat_count(db) == 1
+    assert balance(db, user_id) == 10000000 - 1000
+    assert store.reserved([user_id]) == {}
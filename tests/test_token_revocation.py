@@ -0,0 +1,61 @@
+from sqlalchemy import func, select
+from backend.database import models
+from backend.services import token_revocation
+from backend.services.principal_cache import Principal, PrincipalCache
+from backend.services.token_revocation import REVOCATION_TTL_SECONDS, RevocationList, prune_revocations
+
+def test_logout_reaches_other_workers(db, clock):
+    worker, other = RevocationList(), RevocationList()
+    other.sync(db)
+    worker.revoke_token(db, "abc")
+    assert worker.is_revoked("abc")
+    assert not other.is_revoked("abc")
+    clock.advance(5)
+    other.sync(db)
+    assert other.is_revoked("abc")
+
+def test_claims_change_reaches_other_workers(db, clock):
+    worker, other = RevocationList(), RevocationList()
+    issued_at = int(clock.now)
+    clock.advance(1)
+    worker.invalidate_claims(db, [1, 2])
+    other.sync(db)
+    assert other.claims_stale(1, issued_at) and other.claims_stale(2, issued_at)
+    assert not other.claims_stale(3, issued_at)
+    clock.advance(1)
+    assert not other.claims_stale(1, int(clock.now))
+
+def test_new_worker_loads_live_revocations(db, clock):
+    RevocationList().revoke_token(db, "old")
+    clock.advance(REVOCATION_TTL_SECONDS + 1)
+    RevocationList().revoke_token(db, "new")
+    worker = RevocationList()
+    worker.sync(db)
+    assert worker.is_revoked("new")
+    assert not worker.is_revoked("old")
+
+def test_rows_pruned_after_token_lifetime(db, clock):
+    RevocationList().revoke_token(db, "abc")
+    assert prune_revocations(db) == 0
+    clock.advance(REVOCATION_TTL_SECONDS + 1)
+    assert prune_revocations(db) == 1
+    db.commit()
+    assert db.execute(select(func.count(models.TokenRevocation.id))).scalar() == 0
+
+def test_synced_claims_change_evicts_the_cached_principal(db, clock, monkeypatch):
+    cache = PrincipalCache()
+    monkeypatch.setattr(token_revocation, "principal_cache", cache)
+    worker, other = RevocationList(), RevocationList()
+    other.sync(db)
+    worker.invalidate_claims(db, [1])
+    # Cached by the other worker before its next poll
+    principal = Principal(id=1, username="alice", role="user", is_active=True, plan_id=None, can_access_vip_models=False)
+    cache.put("alice", principal, cache.version())
+    clock.advance(5)
+    other.sync(db)
+    assert cache.get("alice") is None
+    # Re-reading the same row on the next poll leaves a fresh snapshot alone
+    cache.put("alice", principal, cache.version())
+    clock.advance(1)
+    other.sync(db)
+    assert cache.get("alice") == principal